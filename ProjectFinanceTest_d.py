@@ -15,6 +15,9 @@ import company_tools as ct
 import pandas as pd
 import datetime as dt
 from pandas.tseries.offsets import DateOffset
+import os
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pf_batch_test.xml')
 
 class CapitalProjectTests(unittest.TestCase):
     """Tests for whether the implementation of a capital project is working correctly"""
@@ -773,7 +776,233 @@ class CapitalProjectTests(unittest.TestCase):
         #self.assertAlmostEqual(cap_proj.calcIRR(), 'what')
         #self.assertAlmostEqual(cap_proj.calcNPV(0.25),'what')
 
-    
+
+
+class ResolutionTests(unittest.TestCase):
+    """Tests that the coarser cash sheet grids agree with the daily sheet"""
+
+    def assemble(self, resolution):
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.setResolution(resolution)
+        proj.assembleFinancials(price = (0.7, 'fixed'))
+        return proj
+
+    def testRollUp(self):
+        """Monthly, quarterly, and annual sheets should total to the daily sheet, year by year"""
+        cols = ['Production', 'Sales', 'Revenue', 'Variable_costs', 'Fixed_costs', 'Capital_expenditures', 'Depreciation', 'Taxes', 'Net_cash_flow']
+        daily = self.assemble('D').cf_sheet
+        daily = daily.groupby(daily.index.year).sum()
+        for res in ['M', 'Q', 'A']:
+            sheet = self.assemble(res).cf_sheet
+            sheet = sheet.groupby(sheet.index.year).sum()
+            self.assertEqual(list(sheet.index), list(daily.index))
+            for col in cols:
+                #a row straddling the startup boundary escalates at its period average, hence the absolute tolerance
+                np.testing.assert_allclose(sheet[col], daily[col], rtol = 1E-4, atol = 1E-4*np.abs(daily[col]).max(), err_msg = "%s at %s" % (col, res))
+
+    def testPeriodRates(self):
+        """calcNPV and calcIRR should work in rates per row, which period_rate and annual_rate convert"""
+        daily_irr = self.assemble('D').annual_rate(self.assemble('D').calcIRR())
+        for (res, ppy) in [('D', 365), ('M', 12), ('Q', 4), ('A', 1)]:
+            proj = self.assemble(res)
+            rate = proj.period_rate(0.15)
+            self.assertAlmostEqual((1.0 + rate)**ppy, 1.15, 12)
+            self.assertAlmostEqual(proj.annual_rate(rate), 0.15, 12)
+            #a per-row rate discounts each row by the annual rate over the years since Initial_period
+            check = np.dot(proj.cash_sheet['Net_cash_flow'], 1.15**(-proj.cash_sheet['Period']/365.0))
+            self.assertAlmostEqual(proj.calcNPV(rate)/check, 1.0, 10)
+            irr = proj.calcIRR()
+            self.assertAlmostEqual(proj.calcNPV(irr)/np.abs(proj.cash_sheet['Net_cash_flow']).sum(), 0.0, 10)
+            #a coarse row books its flows at the row's start, so the coarse IRRs only come close
+            self.assertTrue(abs(proj.annual_rate(irr) - daily_irr) < 0.01)
+
+class BatchTests(unittest.TestCase):
+    """Tests for evaluating a project at a sweep of prices in one pass"""
+
+    def testBatchMatchesAssembly(self):
+        """Each row of the batch should match a full assembly at that price, discounted at the annual rate"""
+        prices = [0.5, 0.6, 0.7, 0.9, 1.2]
+        for res in ['D', 'M']:
+            for rate in [None, 0.08]:
+                proj = pf.PF_FileLoader(fixture).load()
+                proj.fin_param['Target_IRR'] = 0.15
+                proj.setResolution(res)
+                table = proj.assembleFinancials_batch(prices, rate = rate, block_size = 2)
+                annual = 0.15 if rate is None else rate
+                for price in prices:
+                    check = pf.PF_FileLoader(fixture).load()
+                    check.setResolution(res)
+                    check.assembleFinancials(price = (price, 'fixed'))
+                    npv = check.calcNPV(check.period_rate(annual))
+                    self.assertAlmostEqual(table['NPV'][price]/npv, 1.0, 9)
+                    self.assertAlmostEqual(table['IRR'][price], check.annual_rate(check.calcIRR()), 9)
+                #the sheet is left at the last price
+                self.assertAlmostEqual(proj.calcNPV(proj.period_rate(annual)), table['NPV'][prices[-1]], 6)
+
+class SolvePriceTests(unittest.TestCase):
+    """Tests for the break-even price solver"""
+
+    def testBreakEvenPrice(self):
+        """The IRR at the solved price should be the annual target, at every resolution"""
+        for res in ['D', 'M', 'Q', 'A']:
+            proj = pf.PF_FileLoader(fixture).load()
+            proj.fin_param['Target_IRR'] = 0.15
+            proj.setResolution(res)
+            price = proj.solve_price()
+            self.assertTrue(0.5 < price < 1.0)
+            self.assertAlmostEqual(proj.annual_rate(proj.calcIRR()), 0.15, 10)
+            self.assertAlmostEqual(proj.calcNPV(proj.period_rate(0.15))/price, 0.0, 6)
+            #an explicit target, warm started from the last price
+            proj.solve_price(target_irr = 0.08)
+            self.assertAlmostEqual(proj.annual_rate(proj.calcIRR()), 0.08, 10)
+            #the sheet is left assembled at the solved price
+            check = pf.PF_FileLoader(fixture).load()
+            check.setResolution(res)
+            check.assembleFinancials(price = (proj._price[0], 'fixed'))
+            self.assertAlmostEqual(check.annual_rate(check.calcIRR()), 0.08, 10)
+
+    def testTaxFloor(self):
+        """With the tax floor, loss rows pay no tax and the solver still reaches the target through the kinks"""
+        for res in ['D', 'Q']:
+            proj = pf.PF_FileLoader(fixture).load()
+            proj.fin_param['Target_IRR'] = 0.15
+            proj.setResolution(res)
+            proportional = proj.solve_price()
+            proj.setTaxFloor(True)
+            price = proj.solve_price()
+            sheet = proj.cash_sheet
+            losses = sheet['Taxable_income'] < 0.0
+            self.assertTrue(losses.any())
+            self.assertTrue((sheet['Taxes'][losses] == 0.0).all())
+            np.testing.assert_allclose(sheet['Taxes'], 0.41*np.maximum(sheet['Taxable_income'], 0.0))
+            #the floored cash flows have more than one IRR, and the target is one of them
+            self.assertAlmostEqual(proj.calcNPV(proj.period_rate(0.15))/price, 0.0, 6)
+            roots = proj.annual_rate(proj._irr.roots(sheet['Net_cash_flow']))
+            self.assertAlmostEqual(np.abs(roots - 0.15).min(), 0.0, 8)
+            #losing the tax shield on the loss rows takes a higher price
+            self.assertTrue(price > proportional)
+
+    def testTaxFloorRecompute(self):
+        """Switching the tax floor should rebuild the taxes on the next recompute"""
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.assembleFinancials(price = (0.7, 'fixed'))
+        self.assertTrue(proj.cash_sheet['Taxes'].min() < 0.0)
+        proj.setTaxFloor(True)
+        self.assertEqual(proj.recompute(), ['other'])
+        self.assertEqual(proj.cash_sheet['Taxes'].min(), 0.0)
+
+class FileLoaderTests(unittest.TestCase):
+    """Tests for loading saved project files into assemblable projects"""
+
+    def testLoadProject(self):
+        """The loaded components should total to the file's costs and the project should assemble"""
+        proj = pf.PF_FileLoader(fixture).load()
+        self.assertEqual(proj.fin_param['Initial_period'], dt.datetime(2012,1,1))
+        self.assertEqual(proj.fin_param['Design_cap'], uv.UnitVal(10000000, 'kg'))
+        self.assertAlmostEqual(proj.capex.c_total_capital(), 2500000*2.0 + 1800000*1.8 + 2375000 + 500000, 6)
+        self.assertAlmostEqual(proj.capex.c_deprec_capital(), 2500000*2.0 + 1800000*1.8 + 2375000, 6)
+        #$0.06/kWh for 1.8 MJ/kg, and $4.05/MMBtu for 40 MJ/kg
+        self.assertAlmostEqual(proj.variable_costs.c_total_VC('kg'), 0.06*0.5 + 4.05*4E7*9.47817120313E-10, 10)
+        self.assertAlmostEqual(proj.fixed_costs.c_total_fixed_costs(), 1685000.0, 6)
+        #a 10 year loan matures 10 calendar years after its start, leap days included, after 120 monthly payments
+        loan = proj.debt.debts[0]
+        self.assertEqual(loan.init_date + loan.term, dt.datetime(2024,1,1))
+        loan.build_debt_schedule()
+        self.assertEqual((loan.schedule['principal_payment'] > 0.0).sum(), 120)
+        proj.assembleFinancials(price = (0.8, 'fixed'))
+        sheet = proj.cash_sheet
+        self.assertEqual(proj.fin_param['Startup_period'], dt.datetime(2014,1,1))
+        self.assertAlmostEqual(sheet['Capital_expenditures'].sum(), 11115000.0, 4)
+        self.assertAlmostEqual(sheet['Depreciation'].sum(), 10615000.0, 4)
+        self.assertAlmostEqual(sheet['Loan_proceeds'].sum(), 4000000.0, 4)
+        self.assertAlmostEqual(sheet['Principal_payments'].sum(), 4000000.0, 4)
+
+    def testItemDepreciation(self):
+        """Each capital item is depreciated by its own type, and the project's schedule is the sum of the items'"""
+        proj = pf.PF_FileLoader(fixture).load()
+        items = proj.capex.direct_capital + proj.capex.indirect_capital
+        self.assertEqual(sorted(set(i.depreciation_type for i in items)), ['MACRS', 'NonDepreciable'])
+        proj.capex.direct_capital[0].set_depreciation_type('StraightLine')
+        proj.capex.build_project_depreciation_schedule(dt.datetime(2014,1,1), 7)
+        sched = proj.capex.depreciation_schedule['depreciation']
+        self.assertAlmostEqual(sched.sum(), 10615000.0, 4)
+        #the gasifier is written off evenly over the 2557 days of 2014-2020, the rest by the 7 year MACRS table
+        self.assertAlmostEqual(sched[sched.index.year == 2014].sum(), 5615000.0*0.1429 + 5000000.0*365/2557, 4)
+        self.assertAlmostEqual(sched[sched.index.year == 2021].sum(), 5615000.0*0.0446, 4)
+
+    def testLoadOlderFiles(self):
+        """Older files with the annual-era parameter names should load, and fail on assembly only where they are underspecified"""
+        for name in ['proj_fin_test.xml', 'test_pf_save.xml']:
+            proj = pf.PF_FileLoader(name).load()
+            proj.assembleFinancials(price = (2.0, 'fixed'))
+            self.assertTrue(np.isfinite(proj.calcNPV(proj.period_rate(0.15))))
+        proj = pf.PF_FileLoader('save_test.xml').load()
+        self.assertEqual(proj.fin_param['Initial_period'], dt.datetime(2012,1,1))
+        self.assertRaises(pf.UnderspecifiedError, proj.assembleFinancials, (2.0, 'fixed'))
+
+class RecomputeTests(unittest.TestCase):
+    """Incremental recomputes should give the same sheet as a full assembly"""
+
+    def assertSameSheet(self, proj, edit):
+        #edit is applied to a fresh copy of the project, which is then assembled from scratch
+        check = pf.PF_FileLoader(fixture).load()
+        edit(check)
+        check.assembleFinancials((0.8, 'fixed'))
+        np.testing.assert_allclose(proj.cash_sheet.block, check.cash_sheet.block, rtol = 1E-12, atol = 1E-6)
+
+    def testParameterEdits(self):
+        """Changing financial parameters should rebuild just their stages, and match a full assembly"""
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.assembleFinancials((0.8, 'fixed'))
+        def edit(p):
+            p.fin_param['Inflation_rate'] = 0.03
+            p.fin_param['Federal_tax_rate'] = 0.21
+            p.fin_param['Startup_fixed_cost_breakdown'] = 0.5
+        edit(proj)
+        self.assertEqual(proj.recompute(), ['prices', 'revenue', 'variable', 'fixed', 'other'])
+        self.assertSameSheet(proj, edit)
+
+    def testComponentEdits(self):
+        """Setting an attribute of an item inside a component should rebuild the stage that reads it, and match a full assembly"""
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.assembleFinancials((0.8, 'fixed'))
+        def edit(p):
+            p.capex.direct_capital[0].quote_basis.base_price = 3000000.0
+            p.variable_costs.variable_costs[1].quote_basis.base_price = 5.0
+            p.fixed_costs.fixed_costs[0].quote_basis.base_price = 900000.0
+            p.debt.debts[0].rate = 0.09
+        edit(proj)
+        self.assertEqual(proj.recompute(), ['capex', 'output', 'revenue', 'variable', 'fixed', 'debt', 'other'])
+        self.assertSameSheet(proj, edit)
+
+        #each item marks only its own stage
+        proj.debt.debts[0].rate = 0.07
+        self.assertEqual(proj.recompute(), ['debt', 'other'])
+        proj.capex.direct_capital[1].quote_basis.install_model.factor = 2.0
+        self.assertEqual(proj.recompute(), ['capex', 'output', 'revenue', 'variable', 'fixed', 'other'])
+
+        #replaced parts are no longer watched
+        old_quote = proj.fixed_costs.fixed_costs[1].quote_basis
+        proj.fixed_costs.fixed_costs[1].quote_basis = pf.FixedExpenseQuoteBasis(base_price = 300000.0, date = dt.datetime(2012,1,1), size_basis = uv.UnitVal(10000000, 'kg'), freq = 'A')
+        self.assertEqual(proj.recompute(), ['fixed', 'other'])
+        old_quote.base_price = 1.0
+        old_fc = proj.fixed_costs
+        proj.setFixedCosts(pf.PF_FileLoader(fixture).load().fixed_costs)
+        self.assertEqual(proj.recompute(), ['fixed', 'other'])
+        old_fc.fixed_costs[0].quote_basis.base_price = 1.0
+        self.assertEqual(proj.recompute(), [])
+
+    def testTouch(self):
+        """touch rebuilds a component after an in-place edit the setters cannot see"""
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.assembleFinancials((0.8, 'fixed'))
+        proj.capex.indirect_capital.pop()
+        self.assertEqual(proj.recompute(), [])
+        proj.touch(proj.capex)
+        self.assertEqual(proj.recompute(), ['capex', 'output', 'revenue', 'variable', 'fixed', 'other'])
+        self.assertSameSheet(proj, lambda p: p.capex.indirect_capital.pop())
+        self.assertRaises(pf.ProjFinError, proj.touch, proj.fin_param)
+
 
 class FinancialParametersTests(unittest.TestCase):
     """All of the test cases for the Financial Parameters class"""
@@ -825,6 +1054,17 @@ class FinancialParametersTests(unittest.TestCase):
         fp['Initial_period'] = None
         self.assertEqual(fp.is_incomplete(), True)
 
+    def testRevisions(self):
+        """Every assignment should bump the revision of that key only"""
+        fp = pf.FinancialParameters()
+        self.assertEqual(fp.revisions, {})
+        fp['Inflation_rate'] = 0.02
+        fp['Inflation_rate'] = 0.03
+        fp['Target_IRR'] = 0.15
+        self.assertEqual(fp.revisions, {'Inflation_rate':2, 'Target_IRR':1})
+        self.assertRaises(pf.ProjFinError, fp.__setitem__, 'Inflation_rate', 'shwee-bang')
+        self.assertEqual(fp.revisions['Inflation_rate'], 2)
+
 
 
 class CapitalExpenseTests(unittest.TestCase):
@@ -14,7 +14,12 @@ import pandas.tseries.offsets as offs
 from pandas.tseries.offsets import DateOffset
 from pf_errors import *
 import dataFrame_pd as df
-from collections import deque
+import cash_sheet as cs
+import schedule_tools as st
+import tax_tools as tt
+from irr import IRRSolver
+import profiling
+from profiling import profiled
 
 
 class ProjAnalyzer:
@@ -22,9 +27,68 @@ class ProjAnalyzer:
     def __init__(self):
        pass #Doesn't do anything yet...
 
+
+class Watched(object):
+    """Base class for the parts of a project's components -- the cost containers, their items, quote bases, and loans.
+
+    Setting an attribute tells the objects watching the part that it changed, and they pass that on until it reaches the
+    CapitalProject, which marks the stage that reads the component as dirty.  A part watches any Watched value set on it,
+    and a container watches the items added to it."""
+
+    def __setattr__(self, name, value):
+        old = self.__dict__.get(name)
+        object.__setattr__(self, name, value)
+        if old is not value:
+            if isinstance(old, Watched):
+                old.unwatch(self)
+            if isinstance(value, Watched):
+                value.watch(self)
+        self.changed()
+
+    def watch(self, watcher):
+        """Adds watcher (anything with a changed method) to the objects told about changes to this one"""
+        watchers = self.__dict__.setdefault('_watchers', [])
+        if not any(w is watcher for w in watchers):
+            watchers.append(watcher)
+
+    def unwatch(self, watcher):
+        self.__dict__['_watchers'] = [w for w in self.__dict__.get('_watchers', []) if w is not watcher]
+
+    def changed(self):
+        """Tells the watchers that this part changed -- called by the setters, and by hand after an in-place edit"""
+        for w in self.__dict__.get('_watchers', []):
+            w.changed()
+
+
+class _StageWatcher(object):
+    """Watches one of a CapitalProject's components and marks the stage that reads it as dirty"""
+
+    def __init__(self, project, stage):
+        self.project = project
+        self.stage = stage
+
+    def changed(self):
+        self.project._dirty.add(self.stage)
+
+
 class CapitalProject:
     """Main class that holds a single capital project"""
-    def __init__(self):
+
+    #The assembly stages, in the order they have to run, and the stages that read each one's columns
+    stage_order = ['capex', 'output', 'prices', 'revenue', 'variable', 'fixed', 'debt', 'other']
+    stage_methods = {'sheet':'_initialize_cash_sheet', 'capex':'_calcCapitalCosts', 'output':'setAnnualOutput', 'prices':'_repeatPrices', 'revenue':'setRevenue', 'variable':'_calcVariableCosts', 'fixed':'_calcFixedCosts', 'debt':'_calcDebt', 'other':'setOtherFinancials'}
+    downstream = {'capex':['output', 'revenue', 'fixed', 'other'], 'output':['revenue', 'variable'], 'prices':['revenue'], 'revenue':['other'], 'variable':['other'], 'fixed':['other'], 'debt':['other'], 'other':[]}
+    #The stages that read each financial parameter directly; 'sheet' means the whole cash sheet has to be rebuilt.  Depreciation_type
+    #is only read by the file loader -- each capital item carries its own depreciation_type.
+    sheet_params = ['Initial_period', 'Analysis_period']
+    param_stages = {'Initial_period':['sheet'], 'Analysis_period':['sheet'], 'Startup_period':['output', 'revenue', 'fixed', 'other'], 'Target_IRR':[], 'Depreciation_type':[], 'Depreciation_length':['capex'], 'Plant_life':['output', 'revenue', 'other'], 'Inflation_rate':['prices', 'variable', 'fixed'], 'State_tax_rate':['other'], 'Federal_tax_rate':['other'], 'Design_cap':['output', 'variable'], 'Cap_factor':['output'], 'Capital_expense_breakdown':['capex'], 'Startup_revenue_breakdown':['output'], 'Startup_fixed_cost_breakdown':['fixed'], 'Startup_variable_cost_breakdown':['variable'], 'Salvage_value':['revenue'], 'Decommissioning_cost':['other']}
+
+    #Period lengths for the cash sheet grid; every grid is anchored on Initial_period
+    resolutions = {'D':('days', 1), 'M':('months', 1), 'Q':('months', 3), 'A':('years', 1)}
+    #Nominal rows per year at each resolution; rates passed to calcNPV and returned by calcIRR are per row
+    periods_per_year = {'D':365, 'M':12, 'Q':4, 'A':1}
+
+    def __init__(self, resolution = 'D', tax_floor = False):
         #if not isinstance(financial_parameters, FinancialParameters):
         #    raise ProjFinError, "financial_parameters MUST be a FinancialParameters object"
 
@@ -40,14 +104,32 @@ class CapitalProject:
         #self.variable_costs	:	Variable costs object for the project simulation
         #self.debt		:	Debt financing vehicles for the project; any cash not in by loans is assumed to be equity
         #self.check_bits	:	These ensure that things are done in the proper order -- will eventually used only internally for QC/QA
+        #self.resolution	:	Period of the cash sheet rows -- 'D'aily, 'M'onthly, 'Q'uarterly, or 'A'nnual
+        #self.tax_floor		:	If True, rows with negative taxable income pay no tax instead of a negative tax
 
         self.capex = None
         self.fixed_costs = None
         self.variable_costs = None
         self.debt = None
 
+        if resolution not in CapitalProject.resolutions:
+            raise ProjFinError, "%s is not a recognized resolution; use one of %s" % (resolution, sorted(CapitalProject.resolutions.keys()))
+        self.resolution = resolution
+        self.tax_floor = tax_floor
+
         self.fin_param = None
         self.check_bits = [False, False, False, False, False]	#Fin_param, capex, fixed, variable, debt all MUST be set before analysis can proceed
+        self._solved_price = None				#last break-even price, used to warm start solve_price
+
+        #Incremental recalculation bookkeeping -- see recompute
+        self._dirty = set(CapitalProject.stage_order)
+        self._stage_watchers = dict((stage, _StageWatcher(self, stage)) for stage in ['capex', 'variable', 'fixed', 'debt'])
+        self._seen_revisions = {}
+        self._price = None
+
+        #Stage and line item timings -- see enable_profiling
+        self.profiler = profiling.null_profiler
+        self.profile_report = None
 
     def setFinancialParameters(self, financial_parameters):
         if not isinstance(financial_parameters, FinancialParameters):
@@ -55,6 +137,7 @@ class CapitalProject:
 
         #Doing it this way allows one to save those parameters that are set, but not to run the analysis
         self.fin_param = financial_parameters
+        self._dirty.update(CapitalProject.stage_order)
 
         if financial_parameters.is_incomplete():
             return
@@ -64,27 +147,271 @@ class CapitalProject:
             self.check_bits[0] = True
 
 
+    def setResolution(self, resolution):
+        """Changes the period of the cash sheet rows; the sheet is rebuilt on the new grid"""
+        if resolution not in CapitalProject.resolutions:
+            raise ProjFinError, "%s is not a recognized resolution; use one of %s" % (resolution, sorted(CapitalProject.resolutions.keys()))
+        self.resolution = resolution
+        if self.check_bits[0]:
+            self._initialize_cash_sheet()
+
+    def setTaxFloor(self, tax_floor):
+        """Turns the floor on taxes at zero on or off"""
+        self.tax_floor = tax_floor
+        self._dirty.add('other')
+
     def _initialize_cash_sheet(self):
-        #The main cash sheet is performed daily.  I will write functions to do annual, quarterly, and monthly roll-ups.
+        #The cash sheet covers every day from Initial_period through the end of the analysis period, in rows of the chosen resolution.
+        #Period holds the day offset of the start of each row, so discounting and escalation work the same way on any grid.
         ip = self.fin_param['Initial_period']				#This must be a datetime object for this to work -- this assignment may be unnecessary
-        dates = pd.date_range(ip, end = ip + self.fin_param['Analysis_period']*DateOffset(years=1), freq = 'D')
-        count = {'Period':np.arange(len(dates))}
-        self.cf_sheet = df.DataFrame(data = count, index = dates)
+        end = ip + self.fin_param['Analysis_period']*DateOffset(years=1) + DateOffset(days=1)
+        if self.resolution == 'D':
+            dates = pd.date_range(ip, end = end - DateOffset(days=1), freq = 'D')
+        else:
+            #Offset each start from ip directly, so month-end anchors don't drift (Jan 31, Feb 29, Mar 31, ...)
+            (unit, n) = CapitalProject.resolutions[self.resolution]
+            dates = [ip]
+            while dates[-1] < end:
+                dates.append(ip + DateOffset(**{unit:len(dates)*n}))
+            dates = pd.DatetimeIndex(dates[:-1])
+        #All of the columns live in one preallocated block; cf_sheet is a DataFrame view onto it, so it never needs to be rebuilt
+        self.cash_sheet = cs.CashSheet(dates, end = end)
+        self.calendar = st.DayCalendar(ip)				#day offsets from Initial_period, for laying out the component schedules
+        self.cash_sheet['Period'] = (dates - ip).days
+        for key in CapitalProject.sheet_params:
+            self._seen_revisions[key] = self.fin_param.revisions.get(key)
+        self.cf_sheet = self.cash_sheet.frame()
+        self._dirty.update(CapitalProject.stage_order)
+        #Discount on the day offsets counted in nominal periods, so a per-period rate compounds to the same annual rate at any resolution
+        self._irr = IRRSolver(self.cash_sheet['Period']*CapitalProject.periods_per_year[self.resolution]/365.0)
+        self._esc = np.empty(len(dates))
+        self._esc_rate = None
+
+    def _escalation(self):
+        """Returns the inflation factor for each row of the sheet (the average daily factor over each period); only recalculated when the inflation rate changes"""
+        rate = self.fin_param['Inflation_rate']
+        if rate != self._esc_rate:
+            self._escalation_factors(np.array([rate]), out = self._esc.reshape(1, -1))
+            self._esc_rate = rate
+        return self._esc
+
+    def _escalation_factors(self, rates, out = None):
+        """Returns a (rates x rows) array of inflation factors, one row of factors for each annual inflation rate"""
+        daily_rate = np.power(1+np.asarray(rates, dtype = float), 1.0/365.0) - 1.0  #explictly ignores leap years (which should have a slightly higher inflation price)
+        out = np.power(1+daily_rate[:,np.newaxis], self.cash_sheet['Period'], out = out)
+        if self.resolution != 'D':
+            #Geometric series over the days of each period:  sum(g^k, k < n)/n = (g^n - 1)/(n*(g - 1))
+            n = self.cash_sheet.days
+            for i in np.where(daily_rate != 0.0)[0]:
+                out[i] *= np.expm1(n*np.log1p(daily_rate[i]))/(n*daily_rate[i])
+        return out
 
     def assembleFinancials(self, price):
         """Put together the financials for a given selling price of the product"""
         #Currently, price is in the format (price, mode) where price is the price in the first year, and mode is the mode of inflation -- this stuff should be coded into financial parameters!
         if False in self.check_bits:
             raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"        
-        
+        self._price = tuple(price)
+        stages = list(CapitalProject.stage_order)
+        if 'sheet' in self._stale_stages():
+            stages.insert(0, 'sheet')
+        self._run_stages(stages)
+
+    def recompute(self, price = None):
+        """Rebuilds only the stages whose inputs changed since the last assembly, plus everything downstream of them.  Returns the stages that were run."""
+        #price is the same (price, mode) pair as assembleFinancials; by default the last price is reused
+        if False in self.check_bits:
+            raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"
+        if price is not None and tuple(price) != self._price:
+            self._price = tuple(price)
+            self._dirty.add('prices')
+        if self._price is None:
+            raise ProjFinError, "There is no selling price yet -- give recompute a price or call assembleFinancials first"
+
+        stale = self._stale_stages()
+        if 'sheet' in stale:
+            stale.update(CapitalProject.stage_order)
+        run = [stage for stage in ['sheet'] + CapitalProject.stage_order if stage in stale]
+        self._run_stages(run)
+        return run
+
+    def _run_stages(self, stages):
+        """Runs the given stages in order, then marks the project clean; each stage is timed when profiling is on"""
+        prof = self.profiler
+        with prof.session():
+            for stage in stages:
+                with prof.stage(stage):
+                    getattr(self, CapitalProject.stage_methods[stage])()
+        self._mark_clean()
+        self.profile_report = prof.report()
+
+    def enable_profiling(self, track_memory = False):
+        """Records the wall time, calls, and (with track_memory) net bytes allocated of each stage and line item build from
+        here on; profile_report holds the running totals after every assembly"""
+        self.profiler = profiling.Profiler(track_memory = track_memory)
+        self.profile_report = None
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = profiling.null_profiler
+        self.profile_report = None
+
+    def touch(self, component):
+        """Marks the stages that read component as needing a rebuild.  Setting an attribute of a component, or of anything held
+        inside one, does this by itself; touch is for in-place edits the setters cannot see, such as changing a list or a frame."""
+        if not isinstance(component, Watched):
+            raise ProjFinError, "%s is not a project component" % component
+        component.changed()
+
+    def _set_component(self, member, component, stage):
+        """Sets a component and watches it for changes in place of the one it replaces"""
+        old = getattr(self, member)
+        if isinstance(old, Watched):
+            old.unwatch(self._stage_watchers[stage])
+        setattr(self, member, component)
+        component.watch(self._stage_watchers[stage])
+        self._dirty.add(stage)
+
+    def _stale_stages(self):
+        """Collects the dirty stages and the stages of any changed financial parameters, then closes the set over downstream stages"""
+        stale = set(self._dirty)
+        for key, rev in self.fin_param.revisions.items():
+            if self._seen_revisions.get(key) != rev:
+                stale.update(CapitalProject.param_stages[key])
+        todo = list(stale)
+        while todo:
+            for stage in CapitalProject.downstream.get(todo.pop(), []):
+                if stage not in stale:
+                    stale.add(stage)
+                    todo.append(stage)
+        return stale
+
+    def _mark_clean(self):
+        self._dirty.clear()
+        self._seen_revisions = dict(self.fin_param.revisions)
+
+    def _repeatPrices(self):
+        self.setPrices(self._price[0], self._price[1])
+
+    def assembleFinancials_batch(self, prices, mode = "fixed", rate = None, block_size = 100):
+        """Evaluates the project at a whole set of base selling prices in one pass; returns a DataFrame of NPV and IRR indexed by price.
+        rate is the annual discount rate for the NPV (Target_IRR by default), and the IRR is annual too."""
+        #Capex, output, variable and fixed costs, and debt do not depend on the selling price, so they are only built once.
+        #Every price-dependent column is affine in the base price, so those are broadcast over a (price x day) array, block_size prices at a time.
+        if False in self.check_bits:
+            raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"
+        if mode != "fixed":
+            raise ProjFinError, "Batch evaluation only supports the 'fixed' inflation mode, got %s" % mode
+        prices = np.atleast_1d(np.asarray(prices, dtype = float))
+        if prices.ndim != 1 or len(prices) == 0:
+            raise ProjFinError, "prices must be a one-dimensional sequence of base prices"
+        if rate is None:
+            rate = self.fin_param['Target_IRR']
+        if 'sheet' in self._stale_stages():
+            self._initialize_cash_sheet()
+
         self._calcCapitalCosts()
         self.setAnnualOutput()
-        self.setPrices(price[0], price[1])
+        self._calcVariableCosts()
+        self._calcFixedCosts()
+        self._calcDebt()
+        #At a zero price, Taxable_income and Net_cash_flow hold the price-independent part of each column
+        self.setPrices(0.0, mode)
         self.setRevenue()
+        self.setOtherFinancials()
+
+        sheet = self.cash_sheet
+        disc = self._discount_factors(self.period_rate(rate))
+        pretax_flow = sheet['Net_cash_flow'] + sheet['Taxes']		#net cash flow before taxes at a zero price
+        n = min(block_size, len(prices))
+        sales_price = np.empty((n, len(sheet)))
+        sales = np.empty_like(sales_price)
+        revenue = np.empty_like(sales_price)
+        taxes = np.empty_like(sales_price)
+        ncf = np.empty_like(sales_price)
+        npv = np.empty(len(prices))
+        irr = np.empty(len(prices))
+
+        for start in range(0, len(prices), n):
+            p = prices[start:start+n]
+            m = len(p)
+            np.multiply(p[:,np.newaxis], self._escalation(), out = sales_price[:m])
+            np.multiply(sales_price[:m], sheet['Production'], out = sales[:m])
+            np.add(sales[:m], sheet['Salvage'], out = revenue[:m])
+            #Every dollar of sales goes straight through to taxable income
+            np.add(sales[:m], sheet['Taxable_income'], out = taxes[:m])
+            self._calcTaxes(taxes[:m], out = taxes[:m])
+            np.subtract(sales[:m], taxes[:m], out = ncf[:m])
+            ncf[:m] += pretax_flow
+            np.dot(ncf[:m], disc, out = npv[start:start+m])
+            irr[start:start+m] = self.annual_rate(self._irr.solve(ncf[:m]))
+
+        #Leave the sheet holding the last price in the sweep, as assembleFinancials would
+        self.setPrices(prices[-1], mode)
+        self.setRevenue()
+        self.setOtherFinancials()
+        self._mark_clean()
+
+        return df.DataFrame({'NPV':npv, 'IRR':irr}, index = pd.Index(prices, name = 'price'), columns = ['NPV', 'IRR'])
+
+    def solve_price(self, target_irr = None, mode = "fixed", max_iter = 50):
+        """Returns the base selling price at which the project IRR equals the annual rate target_irr (Target_IRR by default), leaving the sheet assembled at that price"""
+        #Pre-tax cash flow is affine in the base price:  flow(p) = pretax_flow + p*unit_sales.  Taxes are piecewise linear in taxable income,
+        #so while the marginal tax rates are fixed NPV(p) is linear and its root can be solved for directly.  We re-solve until the marginal
+        #rates stop changing -- one pass for a purely proportional tax.  With the tax floor, taxes are convex in the price, so NPV(p) is concave
+        #and the steps close in on the root from below after the first one.  The last solved price is used as the starting point next time.
+        if False in self.check_bits:
+            raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"
+        if mode != "fixed":
+            raise ProjFinError, "The price solver only supports the 'fixed' inflation mode, got %s" % mode
+        if target_irr is None:
+            target_irr = self.fin_param['Target_IRR']
+        if 'sheet' in self._stale_stages():
+            self._initialize_cash_sheet()
+
+        self._calcCapitalCosts()
+        self.setAnnualOutput()
         self._calcVariableCosts()
         self._calcFixedCosts()
         self._calcDebt()
+        self.setPrices(0.0, mode)
+        self.setRevenue()
         self.setOtherFinancials()
+
+        sheet = self.cash_sheet
+        disc = self._discount_factors(self.period_rate(target_irr))
+        unit_sales = sheet['Production'] * self._escalation()		#sales per unit of base price
+        pretax_flow = sheet['Net_cash_flow'] + sheet['Taxes']
+        taxable = np.empty(len(sheet))
+        flow = np.empty(len(sheet))
+
+        price = self._solved_price if self._solved_price is not None else 0.0
+        slope = None
+        for N in range(max_iter):
+            np.multiply(unit_sales, price, out = taxable)
+            taxable += sheet['Taxable_income']
+            new_slope = self._tax_slope(taxable)
+            if slope is not None and np.array_equal(new_slope, slope):
+                break
+            slope = new_slope
+
+            #NPV at the current price, and its (constant) derivative on this linear piece
+            np.multiply(unit_sales, price, out = flow)
+            flow += pretax_flow
+            flow -= self._calcTaxes(taxable)
+            dnpv = np.dot(unit_sales * (1.0 - slope), disc)
+            if dnpv <= 0.0:
+                raise ProjFinError, "The project NPV does not increase with price, so there is no break-even price"
+            price -= np.dot(flow, disc)/dnpv
+        else:
+            raise ProjFinError, "The break-even price did not converge in %s iterations" % max_iter
+
+        self._solved_price = price
+        self.setPrices(price, mode)
+        self.setRevenue()
+        self.setOtherFinancials()
+        self._mark_clean()
+        return price
         
 
     def rollUpMonthly(self):
@@ -136,26 +463,53 @@ class CapitalProject:
                 raise ProjFinError, "Well, shit.  You tried to open a file that you aren't allowed to.  Don't do that."
 
 
-    ###FIX THESE###
+    def period_rate(self, annual_rate):
+        """Converts an annual rate (Target_IRR, for one) to the equivalent compound rate per row of the sheet"""
+        return (1.0 + annual_rate)**(1.0/CapitalProject.periods_per_year[self.resolution]) - 1.0
+
+    def annual_rate(self, period_rate):
+        """Converts a rate per row of the sheet (calcIRR, for one) to the equivalent annual rate"""
+        return (1.0 + period_rate)**CapitalProject.periods_per_year[self.resolution] - 1.0
+
     def calcIRR(self):
         """Returns the IRR for the given cash flow of the project"""
-        #Find the root of the NPV function
-        return spo.brentq(self.calcNPV,0.001,1.0)
+        #The rate is per row of the sheet, as in calcNPV -- annual_rate converts it
+        rate = self._irr.solve(self.cash_sheet['Net_cash_flow'])
+        if np.isnan(rate):
+            raise NoIRRError, "The project cash flows do not have an IRR"
+        return rate
     
     def calcNPV(self, rate):
-        """Returns the NPV for the given cash flow of the project"""
+        """Returns the NPV for the given cash flow of the project at a rate per row of the sheet -- see period_rate"""
         
-        return sum(self.cf_sheet['Net_cash_flow']/np.power(1+rate,self.cf_sheet['Period']))
-    ###END FIX###
+        return np.dot(self.cash_sheet['Net_cash_flow'], self._discount_factors(rate))
+
+    def calcPeakDebt(self):
+        """Returns the largest outstanding loan principal over the life of the project"""
+        outstanding = np.cumsum(self.cash_sheet['Loan_proceeds'] - self.cash_sheet['Principal_payments'])
+        return max(outstanding.max(), 0.0)
+
+    def calcPayback(self):
+        """Returns the payback period in years from Initial_period -- when the cumulative net cash flow turns non-negative for good; None if it never does"""
+        cumulative = np.cumsum(self.cash_sheet['Net_cash_flow'])
+        negative = np.where(cumulative < 0.0)[0]
+        if len(negative) == 0:
+            return 0.0
+        if negative[-1] == len(cumulative) - 1:
+            return None
+        return self.cash_sheet['Period'][negative[-1] + 1]/365.0
+
+    def _discount_factors(self, rate):
+        """Returns the discount factor for each row of the sheet at the given rate"""
+        return self._irr.discount(rate)
 
     def setPrices(self, base_price, mode, inflation_dict = None):
         """Creates the price inflation schedule we expect to see"""
         #INCOMPLETE!
+        self._price = (base_price, mode)
         if mode == "fixed":
-            #create the daily periodic inflation rate from the indicated annual rate
-            daily_rate = np.power(1+self.fin_param['Inflation_rate'], 1.0/365.0) - 1.0  #explictly ignores leap years (which should have a slightly higher inflation price)
-            print daily_rate
-            self.cf_sheet['Sales_price'] = np.ones(len(self.cf_sheet))*base_price*np.power(1+daily_rate,self.cf_sheet['Period'])
+            #escalate the base price at the daily periodic inflation rate
+            np.multiply(self._escalation(), base_price, out = self.cash_sheet['Sales_price'])
             
 
         elif mode == "pre-set":
@@ -167,37 +521,38 @@ class CapitalProject:
 
     def setAnnualOutput(self):
         """Creates the annual output column for production level, adjusted for startup considerations"""
-        output = df.DataFrame(np.zeros(len(self.cf_sheet)), index = self.cf_sheet.index)
+        output = self.cash_sheet['Production']
         ann_out = self.fin_param['Cap_factor'] * self.fin_param['Design_cap'].value
         daily_out = ann_out/365.0		
-        end_period = self.fin_param['Startup_period'] + self.fin_param['Plant_life']*DateOffset(years=1)
-        output[self.fin_param['Startup_period']:self.fin_param['Startup_period']+DateOffset(years=1)] = self.fin_param['Startup_revenue_breakdown']*daily_out
-        output[self.fin_param['Startup_period']+DateOffset(years=1):end_period] = daily_out
-
-        
-        self.cf_sheet['Production'] = output
+        startup = self.fin_param['Startup_period']
+        end_period = startup + self.fin_param['Plant_life']*DateOffset(years=1)
+        #Count the days of each row in the startup year and at full output (the last day of plant life included), then scale
+        np.multiply(self.cash_sheet.overlap(startup, startup+DateOffset(years=1)), self.fin_param['Startup_revenue_breakdown'], out = output)
+        output += self.cash_sheet.overlap(startup+DateOffset(years=1), end_period+DateOffset(days=1))
+        output *= daily_out
         
 
 
 
     def setRevenue(self):
         """Creates the sales, salvage, and revenues columns"""
-        self.cf_sheet['Sales'] = self.cf_sheet['Production'] * self.cf_sheet['Sales_price']
-        self.cf_sheet['Salvage'] = np.zeros(len(self.cf_sheet))
+        sheet = self.cash_sheet
+        np.multiply(sheet['Production'], sheet['Sales_price'], out = sheet['Sales'])
+        sheet['Salvage'].fill(0.0)
         
         try:
-            self.cf_sheet['Salvage'][self.fin_param['Startup_period']+self.fin_param['Plant_life']*DateOffset(years=1)] = self.fin_param['Salvage_value']
+            sheet['Salvage'][sheet.position(self.fin_param['Startup_period']+self.fin_param['Plant_life']*DateOffset(years=1))] = self.fin_param['Salvage_value']
         except KeyError:
             pass
         
         
-        self.cf_sheet['Revenue'] = self.cf_sheet['Sales'] + self.cf_sheet['Salvage']
+        np.add(sheet['Sales'], sheet['Salvage'], out = sheet['Revenue'])
 
     def setCapitalCosts(self, capex):
         """Creates the capital cost data member.  Calculates the startup year.  Creates the capital expenditure and depreciation columns."""
         if not isinstance(capex, CapitalCosts):
             raise ProjFinError, "'capex' MUST be an instance of CapitalCosts"
-        self.capex = capex
+        self._set_component('capex', capex, 'capex')
         self.check_bits[1] = True
 
     def _calcCapitalCosts(self):
@@ -205,17 +560,15 @@ class CapitalProject:
         if self.capex is None:
             raise ProjFinError, "You must set the capital costs before you can calculate them"
         
-        self.fin_param['Startup_period'] = self.capex.build_capex_schedule(self.fin_param['Initial_period'], self.fin_param['Capital_expense_breakdown'])
-        
-        self.capex.build_depreciation_schedule(starting_period = self.fin_param['Startup_period'], length = self.fin_param['Depreciation_length'], method = self.fin_param['Depreciation_type'])
+        self.fin_param['Startup_period'] = self.capex.build_project_capex_schedule(self.fin_param['Initial_period'], self.fin_param['Capital_expense_breakdown'])
         
-        #Set up the columns in the cashflow sheet to be the proper length
-        self.cf_sheet['Capital_expenditures'] = np.zeros(len(self.cf_sheet))
-        self.cf_sheet['Depreciation'] = np.zeros(len(self.cf_sheet))
+        self.capex.build_project_depreciation_schedule(starting_period = self.fin_param['Startup_period'], length = self.fin_param['Depreciation_length'])
         
-        #Fill the columns by year matching
-        self.cf_sheet['Capital_expenditures'] = (self.cf_sheet['Capital_expenditures'] + self.capex.capex_schedule['capex']).fillna(0)
-        self.cf_sheet['Depreciation'] = (self.cf_sheet['Depreciation'] + self.capex.depreciation_schedule['depreciation']).fillna(0)
+        #Clear the columns, then fill them by date matching
+        self.cash_sheet['Capital_expenditures'].fill(0.0)
+        self.cash_sheet['Depreciation'].fill(0.0)
+        self.cash_sheet.add_series('Capital_expenditures', self.capex.capex_schedule['capex'])
+        self.cash_sheet.add_series('Depreciation', self.capex.depreciation_schedule['depreciation'])
             
           
 
@@ -223,19 +576,20 @@ class CapitalProject:
         if not isinstance(VC, VariableCosts):
             raise ProjFinError, "VC must be a VariableCosts object"
 
-        self.variable_costs = VC
+        self._set_component('variable_costs', VC, 'variable')
         self.check_bits[3] = True
 
     def _calcVariableCosts(self):
         if self.variable_costs is None:
             raise ProjFinError, "You must set the variable costs before you can calculate them"
-        daily_rate = np.power(1+self.fin_param['Inflation_rate'], 1.0/365.0) - 1.0
-        self.cf_sheet['Variable_costs'] = np.ones(len(self.cf_sheet))*self.variable_costs.c_total_VC(self.fin_param['Design_cap'].units)*self.cf_sheet['Production']*np.power(1+daily_rate,self.cf_sheet['Period'])
+        vc = self.cash_sheet['Variable_costs']
+        np.multiply(self.cash_sheet['Production'], self.variable_costs.c_total_VC(self.fin_param['Design_cap'].units), out = vc)
+        vc *= self._escalation()
 
     def setFixedCosts(self, FC):
         if not isinstance(FC, FixedCosts):
             raise ProjFinError, "FC must be a FixedCosts object"
-        self.fixed_costs = FC
+        self._set_component('fixed_costs', FC, 'fixed')
         self.check_bits[2] = True
 
     def _calcFixedCosts(self):
@@ -243,20 +597,19 @@ class CapitalProject:
             raise ProjFinError, "You must set the fixed costs before you can calculate them"
 
         total = self.fixed_costs.c_total_fixed_costs()/365		#The fixed cost settings are on an annual basis
-        mask = df.DataFrame(data = np.zeros(len(self.cf_sheet)), index = self.cf_sheet.index)
+        #Build the startup mask directly in the column, then scale it in place
+        fc = self.cash_sheet['Fixed_costs']
         #Could easily generalize for a startup length here
-        mask[self.fin_param['Startup_period']:self.fin_param['Startup_period']+DateOffset(years=1)] = self.fin_param['Startup_fixed_cost_breakdown']
-        mask[self.fin_param['Startup_period']+DateOffset(years=1):] = 1.0
-  
-
-        daily_rate = np.power(1+self.fin_param['Inflation_rate'], 1.0/365.0) - 1.0
-        self.cf_sheet['Fixed_costs'] = np.ones(len(self.cf_sheet))*total*np.power(1+daily_rate,self.cf_sheet['Period'])*mask
+        np.multiply(self.cash_sheet.overlap(self.fin_param['Startup_period'], self.fin_param['Startup_period']+DateOffset(years=1)), self.fin_param['Startup_fixed_cost_breakdown'], out = fc)
+        fc += self.cash_sheet.overlap(self.fin_param['Startup_period']+DateOffset(years=1))
+        fc *= total
+        fc *= self._escalation()
 
     def setDebt(self, debt_pf):
         if not isinstance(debt_pf, DebtPortfolio):
             raise ProjFinError, "debt_pf must be a DebtPortfolio object"
 
-        self.debt = debt_pf
+        self._set_component('debt', debt_pf, 'debt')
         self.check_bits[4] = True
 
     def _calcDebt(self):
@@ -264,30 +617,68 @@ class CapitalProject:
         if self.debt is None:
             raise ProjFinError, "You must set the debt portfolio before you can calculate the debt"
 
-        debt_cols = self.debt.CIP(self.cf_sheet.index)
-        self.cf_sheet['Loan_proceeds'] = debt_cols['cash_proceeds']
-        self.cf_sheet['Interest'] = debt_cols['interest']
-        self.cf_sheet['Principal_payments'] = debt_cols['principal_payment']
+        #The debt schedule is daily; it is summed into the rows of the sheet
+        debt_cols = self.calendar.schedule(self.debt.CIP(self.cash_sheet.daily_index()), ['cash_proceeds', 'interest', 'principal_payment'])
+        for (col, name) in (('Loan_proceeds', 'cash_proceeds'), ('Interest', 'interest'), ('Principal_payments', 'principal_payment')):
+            self.cash_sheet[col].fill(0.0)
+            self.cash_sheet.add_schedule(col, debt_cols, name)
 
         
         
     def setOtherFinancials(self):
         """Sets the decommissioning cost, and calculates EBITDA, net Income, taxes, and cash flow"""
         #Need to check order bits here
-        self.cf_sheet['Decommissioning_costs'] = np.zeros(len(self.cf_sheet))
+        sheet = self.cash_sheet
+        sheet['Decommissioning_costs'].fill(0.0)
         try:
-            self.cf_sheet.loc[self.fin_param['Startup_period']+self.fin_param['Plant_life']*DateOffset(years=1)]['Decommissioning_costs'] = self.fin_param['Decommissioning_cost']
+            sheet['Decommissioning_costs'][sheet.position(self.fin_param['Startup_period']+self.fin_param['Plant_life']*DateOffset(years=1))] = self.fin_param['Decommissioning_cost']
         except KeyError:
             pass
 
-        self.cf_sheet['Cost_of_sales'] = self.cf_sheet['Fixed_costs'] + self.cf_sheet['Variable_costs'] + self.cf_sheet['Decommissioning_costs']
-        self.cf_sheet['EBITDA'] = self.cf_sheet['Revenue'] - self.cf_sheet['Cost_of_sales']
-        self.cf_sheet['Pre-depreciation_income'] = self.cf_sheet['EBITDA'] - self.cf_sheet['Interest']
-        self.cf_sheet['Taxable_income'] = self.cf_sheet['Pre-depreciation_income'] - self.cf_sheet['Depreciation']
+        np.add(sheet['Fixed_costs'], sheet['Variable_costs'], out = sheet['Cost_of_sales'])
+        sheet['Cost_of_sales'] += sheet['Decommissioning_costs']
+        np.subtract(sheet['Revenue'], sheet['Cost_of_sales'], out = sheet['EBITDA'])
+        np.subtract(sheet['EBITDA'], sheet['Interest'], out = sheet['Pre-depreciation_income'])
+        np.subtract(sheet['Pre-depreciation_income'], sheet['Depreciation'], out = sheet['Taxable_income'])
         #!!!#Taxes are wrong, wrong, wrong.  At the very least, need to make tax zero in negative revenue years.  Next would be to add loss carry-over.  Finally would be to create a reserve of credits and carryovers and correctly apply these.
-        self.cf_sheet['Taxes'] = self.cf_sheet['Taxable_income'] * (self.fin_param['State_tax_rate'] + self.fin_param['Federal_tax_rate'])   
-        self.cf_sheet['After-tax_income'] = self.cf_sheet['Taxable_income'] - self.cf_sheet['Taxes']
-        self.cf_sheet['Net_cash_flow'] = self.cf_sheet['After-tax_income'] - self.cf_sheet['Capital_expenditures'] - self.cf_sheet['Principal_payments'] + self.cf_sheet['Loan_proceeds'] + self.cf_sheet['Depreciation']
+        self._calcTaxes(sheet['Taxable_income'], out = sheet['Taxes'])
+        np.subtract(sheet['Taxable_income'], sheet['Taxes'], out = sheet['After-tax_income'])
+        ncf = sheet['Net_cash_flow']
+        np.subtract(sheet['After-tax_income'], sheet['Capital_expenditures'], out = ncf)
+        ncf -= sheet['Principal_payments']
+        ncf += sheet['Loan_proceeds']
+        ncf += sheet['Depreciation']
+
+
+    def _net_cash_flow(self, sales, variable_costs, fixed_costs):
+        """Net cash flow for stacks of sales, variable cost, and fixed cost rows, with every other column taken from the sheet -- the same arithmetic as setOtherFinancials"""
+        sheet = self.cash_sheet
+        ncf = np.add(sales, sheet['Salvage'])
+        ncf -= variable_costs
+        ncf -= fixed_costs
+        ncf -= sheet['Decommissioning_costs']
+        ncf -= sheet['Interest']
+        ncf -= sheet['Depreciation']
+        #ncf holds taxable income at this point
+        ncf -= self._calcTaxes(ncf)
+        ncf -= sheet['Capital_expenditures']
+        ncf -= sheet['Principal_payments']
+        ncf += sheet['Loan_proceeds']
+        ncf += sheet['Depreciation']
+        return ncf
+
+    def _calcTaxes(self, taxable_income, out = None):
+        """Applies the combined state and federal rate to a taxable income array of any shape, floored at zero tax if tax_floor is set"""
+        if self.tax_floor:
+            taxable_income = np.maximum(taxable_income, 0.0, out = out)
+        return np.multiply(taxable_income, self.fin_param['State_tax_rate'] + self.fin_param['Federal_tax_rate'], out = out)
+
+    def _tax_slope(self, taxable_income):
+        """Marginal tax rate at each entry of a taxable income array -- this has to stay consistent with _calcTaxes"""
+        rate = self.fin_param['State_tax_rate'] + self.fin_param['Federal_tax_rate']
+        if self.tax_floor:
+            return np.where(np.asarray(taxable_income) > 0.0, rate, 0.0)
+        return np.ones(np.shape(taxable_income)) * rate
 
 
     def outputCashFlowSheet(self, filename = None):
@@ -364,6 +755,7 @@ class FinancialParameters:
 
     def __init__(self):
         self.params = {}
+        self.revisions = {}		#bumped on every assignment, so a CapitalProject can tell which parameters changed since it last assembled
         for key in FinancialParameters.key_list:
             self.params[key] = None
 
@@ -394,6 +786,7 @@ class FinancialParameters:
             raise ProjFinError, "The depreciation type must be a string"
 
         self.params[key] = value
+        self.revisions[key] = self.revisions.get(key, 0) + 1
     
 
     def is_incomplete(self):
@@ -539,7 +932,7 @@ class SteppedScaler(Scaler):
             N += 1
         return self.base_price * self.steps[sorted_keys[N-1]]
 
-class QuoteBasis(object):
+class QuoteBasis(Watched):
     """This is the class for holding quotation information that a capital item will require to scale"""
     def __init__(self, base_price = None, date = None, size_basis = None, source = None, scaler = NoneScaler(), **kwargs):
         
@@ -756,7 +1149,7 @@ class VariableExpenseQuoteBasis(QuoteBasis):
     pass
 
 	
-class InstallModel:
+class InstallModel(Watched):
     """Class to hold models for installed cost"""
     def __init__(self):
         pass
@@ -791,7 +1184,18 @@ class FixedInstallModel(InstallModel):
         return self.fixed == other.fixed
 
 
-class Escalator:
+def _read_only(a):
+    """Marks a cached array read-only, since every caller gets the same one"""
+    a.flags.writeable = False
+    return a
+
+#Escalation factor vectors, shared by line items that escalate over the same dates from the same basis date at the same
+#rate, and the depreciation kernels, shared by schedules of the same method and recovery years
+escalation_cache = LRUCache(maxsize = 128)
+depreciation_kernels = LRUCache(maxsize = 256)
+
+
+class Escalator(Watched):
     """The cost escalation class.  It takes an input date and escalates to a future date based on a variety of subclasses"""
 
     def __init__(self):
@@ -815,23 +1219,42 @@ class Escalator:
 
         return self.factor #OK, I just broke a lot of shit!
 
+    def _factors(self, basis_date, new_date, rate, daily_factor):
+        """Returns daily_factor**days from basis_date to new_date.  A scalar date gives a float; a series of dates gives a Series
+        wrapping a shared, read-only factor array from the escalation cache (copy it before changing it in place)."""
+        if not isinstance(new_date, (pd.Series, pd.Index, np.ndarray)):
+            try:
+                days = new_date - basis_date
+            except TypeError:
+                raise BadDateError, "The dates passed are not of an acceptable type"
+            if isinstance(days, dt.timedelta):
+                days = np.timedelta64(days)		#cast this up to allow the necessary division
+            return daily_factor**(days/np.timedelta64(1,'D'))
+
+        if not isinstance(basis_date, (dt.datetime, dt.date, np.datetime64)):
+            raise BadDateError, "The basis date is not of an acceptable type, got %s" % type(basis_date)
+        try:
+            stamps = pd.DatetimeIndex(new_date).asi8
+        except (TypeError, ValueError):
+            raise BadDateError, "The dates passed are not of an acceptable type"
+        basis = pd.Timestamp(basis_date).value
+        build = lambda: _read_only(np.power(daily_factor, (stamps - basis)/(86400.0*1E9)))
+        #an evenly spaced grid is keyed by its first date, length, and step; any other grid is not cached
+        step = stamps[1] - stamps[0] if len(stamps) > 1 else 0
+        if len(stamps) > 2 and (np.diff(stamps) != step).any():
+            factors = build()
+        else:
+            first = stamps[0] if len(stamps) else None
+            factors = escalation_cache.get((self.__class__.__name__, rate, basis, first, len(stamps), step), build)
+        return pd.Series(factors, index = getattr(new_date, 'index', None), copy = False)
+
 class NoEscalationEscalator(Escalator):
     """Scales to a constant value"""
     def escalate(self, **kwargs):
 	#need to make sure we have all of the days
 	if 'new_date' in kwargs:
-	    try:
-                days = kwargs['new_date'] - kwargs['basis_date']
-	    except TypeError:
-                raise BadDateError, "A bad date type has been passed"
-	    if isinstance(days, dt.timedelta):
-		days = np.timedelta64(days)
-            n = days/np.timedelta64(1,'D')
-	    self.factor = 1**n
-
-	else:
-            self.factor = 1.0
-        return Escalator.escalate(self, **kwargs)    
+            return self._factors(kwargs['basis_date'], kwargs['new_date'], None, 1.0)
+        return 1.0
 
 
 class InflationRateEscalator(Escalator):
@@ -847,20 +1270,10 @@ class InflationRateEscalator(Escalator):
             if self.rate < 0:
                 raise BadValue, "The rate must be positive"
             dpr = np.power(1+self.rate, 1/365.0)-1
-	    
-	    try:
-                days = kwargs['new_date'] - kwargs['basis_date']
-	    except TypeError:
-	        raise BadDateError, "The dates passed are not of an acceptable type"
-            if isinstance(days, dt.timedelta):
-                days = np.timedelta64(days)		#cast this up to allow the necessary division
-            #n = (kwargs['new_date']-kwargs['basis_date']).days	#number of days between intervening periods
-            n = days/np.timedelta64(1,'D')
-            self.factor = (1+dpr)**n
-            return Escalator.escalate(self, **kwargs)
+            return self._factors(kwargs['basis_date'], kwargs['new_date'], self.rate, 1+dpr)
         except KeyError:
             raise MissingInfoError, "We are missing some data from the escalate function"
-        except TypeError or ValueError:
+        except (TypeError, ValueError):
             raise BadValue, "The values used for the inflation rate are invalid"
 
 class CPIindexEscalator(Escalator):
@@ -875,21 +1288,26 @@ class CPIindexEscalator(Escalator):
         #Calculate a factor
         pass
         
-class DepreciationSchedule:
-    """A timeseries-indexed dataframe that holds the depreciation schedule"""
+class DepreciationSchedule(object):
+    """A depreciation schedule, held as the daily fraction of the cost written down from the starting period (the kernel,
+    shared between assets) and the cost.  It is laid out on a calendar by add_to, and the frame is only built when asked for."""
 
     def __init__(self, starting_period, length):
-	#create an empty dataframe, if nothing else
 	self.check_inputs(starting_period, length)
 	self.length = length
 	self.starting_period = starting_period
+	self.kernel = None			#an unbuilt schedule is all zeros
+	self.cost = 0.0
+	self._frame = None
 
-	#Any creation of an actual schedule will require creation of the DataFrame in the __init__ member function
-
-    def build(self):
+    def build(self, cost):
         """Fills in the depreciation schedule"""
 	pass
 
+    def days(self):
+        """Number of days the schedule covers"""
+        return (self.starting_period + self.length*DateOffset(years=1) - self.starting_period).days
+
     def check_inputs(self, starting_period, length):
         if not isinstance(starting_period, dt.datetime):
             raise BadCapitalDepreciationInput, "starting_period must be a datetime.datetime object; found %s instead" % type(starting_period)
@@ -900,29 +1318,51 @@ class DepreciationSchedule:
                 raise BadCapitalDepreciationInput, "length must be positive"
         except TypeError or ValueError:
             raise BadCapitalDepreciationInput, "length must be numeric and positive"    
-        
+
+    def add_to(self, acc):
+        """Adds the schedule to a ScheduleAccumulator"""
+        if self._frame is not None:
+            acc.add(self._frame)
+        elif self.kernel is None:
+            acc.add_values(self.starting_period, np.zeros(self.days()), ['depreciation'])
+        else:
+            acc.add_values(self.starting_period, self.cost*self.kernel, ['depreciation'])
+
+    @property
+    def frame(self):
+        """The schedule as a daily frame, built on first use; changes to it are what add_to adds from then on"""
+        if self._frame is None:
+            acc = st.ScheduleAccumulator()
+            self.add_to(acc)
+            self._frame = acc.frame()
+        return self._frame
+
     def __getitem__(self, key):
         return self.frame[key]
 
     def __setitem__(self, key, val):
         self.frame[key] = val
 
+    def _set_kernel(self, kernel, cost):
+        self.kernel = kernel
+        self.cost = cost
+        self._frame = None
+
+    def _year_days(self, years):
+        """Number of days in each of the years counted from the starting period"""
+        edges = [self.starting_period + y*DateOffset(years=1) for y in range(years+1)]
+        return tuple((edges[y+1] - edges[y]).days for y in range(years))
+
     def value(self, date):
+        if self._frame is None and self.kernel is not None:
+            day = (pd.Timestamp(date) - pd.Timestamp(self.starting_period)).days
+            if 0 <= day < len(self.kernel):
+                return self.cost*self.kernel[day]
 	return self.frame.loc[date]['depreciation']
 
 
 
 class NonDepreciableDepreciationSchedule(DepreciationSchedule):
-    def __init__(self, starting_period=None, length=None, **kwargs):
-        
-        DepreciationSchedule.__init__(self, starting_period, length)
-        dates = pd.date_range(self.starting_period, self.starting_period + self.length*DateOffset(years=1) - DateOffset(days=1), freq = 'D')
-	d = {'depreciation':np.zeros(len(dates))}
-	self.frame = df.DataFrame(index = dates, data = d)
-        
-	
-
-
     def build(self, cost):
         """Nothing to do here -- the schedule should be filled with zeros"""
         pass
@@ -930,20 +1370,11 @@ class NonDepreciableDepreciationSchedule(DepreciationSchedule):
     
 
 class StraightLineDepreciationSchedule(DepreciationSchedule):
-
-    def __init__(self, starting_period=None, length=None,**kwargs):
-        
-        DepreciationSchedule.__init__(self, starting_period, length)
-        dates = pd.date_range(self.starting_period, self.starting_period + self.length*DateOffset(years=1) - DateOffset(days=1), freq = 'D')
-        d = {'depreciation':np.zeros(len(dates))}
-        self.frame = df.DataFrame(index = dates, data = d)
-	
-
     def build(self, cost):
         """Fills out a straight-line depreciation schedule"""
-        self['depreciation'] += 1.0
-        deprec_value_daily = cost/len(self.frame.index)
-        self['depreciation'] *= deprec_value_daily
+        #The kernel only depends on the number of days
+        n = self.days()
+        self._set_kernel(depreciation_kernels.get(('StraightLine', n), lambda: _read_only(np.ones(n)/n)), cost)
 
 
 class MACRSDepreciationSchedule(DepreciationSchedule):
@@ -954,23 +1385,17 @@ class MACRSDepreciationSchedule(DepreciationSchedule):
     MACRS['10'] = np.array([0.1000, 0.18, 0.144, 0.1152, 0.0922, 0.0737, 0.0655, 0.0655, 0.0656, 0.0655, 0.0328])
     MACRS['15'] = np.array([0.05, 0.095, 0.0855, 0.0770, 0.0693, 0.0623, 0.0590, 0.0590, 0.0591, 0.0590, 0.0591, 0.0590, 0.0591, 0.0590, 0.0591, 0.0295])
     MACRS['20'] = np.array([0.0375, 0.07219, 0.06677, 0.06177, 0.05713, 0.05285, 0.04888, 0.04522, 0.04462, 0.04461, 0.04462, 0.044610, 0.04462, 0.04461, 0.04462, 0.04461, 0.04462, 0.04461, 0.04462, 0.04461, 0.02231])
-   
-    def __init__(self, starting_period=None, length=None,**kwargs):
-        DepreciationSchedule.__init__(self, starting_period, length)
-        
-        dates = pd.date_range(self.starting_period, self.starting_period + (self.length+1)*DateOffset(years=1)-DateOffset(days=1), freq = 'D')
-        d = {'depreciation': np.zeros(len(dates))}
-        self.frame = df.DataFrame(index = dates, data = d)
-	
+
+    def days(self):
+        #the half-year convention runs the schedule into one more year
+        return sum(self._year_days(self.length+1))
 
     def build(self, cost):
-        self['depreciation'] += 1.0
-        for y in range(0,self.length+1):
-                
-            dep_factor = MACRSDepreciationSchedule.MACRS['%s' % (self.length)][y]/len(self[self.starting_period + y*DateOffset(years=1):self.starting_period+(y+1)*DateOffset(years=1)-DateOffset(days=1)])
-            self[self.starting_period+y*DateOffset(years=1):self.starting_period+(y+1)*DateOffset(years=1)-DateOffset(days=1)]['depreciation'] *= dep_factor                
- 
-        self['depreciation'] *= cost
+        #Each recovery year's fraction is spread evenly over its days; the kernel depends on the length and on the day counts
+        #of the recovery years (leap days), so assets starting on the same day of the leap cycle share one
+        rates = MACRSDepreciationSchedule.MACRS['%s' % (self.length)]
+        days = self._year_days(self.length+1)
+        self._set_kernel(depreciation_kernels.get(('MACRS', self.length, days), lambda: _read_only(np.repeat(rates/np.array(days), days))), cost)
 
 
 class ScheduleDepreciationSchedule(DepreciationSchedule):
@@ -985,12 +1410,12 @@ class ScheduleDepreciationSchedule(DepreciationSchedule):
         if 'depreciation' not in schedule.columns:
             raise BadCapitalDepreciationInput, "The depreciation schedule must have a 'depreciation' column"
 
-        self.frame = df.DataFrame(schedule)
+        self._frame = df.DataFrame(schedule)
 
     def build(self, cost):
         self['depreciation'] *= cost
 
-class CapitalExpense:
+class CapitalExpense(Watched):
     """Container class for capital expenditures"""
     
     gl_add_info = OrderedDict([('name',('Name',str)),('uninstalled_cost',('Uninstalled cost',float)),('installation_factor',('Installation factor',float))])
@@ -1056,13 +1481,19 @@ class CapitalExpense:
  
     def build_capex_schedule(self):
         """Aggregates the payment schedule and depreciation schedule into the total_schedule dataframe"""
+        acc = st.ScheduleAccumulator()
+        self.add_capex_schedule(acc)
+	self.total_schedule = acc.frame()
+
+    @profiled('capex')
+    def add_capex_schedule(self, acc):
+        """Builds the depreciation and payment schedules and adds them to a ScheduleAccumulator, so a container sums its
+        items without a frame for each"""
 	#Need to build the depreciation and payment schedules -- use the internal dictionaries of arguments for these, which must be set up first
 	self.build_depreciation_schedule(**self.depreciation_args)
 	self.calc_payment_schedule(**self.payment_args)
-
-
-	#Let's use the merge SQL-like feature of the pandas dataframe to do this
-	self.total_schedule = self.depreciation_schedule.frame.join(self.payment_schedule, how = 'outer').fillna(0.0)
+        self.depreciation_schedule.add_to(acc)
+        acc.add(self.payment_schedule)
 
 
     def build_depreciation_schedule(self, starting_period, length, **kwargs):
@@ -1183,7 +1614,7 @@ class IndirectCapitalExpense(CapitalExpense):
 
 
 
-class CapitalCosts:
+class CapitalCosts(Watched):
     
 
     #Stuff for GUI
@@ -1207,6 +1638,8 @@ class CapitalCosts:
             raise BadDirectCapitalItem, "Only capital expenses can be added to the capital expense list"
 
         self.direct_capital.append(capital_item)
+        capital_item.watch(self)
+        self.changed()
 
     def add_indirect_capital_item(self, indirect_capital_item):
         """Adds an indirect capital item to the indirect_capital list"""
@@ -1214,33 +1647,86 @@ class CapitalCosts:
             raise BadIndirectCapitalItem, "Only indirect capital expenses can be added to the indirect capital expense list"
 
         self.indirect_capital.append(indirect_capital_item)
+        indirect_capital_item.watch(self)
+        self.changed()
+
 
+    def c_total_capital(self):
+        """Total installed cost of all of the capital items, at their quotes"""
+        return self._sum_installed_cost(depreciable_only = False)
 
+    def c_deprec_capital(self):
+        """Total installed cost of the depreciable capital items, at their quotes"""
+        return self._sum_installed_cost(depreciable_only = True)
+
+    def _sum_installed_cost(self, depreciable_only):
+        total = 0.0
+        for item in self.direct_capital + self.indirect_capital:
+            if isinstance(item, CapitalCosts):
+                total += item._sum_installed_cost(depreciable_only)
+            elif not (depreciable_only and item.depreciation_type == 'NonDepreciable'):
+                total += item.quote_basis.cost()
+        return total
+
+    @profiled('capex')
     def build_capex_schedule(self):
         """Calculates all of the payments and depreciation and aggregates these into a pandas dataframe"""
 	#Call the aggregation functions on all of the directs
 
-        self.total_schedule = df.DataFrame()
+        acc = st.ScheduleAccumulator()
 	
         for dc in self.direct_capital:
-	    dc.build_capex_schedule()		#if some of these items are CapitalCosts, then the schedule will contain indirects -- this handles itself seamlessly
-	    #shit, now we need to actually deal with the data mismatch problems -- going to do this the brute force way
-	    if len(self.total_schedule) == 0:	#base case
-	        self.total_schedule = self.total_schedule.join(dc.total_schedule, how = 'outer').fillna(0.0)
-		#print self.total_schedule
-	    else:
-		self.total_schedule = self.total_schedule.add(dc.total_schedule, fill_value = 0.0)
-	        
+	    dc.add_capex_schedule(acc)		#if some of these items are CapitalCosts, then the schedule will contain indirects -- this handles itself seamlessly
 
+	for ic in self.indirect_capital:
+	    ic.add_capex_schedule(acc)
+
+	self.total_schedule = acc.frame()
 	#create the indirect costs column, if it is not already there
 	if 'indirect_costs' not in self.total_schedule.columns:
 	    self.total_schedule['indirect_costs'] = np.zeros(len(self.total_schedule.index))
 
-	for ic in self.indirect_capital:
-            
-	    ic.build_capex_schedule()
-	    self.total_schedule = self.total_schedule.add(ic.total_schedule, fill_value = 0.0)
+    def add_capex_schedule(self, acc):
+        """Builds the total schedule and adds it to a ScheduleAccumulator, for a CapitalCosts held as an item of another"""
+        self.build_capex_schedule()
+        acc.add(self.total_schedule)
+
+    def build_project_capex_schedule(self, initial_period, expense_breakdown):
+        """Lays out the capital of a project by its construction years and returns the startup period (the end of construction).
 
+        This is an approximation for CapitalProject: each year's fraction of the unescalated total capital is spread evenly over
+        the days of that year.  The items' payment terms, escalation, and lead times are ignored, and total_schedule is not
+        built -- build_capex_schedule gives the itemized schedule."""
+        if not isinstance(expense_breakdown, list):
+            raise ProjFinError, "Only a simple (list) capital expense breakdown is supported"
+        try:
+            if abs(sum(expense_breakdown) - 1.0) > 1E-9:
+                raise ProjFinError, "The expense_breakdown must sum to 1"
+        except TypeError:
+            raise ProjFinError, "The expense_breakdown list must be filled with numbers"
+
+        edges = [pd.Timestamp(initial_period) + y*DateOffset(years=1) for y in range(len(expense_breakdown)+1)]
+        days = np.array([(edges[y+1] - edges[y]).days for y in range(len(expense_breakdown))])
+        capex = np.repeat(np.array(expense_breakdown, dtype = float)/days, days) * self.c_total_capital()
+        self.capex_schedule = df.DataFrame({'capex':capex}, index = pd.date_range(edges[0], periods = len(capex), freq = 'D'))
+        return edges[-1].to_pydatetime()
+
+    def build_project_depreciation_schedule(self, starting_period, length):
+        """Sums the depreciation schedules of the items, each by its own depreciation_type, from the project's startup period.
+        length is the recovery period of items that do not give their own in depreciation_args."""
+        acc = st.ScheduleAccumulator()
+        for item in self.direct_capital + self.indirect_capital:
+            if isinstance(item, CapitalCosts):
+                item.build_project_depreciation_schedule(starting_period, length)
+                acc.add(item.depreciation_schedule)
+            else:
+                args = {'starting_period':starting_period, 'length':length}
+                args.update(item.depreciation_args)
+                item.build_depreciation_schedule(**args)
+                item.depreciation_schedule.add_to(acc)
+        self.depreciation_schedule = acc.frame()
+        if 'depreciation' not in self.depreciation_schedule.columns:
+            self.depreciation_schedule['depreciation'] = np.zeros(len(self.depreciation_schedule.index))
             
     ##############################################
     """
@@ -1337,7 +1823,7 @@ class dtFractionalStartupDiscounter(StartupDiscounter):
         
 
 
-class FixedExpense(object):
+class FixedExpense(Watched):
     """Models a fixed (non-production related) expense."""
 
     def __init__(self, name, description = None, quote_basis = None, escalator = None, pmt_type = None, startup_discounter = None):
@@ -1422,6 +1908,7 @@ class FixedExpense(object):
 
         self._startup_discounter = v
 
+    @profiled('fixed')
     def build_fex_schedule(self):
 	"""This is the wrapper function that matches the name in the container class"""
         self.calc_payment_schedule(**self.pmt_args)
@@ -1458,7 +1945,7 @@ class FixedExpense(object):
 	pass
 
 
-class FixedCosts(object):
+class FixedCosts(Watched):
     gl_add_info = OrderedDict([('project_staff',('Project staff',float)),('g_and_a',('General and Administrative',float)),('prop_tax_and_insurance',('Property tax and insurance',float)),('rent_or_lease',('Rent or Lease',float)),('licensing_permits_fees',('Licensing, permits, and fees',float)),('mat_cost_maint_repair',('Material costs for maintenance and repairs',float)),('other_fees',('Other fees',float)),('other_fixed_op_and_maint',('Other fixed operational and maintenance costs',float))])
     labels = OrderedDict([('project_staff','Project staff'),('g_and_a','General and Administrative'),('prop_tax_and_insurance','Property tax and insurance'),('rent_or_lease','Rent or Lease'),('licensing_permits_fees','Licensing, permits, and fees'),('mat_cost_maint_repair','Material costs for maintenance and repairs'),('other_fees','Other fees'),('other_fixed_op_and_maint','Other fixed operational and maintenance costs')])
     types = OrderedDict([('project_staff',float),('g_and_a',float),('prop_tax_and_insurance',float),('rent_or_lease',float),('licensing_permits_fees',float),('mat_cost_maint_repair',float),('other_fees',float),('other_fixed_op_and_maint',float)])
@@ -1472,21 +1959,33 @@ class FixedCosts(object):
         if not isinstance(fixed_cost, FixedExpense) and not isinstance(fixed_cost, FixedCosts):
             raise BadFixedCostType, "fixed_cost must be of type FixedExpense, got %s" % type(fixed_cost)
         self.fixed_costs.append(fixed_cost)
+        fixed_cost.watch(self)
+        self.changed()
 
     def del_fixed_cost(self, fixed_cost):			###!!!### all of these deletions should be done with ids instead -- much cleaner, as I would not need the acutal object to remove it
         for fc in self.fixed_costs:
             if fc.name == fixed_cost.name:
                 self.fixed_costs.remove(fixed_cost)
+                fixed_cost.unwatch(self)
+                self.changed()
 
+    @profiled('fixed')
     def build_fex_schedule(self):
-	self.schedule = df.DataFrame()
+	acc = st.ScheduleAccumulator()
         for fc in self.fixed_costs:
             fc.build_fex_schedule()
-            if len(self.schedule) == 0:
-                self.schedule = self.schedule.join(fc.schedule, how = 'outer').fillna(0.0)
+            acc.add(fc.schedule)
+	self.schedule = acc.frame()
 
-	    else:
-		self.schedule = self.schedule.add(fc.schedule, fill_value = 0.0)
+    def c_total_fixed_costs(self):
+        """Total annual fixed cost at the quotes -- each quote is for one payment at its frequency"""
+        total = 0.0
+        for fc in self.fixed_costs:
+            if isinstance(fc, FixedCosts):
+                total += fc.c_total_fixed_costs()
+            else:
+                total += fc.quote_basis.base_price * CapitalProject.periods_per_year[fc.quote_basis.freq]
+        return total
 	        
  
 
@@ -1497,7 +1996,7 @@ class FixedCosts(object):
         return not self.__eq__(other)
 
    
-class VariableExpense(object):
+class VariableExpense(Watched):
     """Holds a single instance of a variable expense"""
 
     def __init__(self, name, description = None, quote_basis = None, production = None, rate = None, escalator = None):
@@ -1576,6 +2075,7 @@ class VariableExpense(object):
         else:
             self._escalator = v
 
+    @profiled('variable')
     def build_vex_schedule(self, end_date):
         if not isinstance(end_date, dt.datetime):
             raise BadScheduleDateError, "end_date must be a dt.datetime object"
@@ -1588,23 +2088,24 @@ class VariableExpense(object):
 	#escalate the quote basis
 	esc_factors = self.escalator.escalate(basis_date = self.quote_basis.date, new_date  = pd.Series(self.schedule.index))  #lots of reach through -- do we want to put an accessor in Product?
 	esc_factors.index = self.schedule.index
-	self.schedule['variable_consumption'] = self.rate.value * self.production.schedule['rate']
-
-	self.schedule.units['variable_consumption'] = (self.rate * uv.UnitVal(1.0, self.production.schedule.units['rate'])).units
+	consumption = self.rate * uv.UnitArray(self.production.schedule['rate'], self.production.schedule.units['rate'])
+	self.schedule['variable_consumption'] = np.asarray(consumption)
+	self.schedule.units['variable_consumption'] = consumption.units
 	if self.preferred_units['variable_consumption'] is not None:
 	    self.schedule.convert_units('variable_consumption', self.preferred_units['variable_consumption'])	#This should throw an error on unit mismatch, but should happen at the DataFrame level
 	else:
 	    self.schedule.simplify_units('variable_consumption')
 
-	self.schedule['variable_costs'] = esc_factors * self.quote_basis.base_price * self.schedule['variable_consumption']
-	self.schedule.units['variable_costs'] = (self.quote_basis.size_basis * uv.UnitVal(1.0,self.schedule.units['variable_consumption'])).units
+	costs = uv.UnitArray(esc_factors * self.quote_basis.base_price, self.quote_basis.size_basis.units) * uv.UnitArray(self.schedule['variable_consumption'], self.schedule.units['variable_consumption'])
+	self.schedule['variable_costs'] = np.asarray(costs)
+	self.schedule.units['variable_costs'] = costs.units
 	if self.preferred_units['variable_costs'] is not None:
 	    self.schedule.convert_units('variable_costs', self.preferred_units['variable_costs'])
 	else:
 	    self.schedule.simplify_units('variable_costs')
 	
 	
-class VariableCosts:
+class VariableCosts(Watched):
     """Class to hold the set of variable costs""" 
 
     def __init__(self):
@@ -1616,29 +2117,34 @@ class VariableCosts:
         if not isinstance(vex, VariableExpense) and not isinstance(vex, VariableCosts):
             raise BadVariableExpenseItem, "vex must be of type VariableExpense, got %s" % type(vex)
         self.variable_costs.append(vex)
+        vex.watch(self)
+        self.changed()
 
     def del_variable_expense(self, vex):			###!!!### all of these deletions should be done with ids instead -- much cleaner, as I would not need the acutal object to remove it
         for vc in self.variable_costs:
             if vc.name == vex.name:
                 self.variable_costs.remove(vc)
+                vc.unwatch(self)
+                self.changed()
 
+    @profiled('variable')
     def build_vex_schedule(self, end_date):
-	self.schedule = df.DataFrame()
+	acc = st.ScheduleAccumulator(detailed = self.detailed, detail_columns = ['variable_consumption', 'variable_costs'])
 
 	for vc in self.variable_costs:
             vc.build_vex_schedule(end_date)
-            if len(self.schedule) == 0:
-                self.schedule = self.schedule.join(vc.schedule, how = 'outer').fillna(0.0)
-	        self.schedule = df.DataFrame(self.schedule)
-
-	    else:
-		self.schedule = self.schedule.add(vc.schedule, fill_value = 0.0)			#This assumes a common currency in all the sheets ###!!!###
+	    acc.add(vc.schedule, vc.name)		#This assumes a common currency in all the sheets ###!!!###
+	self.schedule = acc.frame()
 
-	    if self.detailed:
-		self.schedule['%s_variable_consumption' % vc.name] = vc.schedule['variable_consumption']
-		self.schedule.units['%s_variable_consumption'] = vc.schedule.units['variable_consumption']
-		self.schedule['%s_variable_costs' % vc.name] = vc.schedule['variable_costs']
-		self.schedule.units['%s_variable_costs' % vc.name] = vc.schedule.units['variable_costs']
+    def c_total_VC(self, production_units):
+        """Variable cost of making one unit (production_units) of product at the quotes, the same unit arithmetic as build_vex_schedule"""
+        total = 0.0
+        for vc in self.variable_costs:
+            if isinstance(vc, VariableCosts):
+                total += vc.c_total_VC(production_units)
+            else:
+                total += uv.converter.convert_units(vc.quote_basis.base_price * vc.rate.value, "%s*%s" % (vc.quote_basis.size_basis.units, vc.rate.units), "1/(%s)" % production_units)
+        return total
  
     
     def __eq__(self, other):
@@ -1826,6 +2332,7 @@ class Production(object):
 	    self._freq = v
             self.freq_dummy_uv = uv.UnitVal(1, Production.freqs[v])
 
+    @profiled('production')
     def build_production_schedule(self, end_date):
 	"""This is the wrapper function that matches the name in the container class"""
 	#dispatch to the right function
@@ -1857,8 +2364,9 @@ class Production(object):
 	    self.schedule.simplify_units('rate')
 
 	#For the revenue column to work, we need equivalent units, right?  Or do we just need to multiply the series values, then simplify units?
-	self.schedule['revenue'] = self.schedule['price'] * self.schedule['rate']
-	self.schedule.units['revenue'] = (uv.UnitVal(1.0, self.schedule.units['price'])*uv.UnitVal(1.0, self.schedule.units['rate'])).units
+	revenue = uv.UnitArray(self.schedule['price'], self.schedule.units['price']) * uv.UnitArray(self.schedule['rate'], self.schedule.units['rate'])
+	self.schedule['revenue'] = np.asarray(revenue)
+	self.schedule.units['revenue'] = revenue.units
 	if self.preferred_units['revenue'] is not None:
 	    self.schedule.convert_units('revenue', self.preferred_units['revenue'])
 	else:
@@ -1884,26 +2392,14 @@ class ProductionPortfolio:
             if p.name == production.name:
                 self.production.remove(p)
 
+    @profiled('production')
     def build_production_schedule(self, end_date):
-	self.schedule = df.DataFrame()
+	acc = st.ScheduleAccumulator(detailed = self.detailed, detail_columns = ['rate', 'price', 'revenue'])
 
 	for p in self.production:
             p.build_production_schedule(end_date)
-            if len(self.schedule) == 0:
-	                
-		self.schedule = self.schedule.join(p.schedule, how = 'outer').fillna(0.0)
-	        self.schedule = df.DataFrame(self.schedule)	#need to cast this back up to a unit containing dataframe -- oh, shit, the units are gone -- only really a problem with currency
-	    else:
-		
-		self.schedule = self.schedule.add(p.schedule, fill_value = 0.0)
-
-	    if self.detailed:
-		self.schedule['%s_rate' % p.name] = p.schedule['rate']
-		self.schedule.units['%s_rate' % p.name] = p.schedule.units['rate']
-		self.schedule['%s_price' % p.name] = p.schedule['price']
-		self.schedule.units['%s_price' % p.name] = p.schedule.units['price']
-	        self.schedule['%s_revenue' % p.name] = p.schedule['revenue']
-		self.schedule.units['%s_revenue' % p.name] = p.schedule.units['revenue']
+	    acc.add(p.schedule, p.name)		#the summed columns take the units of the first stream -- only really a problem with currency
+	self.schedule = acc.frame()
 
  		
         #drop the extraneous columns - cleanest to do it here, and the extra math won't cost much above
@@ -1917,7 +2413,7 @@ class ProductionPortfolio:
 
 
 
-class DebtPortfolio:
+class DebtPortfolio(Watched):
     """Holds all of the loans, bonds, etc. for a given project"""
     def __init__(self):
         self.debts = []
@@ -1934,6 +2430,7 @@ class DebtPortfolio:
                 raise ProjFinError, "%s is already a loan in the debt portfolio" % debt.name
 
         self.debts.append(debt)
+        debt.watch(self)
         self.loan_schedule_bit = False
 
     def del_debt(self, name):
@@ -1941,61 +2438,45 @@ class DebtPortfolio:
         for debt in self.debts:
             if debt.name == name:
                 self.debts.remove(debt)
+                debt.unwatch(self)
+                self.changed()
 
 	###!!!###Throw a warning if this is not in here
 
+    @profiled('debt')
     def build_debt_schedule(self):
         """Rolls up the debt schedules for all of the given loans"""
-	self.schedule = df.DataFrame()
+	acc = st.ScheduleAccumulator()
 	
         for d in self.debts:
 	    try:
-	        d.build_debt_schedule()		#if some of these items are CapitalCosts, then the schedule will contain indirects -- this handles itself seamlessly
+	        d.build_debt_schedule()
 
 	    except MissingInfoError:
 		raise UnderspecifiedError, "Debt item %s is underspecified; cannot calculate its schedule" % d.name
 
-	    if len(self.schedule) == 0:	#base case
-	        self.schedule = self.schedule.join(d.schedule, how = 'outer').fillna(0.0)
-
-	    else:
-		self.schedule = self.schedule.add(d.schedule, fill_value = 0.0)
-
-
-    def calculate_loans(self):
-        """Calculates all the schedules for all of the given loans"""
-        for loan in self.loans:
-            if not loan.scheduled:
-                loan.generate_schedule()
+	    acc.add(d.schedule)
+	self.schedule = acc.frame()
 
-        self.loan_schedule_bit = True
-
-    ###This is no longer relevant -- the general loan schedule already does this
 
     def CIP(self, date_range):
-        """Calculates the cash proceeds, interest, and principal payment for all loans in the portfolio for a given date range"""
-        if not self.loan_schedule_bit:
-            self.calculate_loans()
-        
-        #date_range should be a timeseries object for this to work
-        output = df.DataFrame(index = date_range)
-        
+        """Returns the cash proceeds, principal payment, and interest of all of the debts on each date of date_range (days with nothing are zero)"""
         names = ['cash_proceeds','principal_payment','interest']
+        output = df.DataFrame(dict((name, np.zeros(len(date_range))) for name in names), index = date_range, columns = names)
+        if len(self.debts) == 0:
+            return output
+        self.build_debt_schedule()
+        schedule = self.schedule.reindex(date_range)
         for name in names:
-            output[name] = np.zeros(len(output))
-        for loan in self.loans:
-            output = output.add(loan.schedule, fill_value=0)
-               
-        output = df.DataFrame(output, index = date_range, columns = names)
-        
-        return output   
+            output[name] = schedule[name].fillna(0.0).values
+        return output
 
 
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and self.loans == other.loans and self.bonds == other.bonds
+        return isinstance(other, self.__class__) and self.debts == other.debts
 
     def __ne__(self, other):
-        return not self.__ne__(other)
+        return not self.__eq__(other)
     
 
 class DebtPmtScheduler:
@@ -2042,7 +2523,7 @@ class DebtPmtScheduler:
 	return frame
 	
 
-class Debt:
+class Debt(Watched):
     """Abstract class for all debt instruments"""
 
     def __init__(self, name, principal = None, init_date = None, comment = None,term = None, rate = None, pmt_freq = None):
@@ -2102,58 +2583,44 @@ class Debt:
                 raise MissingInfoError, "You need to set %s before generating the debt schedule" % item 
 
 
+    @profiled('debt')
     def build_debt_schedule(self):
-	self.check_defined()      
-
-	#create the schedule of interest accumulation/calculation -- works around the interspersed payments
-	
-	s = df.DataFrame()
-
-	for ps in self.pmt_schedules:
-	    s = s.join(ps, how = 'outer').fillna(0.0)
-
-	for cs in self.cash_schedules:
-	    s = s.join(cs, how = 'outer').fillna(0.0)
-	
-        self.schedule = df.DataFrame(index = s.index)
-        
-        #Now we just need to step through the payment dates to calculate the schedule 
-
-	
-
-        #set up the principal column
-        self.schedule['principal'] = np.zeros(len(self.schedule))
-	self.schedule['interest'] = np.zeros(len(self.schedule))
-	self.schedule['cash_proceeds'] = np.zeros(len(self.schedule))
-	self.schedule['principal_payment'] = np.zeros(len(self.schedule))
-
-	
-
-
-	all_but_first = self.schedule.index[1:]
-
-	#do the first row
-	self.schedule['principal'][0] = s['proceeds'][0] - s['payments'][0]
-	P = self.schedule['principal'][0]
-	self.schedule['cash_proceeds'][0] = s['proceeds'][0]
-	self.schedule['principal_payment'][0] = s['payments'][0]
-	
-	#iterate through the rest of the rows
-	for i in all_but_first:
-
-	    if i in self.interest_dates:						
-	         self.schedule.loc[i,'interest'] = self.rate/self.pmt_freq*P
-
-	    self.schedule.loc[i,'principal'] = P + s.loc[i,'proceeds'] + self.schedule.loc[i,'interest'] - s.loc[i,'payments']
-	    self.schedule.loc[i,'principal_payment'] = s.loc[i,'payments'] - self.schedule.loc[i,'interest']
-	    self.schedule.loc[i,'cash_proceeds'] = s.loc[i,'proceeds']
-	    P = self.schedule.loc[i,'principal']
-
-	    if P <= 0:
-	        break		#stop when there is no principal left to pay
-
-          
-        
+	self.check_defined()
+	self._build_schedule(self.pmt_schedules, self.cash_schedules)
+
+    def _build_schedule(self, pmt_schedules, cash_schedules):
+        """Builds the principal, interest, proceeds, and principal payment schedule over the merged payment and proceeds dates"""
+	#merge the payments and proceeds -- works around the interspersed payments
+	acc = st.ScheduleAccumulator()
+	for sched in pmt_schedules + cash_schedules:
+	    acc.add(sched)
+	merged = acc.total()
+	rows = np.flatnonzero(merged.present)
+	dates = merged.calendar.dates(merged.start + rows)
+	payments = merged['payments'][rows] if 'payments' in merged.columns else np.zeros(len(rows))
+	proceeds = merged['proceeds'][rows] if 'proceeds' in merged.columns else np.zeros(len(rows))
+
+	#The principal follows P[i] = g[i]*P[i-1] + proceeds[i] - payments[i], where g[i] = 1 + rate/pmt_freq on the interest
+	#dates after the first row and 1 otherwise.  With n[i] interest dates so far, G[i] = (1 + rate/pmt_freq)**n[i] is the
+	#running product of g, and P[i] = G[i]*cumsum((proceeds - payments)/G)[i].
+	r = self.rate/float(self.pmt_freq)
+	accrues = np.asarray(dates.isin(getattr(self, 'interest_dates', [])))
+	accrues[:1] = False
+	growth = np.power(1.0 + r, np.cumsum(accrues))
+	principal = growth*np.cumsum((proceeds - payments)/growth)
+	interest = np.zeros(len(rows))
+	interest[1:] = r*principal[:-1]
+	interest *= accrues
+	principal_payment = payments - interest
+	cash_proceeds = proceeds.copy()
+
+	#stop when there is no principal left to pay; the later rows stay zero
+	paid_off = np.flatnonzero(principal[1:] <= 0)
+	if len(paid_off):
+	    for col in (principal, interest, cash_proceeds, principal_payment):
+		col[paid_off[0]+2:] = 0.0
+
+        self.schedule = df.DataFrame({'principal':principal, 'interest':interest, 'cash_proceeds':cash_proceeds, 'principal_payment':principal_payment}, index = dates, columns = ['principal', 'interest', 'cash_proceeds', 'principal_payment'])
         self.scheduled = True
 
 
@@ -2182,17 +2649,15 @@ class Loan(Debt):
               
         self.scheduled = False
 
+    @profiled('debt')
     def build_debt_schedule(self):
         """Generates the loan schedule from appropriate information"""
 	self.check_defined()
         #This is a normally amortized loan; if the payment schedules[] object contains an additional payment schedule, we'll add that in
-        self.scheduler.pmt_normal_amortization(amt=self.principal, term=self.term, pmt_freq=self.pmt_freq, init_date = self.init_date, rate=self.rate)
+	#The amortization and the upfront cash are not kept in the lists, so rebuilding the loan does not count them twice
 	nml_amt = self.scheduler.pmt_normal_amortization(amt = self.principal, term = self.term, pmt_freq = self.pmt_freq, init_date = self.init_date, rate = self.rate)
-	self.pmt_schedules.append(nml_amt)
-	self.cash_schedules.append(self.scheduler.cash_upfront(amt = self.principal, init_date = self.init_date))
         self.interest_dates = nml_amt.index
-	
-	Debt.build_debt_schedule(self)
+	self._build_schedule(self.pmt_schedules + [nml_amt], self.cash_schedules + [self.scheduler.cash_upfront(amt = self.principal, init_date = self.init_date)])
 
 
 	
@@ -2227,6 +2692,7 @@ class Tax(object):
 	self.credits = credits
 	self.carryover_years = carryover_years
 	self.carryback_years = carryback_years
+	self.periods = None			#st.PeriodCodes of the daily schedule, shared by the taxes under a TaxManager
 
     @property
     def name(self):
@@ -2315,13 +2781,33 @@ class Tax(object):
 
         self._carryback_years = v
 
-    def aggregate(self, dataframe, freq = 'Y'):
-	"""Aggregate a dataframe by a frequency subset of its index.  Returns the aggregated dataframe.  Right now, frequency does nothing and is unadjustable--only annual"""
-	key = lambda x: x.year
-	dataframe['year'] = key(dataframe.index)
-	agg_dataframe = (dataframe.groupby('year')).aggregate(np.sum)		#This is the aggregated dataframe
-	return agg_dataframe
+    def period_codes(self, index):
+        """The period codes for a daily index: the ones shared by a TaxManager when they cover it, otherwise new ones"""
+        if self.periods is None or not self.periods.matches(index):
+            self.periods = st.PeriodCodes(index)
+        return self.periods
 
+    def aggregate(self, dataframe, freq = 'Y'):
+	"""Aggregate a dataframe by a frequency subset of its index.  Returns the aggregated dataframe, indexed by year.  Right now, frequency does nothing and is unadjustable--only annual"""
+	periods = self.period_codes(dataframe.index)
+	return df.DataFrame(periods.aggregate(dataframe.values), index = pd.Index(periods.periods, name = 'year'), columns = dataframe.columns)
+
+    def carry_losses(self):
+        """Applies loss carryback and carryforward to the annual taxable income of schedule_agg; the year by year usage
+        and expiry of the losses is kept in nol_ledger"""
+        years = np.asarray(self.schedule_agg.index, dtype = int)
+        if len(years) == 0:
+            self.nol_ledger = df.DataFrame(columns = tt.ledger_columns)
+            return
+        #the engine works on consecutive years, so a year missing from the schedule counts as a year without income
+        span = np.arange(years.min(), years.max() + 1)
+        income = np.zeros(len(span))
+        income[years - span[0]] = self.schedule_agg['taxable_income'].values
+        (income, ledger) = tt.carry_losses(income, self.carryover_years, self.carryback_years)
+        self.schedule_agg['taxable_income'] = income[years - span[0]]
+        self.nol_ledger = df.DataFrame(ledger, index = span, columns = tt.ledger_columns)
+
+    @profiled('tax')
     def build_tax_schedule(self):
         """Creates the schedule of taxes"""
 	if len(self.basis.index) == 0:
@@ -2355,6 +2841,7 @@ class GraduatedFractionalTax(Tax):
 
 	self._rate = v
 
+    @profiled('tax')
     def build_tax_schedule(self):
 	#The graduated schedule should be anchored with zero: {0:rate0, bracket1:rate1, ...}
 	#we will tack on np.inf to the end to make sure that we don't overrun
@@ -2374,61 +2861,11 @@ class GraduatedFractionalTax(Tax):
 	#group and aggregate by year -- this is the default behavior of 
      	
 	self.schedule_agg = self.aggregate(self.schedule)
-        self.schedule_agg['tax'] = np.zeros(len(self.schedule_agg.index))
-
-	
 
+	#carry losses back and forward across the years before taxing them
+	self.carry_losses()
 
-	#we actually need to do carryover up here
-	#walk through the taxable income sheet and apply carryover/carryback as appropriate
-	carryover = deque(maxlen = self.carryover_years)
-	for i in self.schedule_agg.index:
-	   
-	    if self.schedule_agg.loc[i,'taxable_income'] < 0.0:
-		amt = -1 * self.schedule_agg.loc[i, 'taxable_income']
-	        #carryback first
-		for j in range(0,self.carryback_years):
-		    try:
-			inc = self.schedule_agg.loc[i - (self.carryback_years -j),'taxable_income']
-		        if inc > 0.0:
-			    if amt <= inc:
-                                self.schedule_agg.loc[i- (self.carryback_years -j),'taxable_income'] -= amt
-				amt = 0.0
-			    else:
-				amt -= inc
-				self.schedule_agg.loc[i - (self.carryback_years -j), 'taxable_income'] = 0.0
-		    except KeyError:
-                        pass #This is here for the case where there are fewer years to look at in the project than allowed in carryback
-
-		#carryforward now
-		carryover.append(amt)		#this works, because deque just discards objects to the left when it is full
-		#set the taxable income in this year to zero, now that we are done with it, so that we don't have negative taxes
-		self.schedule_agg.loc[i, 'taxable_income'] = 0.0
-
-
-            else:
-		while carryover and self.schedule_agg.loc[i,'taxable_income'] > 0.0:
-		    amt = carryover.popleft()
-		    if amt <= self.schedule_agg.loc[i,'taxable_income']:
-			self.schedule_agg.loc[i,'taxable_income'] -= amt
-		    else:
-		        amt -= self.schedule_agg.loc[i,'taxable_income']
-			self.schedule_agg.loc[i,'taxable_income'] = 0.0
-			carryover.appendleft(amt)			#stick the remainder back in the deque
-		if carryover:
-		    carryover.append(0.0)				#this was a profitable year, so need to move the deque along a year -- enough profitable years will push the carryover over the end
-	
-	sorted_brackets = sorted(self.rate)
-	sorted_brackets.append(np.inf)
-
-	found_bracket_mask = df.DataFrame({'mask':np.array([True]*len(self.schedule_agg.index))}, index = self.schedule_agg.index)
-	#comparisons must be made on slices, of course
-
-	for n in range(1,len(sorted_brackets)):
-	    self.schedule_agg['tax'][self.schedule_agg['taxable_income']>=sorted_brackets[n]] += (sorted_brackets[n]-sorted_brackets[n-1])*self.rate[sorted_brackets[n-1]]
-	    self.schedule_agg['tax'][np.logical_and(self.schedule_agg['taxable_income']<sorted_brackets[n],found_bracket_mask['mask'])] += (self.schedule_agg['taxable_income']-sorted_brackets[n-1])*self.rate[sorted_brackets[n-1]]
-            
-	    found_bracket_mask['mask'][self.schedule_agg['taxable_income']<sorted_brackets[n]] = False	#When you find the right tax bracket, stop adding to these columns
+	self.schedule_agg['tax'] = tt.bracket_table(self.rate).fractional_tax(self.schedule_agg['taxable_income'].values)
 
 	#THIS ASSUMES THAT CREDITS ARE IN THE PRIORITY ORDER!!!
 
@@ -2443,12 +2880,11 @@ class GraduatedFractionalTax(Tax):
 
 
 	#now we need to build the schedule by apportioning the tax according to the income
-	self.schedule['tax'] = np.zeros(len(self.schedule.index))
-	for year in self.schedule_agg.index:
-	    if self.schedule_agg.loc[year, 'tax'] == 0:
-		self.schedule['tax'][self.schedule.index.year == year] = 0.0
-	    else:
-	        self.schedule['tax'][self.schedule.index.year == year] = self.schedule_agg.loc[year, 'tax'] * self.schedule['gross_income']/self.schedule_agg.loc[year,'gross_income']
+	annual = self.schedule_agg['tax'].values
+	share = np.zeros(len(annual))
+	taxed = annual != 0
+	share[taxed] = annual[taxed]/self.schedule_agg['gross_income'].values[taxed]
+	self.schedule['tax'] = self.period_codes(self.schedule.index).spread(share)*self.schedule['gross_income'].values
 	
 
 	
@@ -2480,6 +2916,7 @@ class FractionalTax(GraduatedFractionalTax):
 class GraduatedFixedTax(GraduatedFractionalTax):
     """Fixed tax payments throughout a year, with no proportion based on when the income was incurred"""
 
+    @profiled('tax')
     def build_tax_schedule(self):
         super(GraduatedFixedTax,self).build_tax_schedule()
 	if not self.rate:
@@ -2493,54 +2930,9 @@ class GraduatedFixedTax(GraduatedFractionalTax):
 
 	#group and aggregate by year -- this is the default behavior of 
         self.schedule_agg = self.aggregate(self.schedule)
-	#we actually need to do carryover up here
-	#walk through the taxable income sheet and apply carryover/carryback as appropriate
-	carryover = deque(maxlen = self.carryover_years)
-	for i in self.schedule_agg.index:
-	   
-	    if self.schedule_agg.loc[i,'taxable_income'] < 0.0:
-		amt = -1 * self.schedule_agg.loc[i, 'taxable_income']
-	        #carryback first
-		for j in range(0,self.carryback_years):
-		    try:
-			inc = self.schedule_agg.loc[i - (self.carryback_years -j),'taxable_income']
-		        if inc > 0.0:
-			    if amt <= inc:
-                                self.schedule_agg.loc[i- (self.carryback_years -j),'taxable_income'] -= amt
-				amt = 0.0
-			    else:
-				amt -= inc
-				self.schedule_agg.loc[i - (self.carryback_years -j), 'taxable_income'] = 0.0
-		    except KeyError:
-                        pass #This is here for the case where there are fewer years to look at in the project than allowed in carryback
-
-		#carryforward now
-		carryover.append(amt)		#this works, because deque just discards objects to the left when it is full
-		#set the taxable income in this year to zero, now that we are done with it, so that we don't have negative taxes
-		self.schedule_agg.loc[i, 'taxable_income'] = 0.0
+	self.carry_losses()
 
-
-            else:
-		while carryover and self.schedule_agg.loc[i,'taxable_income'] > 0.0:
-		    amt = carryover.popleft()
-		    if amt <= self.schedule_agg.loc[i,'taxable_income']:
-			self.schedule_agg.loc[i,'taxable_income'] -= amt
-		    else:
-		        amt -= self.schedule_agg.loc[i,'taxable_income']
-			self.schedule_agg.loc[i,'taxable_income'] = 0.0
-			carryover.appendleft(amt)			#stick the remainder back in the deque
-		if carryover:
-		    carryover.append(0.0)				#this was a profitable year, so need to move the deque along a yea	
-
-
-
-	self.schedule_agg['tax'] = np.zeros(len(self.schedule_agg.index))
-	sorted_brackets = sorted(self.rate)
-	sorted_brackets.append(np.inf)
-	n = 0
-	while n < len(sorted_brackets)-1:
-	    self.schedule_agg['tax'][np.logical_and(self.schedule_agg['taxable_income']>=sorted_brackets[n],self.schedule_agg['taxable_income']<sorted_brackets[n+1])] = self.rate[sorted_brackets[n]]
-            n += 1
+	self.schedule_agg['tax'] = tt.bracket_table(self.rate).fixed_tax(self.schedule_agg['taxable_income'].values)
 	#now we need to build the schedule by apportioning the tax according to the income
 	
 	for credit in self.credits:
@@ -2552,12 +2944,9 @@ class GraduatedFixedTax(GraduatedFractionalTax):
                 self.schedule_agg['tax'][self.schedule_agg['tax']>agg_credit_schedule['credits']] -= agg_credit_schedule['credits']
 	        self.schedule_agg['tax'][np.logical_and(self.schedule_agg['tax']<=agg_credit_schedule['credits'], self.schedule_agg['tax']>0.0)] = 0.0
 
-	self.schedule['tax'] = np.zeros(len(self.schedule.index))
-	for year in self.schedule_agg.index:
-	    if year % 4 == 0:			#leap year
-		self.schedule['tax'][self.schedule.index.year == year] = self.schedule_agg.loc[year,'tax']/366.0
-	    else:
-		self.schedule['tax'][self.schedule.index.year == year] = self.schedule_agg.loc[year,'tax']/365.0
+	periods = self.period_codes(self.schedule.index)
+	days = np.where(periods.periods % 4 == 0, 366.0, 365.0)		#leap years
+	self.schedule['tax'] = periods.spread(self.schedule_agg['tax'].values/days)
 
     
 
@@ -2624,6 +3013,15 @@ class TaxCredit(object):
         self.credit.basis = v
 
 
+    @property
+    def periods(self):
+        return self.credit.periods
+
+    @periods.setter
+    def periods(self, v):
+        self.credit.periods = v
+
+    @profiled('tax')
     def build_credit_schedule(self):
         self.credit.build_tax_schedule()
 
@@ -2631,11 +3029,18 @@ class TaxCredit(object):
 
 class TaxManager(object):
     """General aggregator for taxes"""
+    max_iterations = 100		#passes allowed for a cycle of deductible taxes that has to be iterated
+    tolerance = 0.01			#largest daily change in a tax between passes that counts as converged
 
-    def __init__(self, revenue = None, deductions = None, credits = None, taxes = None):
+    def __init__(self, revenue = None, deductions = None, credits = None, taxes = None, calendar = None):
 	#Main containers
 	self.revenue = df.DataFrame()
 	self.deductions = df.DataFrame()        
+	#The streams are aligned on a day-offset calendar; revenue and deductions above are the frame views of these
+	self.calendar = calendar
+	self._revenue = None
+	self._deductions = None
+	self._periods = None		#period codes of the master schedule, shared by all the taxes and credits
 	self.taxes = {}
 	self.credits = {}
 
@@ -2675,7 +3080,8 @@ class TaxManager(object):
 		    raise TaxManagerError, "%s is not a column in the given revenue dataframe" % col
 	        if col in self.revenue.columns:
 		    raise TaxManagerError, "%s already exists in the revenue dataframe" % col
-	    self.revenue = self.revenue.join(rn_revenue[columns],how='outer').fillna(0.0)
+	    self._revenue = self._add_stream(self._revenue, rn_revenue, columns)
+	    self.revenue = self._revenue.to_frame()
 
     def add_deductions(self, deductions, name = "", columns = None):
         """Adds deduction streams from a dataframe"""
@@ -2704,7 +3110,17 @@ class TaxManager(object):
 		    raise TaxManagerError, "%s is not a column in the given deduction dataframe" % col
 		if col in self.deductions.columns:
 		    raise TaxManagerError, "%s already exists in the deductions dataframe" % col
-            self.deductions = self.deductions.join(rn_deductions[columns], how='outer').fillna(0.0)
+            self._deductions = self._add_stream(self._deductions, rn_deductions, columns)
+            self.deductions = self._deductions.to_frame()
+
+    def _add_stream(self, streams, frame, columns):
+        """Lays the columns of frame out on the calendar (anchored on the first stream if none was given) and joins them onto streams"""
+        if self.calendar is None:
+            self.calendar = st.anchor_calendar(frame.index)
+        new = self.calendar.schedule(frame, list(columns))
+        if streams is None:
+            return new
+        return streams.join(new)
 
     
     def add_taxes(self, taxes=None, revenue_associations=None, deduction_associations=None, credit_associations = None):
@@ -2838,26 +3254,34 @@ class TaxManager(object):
 	    raise TaxManagerError, "%s is not a valid type of TaxCredit" % kind
         self.add_credits(new_credit, revenue_associations = revenue)
 
+    @profiled('tax')
     def build_tax_schedule(self):
 	"""Builds the aggregated tax schedule"""
 	#Create the overall schedule
 	#For each of the taxes, reset the basis, deductions, and credits
 	#loop on a convergence criterion
-	master = self.revenue.join(self.deductions, how = 'outer').fillna(0.0)
+	streams = [x for x in (self._revenue, self._deductions) if x is not None]
+	if streams:
+	    master = streams[0].join(*streams[1:]).to_frame()
+	else:
+	    master = df.DataFrame()
 
 	self.schedule = df.DataFrame(index = master.index)
 	self.schedule['tax'] = np.zeros(len(self.schedule.index))
+	if self._periods is None or not self._periods.matches(master.index):
+	    self._periods = st.PeriodCodes(master.index)
 
 	#set the bases, deductions, and credits for each of the taxes
-	last = df.DataFrame(index = self.schedule.index)
 
 	for credit in self.credits:
+	    self.credits[credit].periods = self._periods
 	    try:
 		self.credits[credit].basis = master[self.revenue_dict[credit]]
 	    except KeyError:
 		raise TaxManagerError, "%s is underdefined.  Need to link a basis to this credit" % credit
 	
 	for tax in self.taxes:
+	    self.taxes[tax].periods = self._periods
 	    try:
 	        self.taxes[tax].basis = master[self.revenue_dict[tax]]
 	        self.taxes[tax].deductions = master[self.deductions_dict[tax]]
@@ -2870,37 +3294,122 @@ class TaxManager(object):
 	    if tax in self.deductible_taxes:
 		for d_tax in self.deductible_taxes[tax]:
 		    self.taxes[tax].deductions[d_tax] = np.zeros(len(self.taxes[tax].deductions.index))
-	    last[tax] = np.zeros(len(self.schedule.index))
-	converged = False
-	N = 0
-
-	while not converged:# and N < 5:
-	    converged = True
-	    for tax in self.taxes:
-		self.taxes[tax].build_tax_schedule()
-	        #determine convergence
-	        self.schedule['%s_tax'%tax] = self.taxes[tax].schedule['tax']
-	        self.schedule.fillna(0.0)
-		converged = converged and (np.absolute((self.schedule['%s_tax' % tax] - last[tax]))<0.01).all()	#using absolute convergence here
-		last[tax] = self.schedule['%s_tax' % tax]
-		
-
 
-	    for tax in self.taxes:
-		if tax in self.deductible_taxes:
-		   for d_tax in self.deductible_taxes[tax]:
-			self.taxes[tax].deductions[d_tax] = self.taxes[d_tax].schedule['tax']
-		   self.taxes[tax].deductions.fillna(0.0) 	#deal with mismatches
-
-   
+	#solve the taxes in dependency order: each one after the taxes it deducts, and cycles of mutually deductible taxes together
+	self.solve_info = []
+	results = {}
+	for component in tt.dependency_order(dict((tax, self.deductible_taxes.get(tax, [])) for tax in self.taxes)):
+	    self._solve_component(component, results)
 
+	for tax in self.taxes:
+	    self.schedule['%s_tax' % tax] = results[tax]
 	self.schedule['tax'] = np.zeros(len(self.schedule.index))
 	for tax in self.taxes:
 	    self.schedule['tax'] += self.schedule['%s_tax' % tax]
 
+    def _build_with(self, name, results):
+        """Builds one tax, deducting the current schedules of the taxes it deducts; returns its daily tax"""
+        tax = self.taxes[name]
+        for d_tax in self.deductible_taxes.get(name, []):
+            tax.deductions[d_tax] = results[d_tax]
+        tax.build_tax_schedule()
+        return tax.schedule['tax']
+
+    def _solve_component(self, component, results):
+        """Fills in results with the daily taxes of one strongly connected component of the deductible taxes"""
+        if len(component) == 1 and component[0] not in self.deductible_taxes.get(component[0], []):
+            results[component[0]] = self._build_with(component[0], results)
+            self.solve_info.append({'taxes':component, 'method':'direct', 'builds':1})
+            return
+
+        current = dict(results)
+        builds = 0
+        if all(self._is_linear(tax) for tax in component):
+            predicted = self._linear_solution(component, results)
+            if predicted is not None:
+                current.update(predicted)
+                built = dict((tax, self._build_with(tax, current)) for tax in component)
+                builds = len(component)
+                if max(self._change(built[tax], predicted[tax]) for tax in component) < self.tolerance:
+                    results.update(built)
+                    self.solve_info.append({'taxes':component, 'method':'linear', 'builds':builds})
+                    return
+                current.update(built)		#a loss year or a credit made it nonlinear; iterate from here
+
+        for tax in component:
+            if tax not in current:
+                current[tax] = pd.Series(np.zeros(len(self.schedule.index)), index = self.schedule.index)
+        #Gauss-Seidel passes, extrapolating every third iterate
+        history = []
+        for n in range(self.max_iterations):
+            change = 0.0
+            for tax in component:
+                new = self._build_with(tax, current)
+                change = max(change, self._change(new, current[tax]))
+                current[tax] = new
+            builds += len(component)
+            if change < self.tolerance:
+                results.update((tax, current[tax]) for tax in component)
+                self.solve_info.append({'taxes':component, 'method':'iterative', 'builds':builds})
+                return
+            history.append(np.concatenate([np.asarray(current[tax], dtype = float) for tax in component]))
+            if len(history) == 3:
+                x = tt.extrapolate(*history)
+                history = []
+                if x is not None:
+                    for (tax, values) in zip(component, np.split(x, len(component))):
+                        current[tax] = pd.Series(values, index = current[tax].index)
+        raise TaxManagerError, "The deductible taxes %s did not converge in %s passes" % (component, self.max_iterations)
+
+    def _change(self, new, old):
+        if len(new) == 0:
+            return 0.0
+        return np.nanmax(np.absolute(np.asarray(new, dtype = float) - np.asarray(old, dtype = float)))
+
+    def _is_linear(self, name):
+        """A fractional tax at a single rate with no credits is linear in its deductions, as long as no year has a loss"""
+        tax = self.taxes[name]
+        return isinstance(tax, GraduatedFractionalTax) and not isinstance(tax, GraduatedFixedTax) and sorted(tax.rate) == [0.0] and not tax.credits
+
+    def _linear_solution(self, component, results):
+        """Solves a cycle of linear taxes that deduct one another as one small linear system in each year's taxes, and
+        apportions the annual taxes over the days by gross income; returns None if the system is singular"""
+        index = self.schedule.index
+        periods = self._periods
+        pos = dict((tax, i) for (i, tax) in enumerate(component))
+        n = len(component)
+        A = np.zeros((n, n))
+        rates = np.zeros(n)
+        income = np.zeros((n, len(periods)))
+        weights = np.zeros((n, len(index)))
+        for tax in component:
+            i = pos[tax]
+            rates[i] = self.taxes[tax].rate[0.0]
+            gross = np.asarray(self.taxes[tax].basis.values, dtype = float).sum(axis = 1)
+            deducted = set(self.deductible_taxes.get(tax, []))
+            deductions = self.taxes[tax].deductions
+            taxable = gross - np.asarray(deductions[[c for c in deductions.columns if c not in deducted]].values, dtype = float).sum(axis = 1)
+            for d_tax in deducted:
+                if d_tax in pos:
+                    A[i, pos[d_tax]] = 1.0
+                else:
+                    taxable -= np.asarray(results[d_tax], dtype = float)
+            income[i] = periods.aggregate(taxable)
+            annual_gross = periods.spread(periods.aggregate(gross))
+            weights[i] = np.where(annual_gross != 0.0, gross/np.where(annual_gross != 0.0, annual_gross, 1.0), 0.0)
+        try:
+            annual = np.linalg.solve(np.eye(n) + rates[:, np.newaxis]*A, rates[:, np.newaxis]*income)
+        except np.linalg.LinAlgError:
+            return None
+        return dict((tax, pd.Series(periods.spread(annual[pos[tax]])*weights[pos[tax]], index = index)) for tax in component)
+
 
 class PF_FileLoader:
     """Reads the XML save file for a given project"""
+    #Older files name some parameters differently; the startup period always comes from the capital expense schedule
+    renamed_params = {'Initial_year':'Initial_period', 'initial_year':'Initial_period', 'target_IRR':'Target_IRR'}
+    ignored_params = ['Startup_year', 'Startup_period']
+    depreciation_types = {'straight-line':'StraightLine', 'MACRS':'MACRS'}
     def __init__(self, source):
         if isinstance(source, str):
 	    self.doc = etree.parse(source)	#Should do some error checking here in the future
@@ -2920,46 +3429,69 @@ class PF_FileLoader:
         
 
     def _load_cap_costs(self):
+        #Each item is quoted as its installed cost at the initial period, for the design capacity, and depreciated by the file's method
         capcosts = self.docroot.find("capital_costs")
+        if capcosts is None or len(capcosts) == 0:
+            return
         new_capcosts = CapitalCosts()
-        for cap_exp in capcosts[0]:
-            new_cap_exp = CapitalExpense(cap_exp.attrib['name'])
-            for prop in cap_exp:
-                if prop.tag != "comment":
-                    setattr(new_cap_exp, prop.tag, float(prop.text))
-                else:
-                    new_cap_exp.comment.append(prop.text)
-            new_capcosts.add_capital_item(new_cap_exp)
+        for cap_exp in self._section(capcosts, "direct_capital_costs"):
+            props = dict((prop.tag, prop.text) for prop in cap_exp if prop.tag != "comment")
+            cost = self._cast_special(props.get('uninstalled_cost'), float)
+            if not cost:
+                continue
+            factor = self._cast_special(props.get('installation_factor', '1.0'), float)
+            new_cap_exp = CapitalExpense(tag = cap_exp.attrib['name'], name = cap_exp.attrib['name'], quote_basis = self._quote(CapitalExpenseQuoteBasis, cost, installation_model = FactoredInstallModel(factor if factor is not None else 1.0)), depreciation_type = self._depreciation_type())
+            for prop in cap_exp.findall("comment"):
+                new_cap_exp.add_comment(prop.text)
+            new_capcosts.add_direct_capital_item(new_cap_exp)
         
-        for cap_exp in capcosts[1]:                  #OK, this could be more introspective, but bleh for now
-            if cap_exp.attrib['depreciable'] == 'True':
-                new_capcosts.indirect_deprec_capital[cap_exp.tag] = self._cast_special(cap_exp.text,float)
-            else:
-                new_capcosts.indirect_nondeprec_capital[cap_exp.tag] = self._cast_special(cap_exp.text,float)
+        for cap_exp in self._section(capcosts, "indirect_capital_costs"):
+            cost = self._cast_special(cap_exp.text, float)
+            if not cost:
+                continue
+            depreciable = cap_exp.attrib.get('depreciable', 'True').strip() == 'True'
+            new_capcosts.add_indirect_capital_item(IndirectCapitalExpense(tag = cap_exp.tag, name = cap_exp.tag, quote_basis = self._quote(IndirectCapitalExpenseQuoteBasis, cost, method = 'fixed'), depreciation_type = self._depreciation_type() if depreciable else 'NonDepreciable'))
         self.project.setCapitalCosts(new_capcosts)
 
 
     def _load_variable_costs(self):
-        new_variable_costs = VariableCosts()
+        #unit_cost is the price of one unit of the expense; prod_req is the amount of the expense used per unit of production
         var_costs = self.docroot.find("variable_costs")
+        if var_costs is None:
+            return
+        new_variable_costs = VariableCosts()
         for var_exp in var_costs:
-            new_var_exp = VariableExpense(var_exp.attrib["name"])
+            price = None
+            rate = None
             for prop in var_exp:
                 if prop.tag == "unit_cost":
-                    new_var_exp.unit_cost = uv.UnitVal(self._cast_special(prop.text,float),prop.attrib["units"])
+                    price = (self._cast_special(prop.text,float), prop.attrib["units"])
                 elif prop.tag == "prod_req":
-                    new_var_exp.prod_req = uv.UnitVal(self._cast_special(prop.text,float), prop.attrib["units"])
+                    if "units" in prop.attrib:
+                        units = prop.attrib["units"]
+                    else:
+                        units = "%s/%s" % (prop.attrib["unit_var"], prop.attrib["unit_prod"])
+                    rate = uv.UnitVal(self._cast_special(prop.text,float), units)
                 else:
                     pass
-            new_variable_costs.add_variable_exp(new_var_exp)
+            if price is None or not price[0] or rate is None:
+                raise BadVariableExpenseInput, "The variable expense %s needs a unit_cost and a prod_req" % var_exp.attrib["name"]
+            quote = self._quote(VariableExpenseQuoteBasis, price[0], size_basis = uv.UnitVal(1.0, "1/(%s)" % price[1]))
+            new_variable_costs.add_variable_expense(VariableExpense(var_exp.attrib["name"], quote_basis = quote, rate = rate))
         self.project.setVariableCosts(new_variable_costs)
 
     def _load_fixed_costs(self):
-        new_fixed_costs = FixedCosts()
+        #The fixed costs are annual amounts
         fixed_costs = self.docroot.find("fixed_costs")
+        if fixed_costs is None:
+            return
+        new_fixed_costs = FixedCosts()
         for fixed_cost in fixed_costs:
             #again, error checking needed here to make this robust to bad XML
-            new_fixed_costs[fixed_cost.tag] = self._cast_special(fixed_cost.text, float)
+            cost = self._cast_special(fixed_cost.text, float)
+            if not cost:
+                continue
+            new_fixed_costs.add_fixed_cost(FixedExpense(fixed_cost.tag, quote_basis = self._quote(FixedExpenseQuoteBasis, cost, freq = 'A')))
         self.project.setFixedCosts(new_fixed_costs)
 
     def _load_fin_params(self):
@@ -2967,51 +3499,84 @@ class PF_FileLoader:
         integers = ['Analysis_period', 'Depreciation_length', 'Plant_life']
         fin_params = self.docroot.find("financial_parameters")
         for fin_param in fin_params:
-            if fin_param.tag == "Design_cap":				#reflects new naming convention NOT yet in use
-                new_fin_params[fin_param.tag] = uv.UnitVal(self._cast_special(fin_param.text,float), fin_param.attrib["units"])
-            elif fin_param.tag == "Depreciation_type":
-                new_fin_params[fin_param.tag] = fin_param.text
-            elif fin_param.tag == "Initial_period":
-                new_fin_params[fin_param.tag] = dt.datetime.strptime(fin_param.text,"%Y-%m-%d")
-            elif fin_param.tag == "Capital_expense_breakdown":
-                if fin_param.attrib["type"] == "simple":
+            tag = PF_FileLoader.renamed_params.get(fin_param.tag, fin_param.tag)
+            if tag in PF_FileLoader.ignored_params or fin_param.text is None or fin_param.text.strip() == 'None':
+                continue
+            if tag == "Design_cap":				#reflects new naming convention NOT yet in use
+                new_fin_params[tag] = uv.UnitVal(self._cast_special(fin_param.text,float), fin_param.attrib["units"])
+            elif tag == "Depreciation_type":
+                new_fin_params[tag] = fin_param.text.strip()
+            elif tag == "Initial_period":
+                if fin_param.tag == "Initial_period":
+                    new_fin_params[tag] = dt.datetime.strptime(fin_param.text.strip(),"%Y-%m-%d")
+                else:
+                    new_fin_params[tag] = dt.datetime(int(fin_param.text), 1, 1)
+            elif tag == "Capital_expense_breakdown":
+                if fin_param.attrib.get("type") == "simple":
                     breakdown = []
                     for item in fin_param:
                         breakdown.append(float(item.text))
-                    new_fin_params[fin_param.tag] = breakdown
+                    new_fin_params[tag] = breakdown
                 else:
                     pass						#include cases for other types of capital cost breakdowns here
                     
-            elif fin_param.tag in integers:
-                new_fin_params[fin_param.tag] = self._cast_special(fin_param.text,int)
+            elif tag in integers:
+                new_fin_params[tag] = self._cast_special(fin_param.text,int)
             else:
-                new_fin_params[fin_param.tag] = self._cast_special(fin_param.text,float)
-        self.project.setFinancialParameters(new_fin_params)		#This function does not yet exist, so this won't work right now
+                new_fin_params[tag] = self._cast_special(fin_param.text,float)
+        self.project.setFinancialParameters(new_fin_params)
 
     def _load_debt(self):
-        new_debt_portfolio = DebtPortfolio()
+        #Loans start on January 1 of their starting year and run for a whole number of years
         securities = self.docroot.find("debt_portfolio")
+        if securities is None:
+            return
+        new_debt_portfolio = DebtPortfolio()
         for security in securities:
             if security.tag == "loan":
-                new_loan = Loan(security.attrib['name'])
-                for prop in security:
-                    if prop.tag == 'strt_year' or prop.tag == 'pmt_freq':
-                        setattr(new_loan, prop.tag, self._cast_special(prop.text,int))
-                    else:
-                        setattr(new_loan, prop.tag, self._cast_special(prop.text,float))
-                new_debt_portfolio.add_loan(new_loan)
+                props = dict((prop.tag, self._cast_special(prop.text, float)) for prop in security if prop.tag != 'comment')
+                start = props.get('strt_yr', props.get('strt_year'))
+                init_date = dt.datetime(int(start), 1, 1) if start is not None else None
+                #The term is a whole number of calendar years from the start, so it needs the start date
+                term = None
+                if init_date is not None and props.get('term') is not None:
+                    term = (init_date + DateOffset(years = int(props['term']))).to_pydatetime() - init_date
+                new_loan = Loan(name = security.attrib['name'], principal = props.get('principal'), rate = props.get('rate'), pmt_freq = int(props['pmt_freq']) if props.get('pmt_freq') is not None else None,
+                                term = term, init_date = init_date)
+                new_debt_portfolio.add_debt(new_loan)
             elif security.tag == "bond":
                 pass
 
         self.project.setDebt(new_debt_portfolio)
 
+    def _quote(self, kind, price, **kwargs):
+        """A quote at the initial period, sized at the design capacity unless a size basis is given"""
+        for key in ['Initial_period', 'Design_cap']:
+            if self.project.fin_param[key] is None:
+                raise ProjFinError, "%s must be set in the financial parameters to load the project's costs" % key
+        kwargs.setdefault('size_basis', self.project.fin_param['Design_cap'])
+        return kind(base_price = price, date = self.project.fin_param['Initial_period'], **kwargs)
+
+    def _depreciation_type(self):
+        """The capital item depreciation_type for the file's Depreciation_type"""
+        method = self.project.fin_param['Depreciation_type']
+        if method not in PF_FileLoader.depreciation_types:
+            raise ProjFinError, "Unknown depreciation method %s" % method
+        return PF_FileLoader.depreciation_types[method]
+
+    def _section(self, parent, tag):
+        section = parent.find(tag)
+        if section is None:
+            return []
+        return section
+
 
     def load(self):
         self._load_data()
         return self.project
 
     def _cast_special(self, text, typ):
-        if text == 'None':
+        if text is None or text.strip() == 'None':
             return None
         else:
             return typ(text)            
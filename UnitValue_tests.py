@@ -8,6 +8,9 @@ Chris Perkins
 import UnitValues as uv
 import unittest
 import unitConversion as uc
+import numpy as np
+import pickle
+import copy
 
 
 
@@ -154,6 +157,86 @@ class UnitValueTests(unittest.TestCase):
 	a.value = 0
 	self.assertRaises(ValueError, lambda: 35/a)
 
+    def testSharedConverter(self):
+	"""UnitVals share one converter and interned units, carry no instance dict, and survive pickling"""
+        a = uv.UnitVal(value = 35, units = 'gal')
+        b = uv.UnitVal(value = 10, units = ''.join(['g', 'al']))
+        self.assertTrue(a.conv is b.conv is uv.converter)
+        self.assertTrue(a.units is b.units)
+        self.assertFalse(hasattr(a, '__dict__'))
+        self.assertRaises(AttributeError, setattr, a, 'color', 'red')
+        for protocol in (0, 2):
+            self.assertEqual(pickle.loads(pickle.dumps(a, protocol)), a)
+        self.assertEqual(copy.deepcopy(a), a)
+
+
+class UnitArrayTests(unittest.TestCase):
+
+    def testUnitArrayArithmetic(self):
+        """UnitArrays add in the left operand's units and combine units on multiplication, with UnitArrays or UnitVals"""
+        a = uv.UnitArray([1.0, 2.0, 3.0], 'gal')
+        b = uv.UnitArray([10.0, 20.0, 30.0], 'L')
+        c = a + b
+        self.assertEqual(c.units, 'gal')
+        self.assertTrue(np.allclose(c, [1.0 + 10/3.785, 2.0 + 20/3.785, 3.0 + 30/3.785], rtol = 1.0E-3))
+        d = uv.UnitVal(1.0, 'L') - a
+        self.assertEqual(d.units, 'L')
+        self.assertTrue(np.allclose(d, [1.0 - 3.785, 1.0 - 7.571, 1.0 - 11.356], rtol = 1.0E-3))
+        e = uv.UnitVal(2.0, '$/gal') * a
+        self.assertEqual(e.units, '$/gal*gal')
+        self.assertEqual(list(e), [2.0, 4.0, 6.0])
+        self.assertEqual((a/b).units, 'gal/(L)')
+        self.assertEqual((1.0/a).units, '(gal)^-1')
+        self.assertEqual((a*2).units, 'gal')
+        self.assertEqual(list(a.dimensions), list(uv.converter.unit_vector('m^3')[1]))
+        self.assertRaises(TypeError, lambda: a + uv.UnitArray([1.0, 2.0, 3.0], 'kg'))
+        self.assertEqual((np.ones(3) + a).units, 'gal')
+        self.assertRaises(uv.BadUnitError, uv.UnitArray, [1.0], 35)
+
+    def testUnitArrayViews(self):
+        """Slices share the data and the units, and conversions return new arrays"""
+        a = uv.UnitArray(np.arange(10.0), 'm')
+        s = a[2:5]
+        self.assertEqual(s.units, 'm')
+        s += uv.UnitVal(100.0, 'cm')
+        self.assertEqual(list(a[:6]), [0.0, 1.0, 3.0, 4.0, 5.0, 5.0])
+        self.assertRaises(TypeError, s.__imul__, uv.UnitVal(1.0, 'm'))
+        f = a.to('ft')
+        self.assertEqual(f.units, 'ft')
+        self.assertAlmostEqual(f[1], 3.2808, 3)
+        self.assertEqual(a[1], 1.0)
+        t = uv.UnitArray([0.0, 100.0], 'C').to('K')
+        self.assertTrue(np.allclose(t, [273.15, 373.15]))
+        g = (a*uv.UnitVal(1.0, 'kg*m/s^2')).simplified()
+        self.assertEqual(g.units, uv.converter.simplify_units('m*kg*m/s^2')[1])
+        self.assertEqual(list(g.dimensions), list(uv.converter.unit_vector('J')[1]))
+        self.assertEqual(list(g), list(a))
+
+    def testUnitArrayPickling(self):
+        """Pickled and copied UnitArrays keep their units and values"""
+        a = uv.UnitArray([1.0, 2.0, 3.0], 'kg/s')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            b = pickle.loads(pickle.dumps(a, protocol))
+            self.assertTrue(isinstance(b, uv.UnitArray))
+            self.assertEqual(b.units, 'kg/s')
+            self.assertEqual(list(b), [1.0, 2.0, 3.0])
+        self.assertEqual(copy.deepcopy(a).units, 'kg/s')
+        self.assertEqual(pickle.loads(pickle.dumps(a[1:], 2)).units, 'kg/s')
+
+    def testUnitArrayComparisons(self):
+        """Comparisons give plain boolean arrays, converting UnitArray and UnitVal operands into the array's units"""
+        a = uv.UnitArray([0.5, 1.0, 2.0], 'm')
+        c = a > 1
+        self.assertEqual(type(c), np.ndarray)
+        self.assertEqual(c.dtype, bool)
+        self.assertEqual(list(c), [False, False, True])
+        self.assertEqual(list(1 < a), [False, False, True])
+        self.assertEqual(list(a >= uv.UnitVal(100.0, 'cm')), [False, True, True])
+        self.assertEqual(list(a == uv.UnitArray([50.0, 10.0, 200.0], 'cm')), [True, False, True])
+        self.assertEqual(type(a != a), np.ndarray)
+        self.assertEqual(list(a[a <= 1.0]), [0.5, 1.0])
+        self.assertRaises(TypeError, lambda: a < uv.UnitVal(1.0, 'kg'))
+
 if __name__ == "__main__":
     unittest.main()
 
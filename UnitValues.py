@@ -1,3 +1,4 @@
+import numpy as np
 import unitConversion as uc
 
 class UnitValueError(Exception):
@@ -9,11 +10,27 @@ class BadUnitError(UnitValueError):
 class BadValueError(UnitValueError):
     pass
 
+#One converter shared by every UnitVal and UnitArray; its parses and conversions are cached process-wide anyway
+converter = uc.UnitConverter()
+
+#Intern the (str) units of UnitVals, so the many values quoted in the same units share one string
+intern_units = True
+
 class UnitVal(object):
+    """A value with units.  UnitVals carry no per-instance dictionary and share the module's converter, so models with
+    thousands of quoted line items stay small."""
+    __slots__ = ('_value', '_units')
+    conv = converter
+
     def __init__(self, value = None, units = None):
         self.value = value
         self.units = units
-	self.conv = uc.UnitConverter()
+
+    def __getstate__(self):
+        return (self._value, self._units)
+
+    def __setstate__(self, state):
+        (self._value, self._units) = state
 
     @property
     def units(self):
@@ -23,7 +40,8 @@ class UnitVal(object):
     def units(self, v):
         if v is not None and not isinstance(v, basestring):
             raise BadUnitError, "The units must be a basestring"
-
+        if intern_units and type(v) is str:
+            v = intern(v)
         self._units = v
 
     @property
@@ -59,6 +77,8 @@ class UnitVal(object):
 
     def __add__(self, other):
         """Returns the sum of this with other, in this' units, as a UnitVal"""
+        if isinstance(other, UnitArray):
+            return NotImplemented
         if not isinstance(other, UnitVal):
             raise TypeError, "UnitVal cannot be added to %s" % type(other)
         #conv = uc.UnitConverter()
@@ -70,6 +90,8 @@ class UnitVal(object):
      
     def __sub__(self, other):
         """Returns the difference of this with other, in this' units, as a UnitVal"""
+        if isinstance(other, UnitArray):
+            return NotImplemented
         if not isinstance(other, UnitVal):
             raise TypeError, "UnitVal cannot be added to %s" % type(other)
         #conv = uc.UnitConverter()
@@ -117,6 +139,8 @@ class UnitVal(object):
         """Returns the product of this with other, in this' units, as a UnitVal"""
         #Want to include the ability to do scalar multiplication as well as uv multiplication
 	#conv = uc.UnitConverter()
+        if isinstance(other, UnitArray):
+            return NotImplemented
         if isinstance(other, UnitVal):
             
             try:
@@ -139,6 +163,8 @@ class UnitVal(object):
     def __div__(self, other):
         """Returns the quotient of this by other, in this' units, as a UnitVal"""
 	#conv = uc.UnitConverter()
+        if isinstance(other, UnitArray):
+            return NotImplemented
         if isinstance(other, UnitVal): 
 
             try:
@@ -210,3 +236,154 @@ class UnitVal(object):
                 raise ValueError, "Divide by zero error"  #May want to make this np.inf instead
             new_units = "(%s)^-1" % self.units
             return UnitVal(other/self.value, new_units)
+
+
+def _magnitude(x):
+    """The bare values of a UnitArray or UnitVal"""
+    return np.asarray(x) if isinstance(x, UnitArray) else x.value
+
+def _values_in(x, units):
+    """The values of a UnitArray or UnitVal in units: the units are checked once and the values scaled once"""
+    try:
+        (scale, offset, signature) = converter.conversion(x.units, units)
+    except uc.InconsistentUnitError:
+        raise TypeError, "Inconsistent units, %s, %s" % (x.units, units)
+    if offset == 0.0:
+        return _magnitude(x) * scale
+    return _magnitude(x) * scale + offset
+
+
+class UnitArray(np.ndarray):
+    """An array of values that all carry the same units, such as a schedule column.
+
+    Arithmetic works on the whole array at once.  Adding or subtracting a UnitArray or UnitVal checks the units once and
+    converts the other operand with one scalar multiply into the units of the left operand, as UnitVal does.
+    Multiplication and division combine the unit strings without simplifying them.  Numbers and plain arrays are bare
+    values in the units of the array, so they leave the units alone.  Comparisons convert the other operand the same way and return
+    plain boolean arrays.  Slices and views share the data and keep the units.  Other numpy functions also keep the units, so
+    use np.asarray() for the bare values when the units do not carry through."""
+
+    def __new__(cls, values, units = None):
+        if units is not None and not isinstance(units, basestring):
+            raise BadUnitError, "The units must be a basestring"
+        try:
+            a = np.asarray(values, dtype = float).view(cls)
+        except (TypeError, ValueError):
+            raise BadValueError, "The values must be numeric"
+        a.units = units
+        return a
+
+    def __array_finalize__(self, obj):
+        self.units = getattr(obj, 'units', None)
+
+    def __reduce__(self):
+        #ndarray pickles only the data, so the units ride along at the end of its state
+        (constructor, args, state) = np.ndarray.__reduce__(self)
+        return (constructor, args, state + (self.units,))
+
+    def __setstate__(self, state):
+        np.ndarray.__setstate__(self, state[:-1])
+        self.units = state[-1]
+
+    def __repr__(self):
+        return "UnitArray(%s, %r)" % (np.asarray(self).tolist(), self.units)
+
+    @property
+    def dimensions(self):
+        """The exponent of each base unit in the units"""
+        return converter.unit_vector(self.units)[1]
+
+    def to(self, new_units):
+        """Returns a copy converted to the new units"""
+        return UnitArray(_values_in(self, new_units), new_units)
+
+    def simplified(self):
+        """Returns a copy in the simplified units"""
+        (factor, units) = converter.simplify_units(self.units)
+        return UnitArray(np.asarray(self) * factor, units)
+
+    def _addend(self, other):
+        """The values of other in this array's units; numbers and plain arrays are taken to be in these units already"""
+        if isinstance(other, (UnitArray, UnitVal)):
+            return _values_in(other, self.units)
+        return other
+
+    def __add__(self, other):
+        return UnitArray(np.asarray(self) + self._addend(other), self.units)
+
+    def __radd__(self, other):
+        if isinstance(other, UnitVal):
+            return UnitArray(other.value + _values_in(self, other.units), other.units)
+        return UnitArray(other + np.asarray(self), self.units)
+
+    def __sub__(self, other):
+        return UnitArray(np.asarray(self) - self._addend(other), self.units)
+
+    def __rsub__(self, other):
+        if isinstance(other, UnitVal):
+            return UnitArray(other.value - _values_in(self, other.units), other.units)
+        return UnitArray(other - np.asarray(self), self.units)
+
+    def __iadd__(self, other):
+        np.asarray(self)[...] += self._addend(other)
+        return self
+
+    def __isub__(self, other):
+        np.asarray(self)[...] -= self._addend(other)
+        return self
+
+    def __mul__(self, other):
+        if isinstance(other, (UnitArray, UnitVal)):
+            return UnitArray(np.asarray(self) * _magnitude(other), "%s*%s" % (self.units, other.units))
+        return UnitArray(np.asarray(self) * other, self.units)
+
+    def __rmul__(self, other):
+        if isinstance(other, UnitVal):
+            return UnitArray(other.value * np.asarray(self), "%s*%s" % (other.units, self.units))
+        return UnitArray(other * np.asarray(self), self.units)
+
+    def __div__(self, other):
+        if isinstance(other, (UnitArray, UnitVal)):
+            return UnitArray(np.asarray(self) / _magnitude(other), "%s/(%s)" % (self.units, other.units))
+        return UnitArray(np.asarray(self) / other, self.units)
+
+    def __rdiv__(self, other):
+        if isinstance(other, UnitVal):
+            return UnitArray(other.value / np.asarray(self), "%s/(%s)" % (other.units, self.units))
+        return UnitArray(other / np.asarray(self), "(%s)^-1" % self.units)
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __imul__(self, other):
+        #the data may be shared with other views, so the units can only change out of place
+        if isinstance(other, (UnitArray, UnitVal)):
+            raise TypeError, "Multiply out of place to change the units of a UnitArray"
+        np.asarray(self)[...] *= other
+        return self
+
+    def __idiv__(self, other):
+        if isinstance(other, (UnitArray, UnitVal)):
+            raise TypeError, "Divide out of place to change the units of a UnitArray"
+        np.asarray(self)[...] /= other
+        return self
+
+    __itruediv__ = __idiv__
+
+    def __lt__(self, other):
+        return np.asarray(self) < self._addend(other)
+
+    def __le__(self, other):
+        return np.asarray(self) <= self._addend(other)
+
+    def __gt__(self, other):
+        return np.asarray(self) > self._addend(other)
+
+    def __ge__(self, other):
+        return np.asarray(self) >= self._addend(other)
+
+    def __eq__(self, other):
+        return np.asarray(self) == self._addend(other)
+
+    def __ne__(self, other):
+        return np.asarray(self) != self._addend(other)
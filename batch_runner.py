@@ -0,0 +1,108 @@
+"""batch_runner.py
+Command line tool that evaluates a batch of saved projects in parallel and writes a summary table
+
+usage: python batch_runner.py projects/ site_*.xml --price 2.50 --workers 8 --output summary.csv --sheets sheets/
+"""
+
+import os
+import sys
+import glob
+import argparse
+import multiprocessing as mp
+import numpy as np
+import ProjectFinance_daily as pf
+import dataFrame_pd as df
+from pf_errors import *
+
+
+summary_columns = ['file', 'NPV', 'IRR', 'breakeven_price', 'peak_debt', 'payback', 'error']
+
+
+def find_project_files(paths):
+    """Expands directories (every .xml file in them) and glob patterns into a sorted list of unique files"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.xml')))
+        else:
+            files.update(f for f in glob.glob(path) if os.path.isfile(f))
+    return sorted(files)
+
+
+def evaluate_file(path, price, mode = "fixed", rate = None, resolution = 'D', sheet_dir = None):
+    """Loads one project file and returns its summary row.  rate is the annual discount rate for the NPV (each project's Target_IRR by
+    default), the IRR is annual, and the break-even price is the price at which the IRR reaches Target_IRR (None if there is none).
+    A project that fails to load or assemble gets a row with the error instead, so one bad file does not stop the batch."""
+    row = dict((col, None) for col in summary_columns)
+    row['file'] = path
+    try:
+        project = pf.PF_FileLoader(path).load()
+        if resolution != project.resolution:
+            project.setResolution(resolution)
+        project.assembleFinancials((price, mode))
+        if rate is None:
+            rate = project.fin_param['Target_IRR']
+        row['NPV'] = project.calcNPV(project.period_rate(rate))
+        row['IRR'] = project.annual_rate(project._irr.solve(project.cash_sheet['Net_cash_flow']))
+        row['peak_debt'] = project.calcPeakDebt()
+        row['payback'] = project.calcPayback()
+        if sheet_dir is not None:
+            project.cf_sheet.to_csv(os.path.join(sheet_dir, os.path.splitext(os.path.basename(path))[0] + '.csv'))
+        if mode == "fixed":
+            #solve_price leaves the sheet at the break-even price, so this comes after the sheet is written
+            try:
+                row['breakeven_price'] = project.solve_price()
+            except ProjFinError:
+                pass
+    except Exception, e:
+        row['error'] = "%s: %s" % (type(e).__name__, e)
+    return row
+
+
+def _evaluate_task(args):
+    return evaluate_file(*args)
+
+
+def run_batch(files, price, mode = "fixed", rate = None, resolution = 'D', sheet_dir = None, workers = None):
+    """Evaluates every file in a pool of worker processes; returns the summary table in file order"""
+    tasks = [(f, price, mode, rate, resolution, sheet_dir) for f in files]
+    if workers == 1:
+        rows = [_evaluate_task(t) for t in tasks]
+    else:
+        pool = mp.Pool(processes = workers)
+        try:
+            #Each file is loaded once, inside the worker that evaluates it
+            rows = pool.map(_evaluate_task, tasks, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    return df.DataFrame(rows, columns = summary_columns).set_index('file')
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Evaluate a batch of project files and write a summary of NPV, IRR, break-even price, peak debt, and payback")
+    parser.add_argument('paths', nargs = '+', help = "project files, directories of .xml files, or glob patterns")
+    parser.add_argument('--price', type = float, required = True, help = "base selling price of the product")
+    parser.add_argument('--mode', default = 'fixed', help = "price inflation mode (default: fixed)")
+    parser.add_argument('--rate', type = float, default = None, help = "annual discount rate for the NPV (default: each project's Target_IRR)")
+    parser.add_argument('--resolution', default = 'D', choices = sorted(pf.CapitalProject.resolutions.keys()), help = "period of the cash sheet rows (default: D)")
+    parser.add_argument('--workers', type = int, default = None, help = "number of worker processes (default: one per CPU)")
+    parser.add_argument('--output', default = 'summary.csv', help = "summary table file (default: summary.csv)")
+    parser.add_argument('--sheets', default = None, help = "directory for the cash sheet of each project (default: not written)")
+    args = parser.parse_args(argv)
+
+    files = find_project_files(args.paths)
+    if len(files) == 0:
+        parser.error("No project files matched %s" % " ".join(args.paths))
+    if args.sheets is not None and not os.path.isdir(args.sheets):
+        os.makedirs(args.sheets)
+
+    summary = run_batch(files, args.price, args.mode, args.rate, args.resolution, args.sheets, args.workers)
+    summary.to_csv(args.output)
+    failed = summary['error'].notnull().sum()
+    print "Evaluated %s projects (%s failed); summary written to %s" % (len(summary), failed, args.output)
+    return 1 if failed == len(summary) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""batch_runner_tests.py
+Unit tests for the batch scenario runner
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import batch_runner as br
+import ProjectFinance_daily as pf
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pf_batch_test.xml')
+
+
+class BatchRunnerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ('site_a.xml', 'site_b.xml', 'notes.txt'):
+            f = open(os.path.join(self.dir, name), 'w')
+            f.write("<project>")			#deliberately broken XML
+            f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFindProjectFiles(self):
+        """Directories give their .xml files, globs give their matches, and nothing is listed twice"""
+        files = br.find_project_files([self.dir, os.path.join(self.dir, 'site_*.xml'), os.path.join(self.dir, '*.txt')])
+        self.assertEqual([os.path.basename(f) for f in files], ['notes.txt', 'site_a.xml', 'site_b.xml'])
+        self.assertEqual(br.find_project_files([os.path.join(self.dir, 'gonzo*')]), [])
+
+    def testBadFilesDoNotStopTheBatch(self):
+        """A file that fails to load should get an error row, in file order, from either the serial or the pooled path"""
+        files = br.find_project_files([self.dir])
+        for workers in (1, 2):
+            summary = br.run_batch(files, 2.0, workers = workers)
+            self.assertEqual(list(summary.index), files)
+            self.assertTrue(summary['error'].notnull().all())
+            self.assertTrue(summary['NPV'].isnull().all())
+        self.assertEqual(br.main([self.dir, '--price', '2.0', '--workers', '1', '--output', os.path.join(self.dir, 'summary.csv')]), 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, 'summary.csv')))
+        self.assertRaises(SystemExit, br.main, [os.path.join(self.dir, 'gonzo*'), '--price', '2.0'])
+
+    def testEndToEnd(self):
+        """Each summary row should match loading the file and calling CapitalProject directly, from either path and at any resolution"""
+        for res in ('D', 'M'):
+            project = pf.PF_FileLoader(fixture).load()
+            project.setResolution(res)
+            project.assembleFinancials((0.8, 'fixed'))
+            npv = project.calcNPV(project.period_rate(0.15))
+            irr = project.annual_rate(project.calcIRR())
+            peak = project.calcPeakDebt()
+            payback = project.calcPayback()
+            ncf = project.cash_sheet['Net_cash_flow'].copy()
+            price = project.solve_price()
+            self.assertAlmostEqual(project.annual_rate(project.calcIRR()), 0.15, 10)
+            self.assertTrue(npv > 0.0 and 0.15 < irr < 1.0 and 0.0 < price < 0.8)
+            if res == 'D':
+                self.assertAlmostEqual(peak, 4000000.0, 6)
+
+            for workers in (1, 2):
+                summary = br.run_batch([fixture, os.path.join(self.dir, 'site_a.xml')], 0.8, resolution = res, sheet_dir = self.dir, workers = workers)
+                row = summary.loc[fixture]
+                self.assertTrue(row['error'] is None or row['error'] != row['error'])
+                self.assertAlmostEqual(row['NPV']/npv, 1.0, 10)
+                self.assertAlmostEqual(row['IRR'], irr, 10)
+                self.assertAlmostEqual(row['breakeven_price'], price, 10)
+                self.assertAlmostEqual(row['peak_debt'], peak, 6)
+                self.assertAlmostEqual(row['payback'], payback, 10)
+                self.assertTrue(summary['error'][os.path.join(self.dir, 'site_a.xml')] is not None)
+            #the written sheet is at the given price, not the break-even one
+            sheet = pd.read_csv(os.path.join(self.dir, 'pf_batch_test.csv'))
+            np.testing.assert_allclose(sheet['Net_cash_flow'], ncf)
+
+        #an explicit rate is annual too
+        row = br.evaluate_file(fixture, 0.8, rate = 0.08)
+        project = pf.PF_FileLoader(fixture).load()
+        project.assembleFinancials((0.8, 'fixed'))
+        self.assertAlmostEqual(row['NPV']/project.calcNPV(project.period_rate(0.08)), 1.0, 10)
+
+    def testPeakDebtAndPayback(self):
+        """Peak debt is the largest outstanding principal; payback is when the cumulative cash flow turns non-negative for good"""
+        proj = pf.PF_FileLoader(fixture).load()
+        sheet = proj.cash_sheet
+        sheet['Loan_proceeds'][[0, 100]] = [1000.0, 500.0]
+        sheet['Principal_payments'][50:60] = 10.0
+        sheet['Principal_payments'][200:300] = 14.0
+        self.assertEqual(proj.calcPeakDebt(), 1400.0)
+
+        sheet['Net_cash_flow'][0] = -1000.0
+        sheet['Net_cash_flow'][1:] = 1.0
+        self.assertEqual(proj.calcPayback(), 1000.0/365.0)
+        sheet['Net_cash_flow'][-1] = -1E9
+        self.assertEqual(proj.calcPayback(), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
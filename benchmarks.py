@@ -0,0 +1,214 @@
+"""benchmarks.py
+Micro-benchmarks for the schedule builders of ProjectFinance_daily on synthetic workloads of several sizes
+
+usage: python benchmarks.py --sizes small medium --repeat 5 --output bench.json --baseline nightly.json --threshold 0.25
+
+Each benchmark builds its inputs fresh before every timed run (builders like Loan.build_debt_schedule change their
+inputs) and starts from empty escalation and depreciation caches, so every run is timed cold.  The best of the runs is
+compared against the baseline.  The exit status is 1 when anything regressed.
+"""
+
+import sys
+import time
+import json
+import platform
+import argparse
+import datetime as dt
+import numpy as np
+import pandas as pd
+import ProjectFinance_daily as pf
+import UnitValues as uv
+import dataFrame_pd as df
+
+
+#Workload sizes: line items, analysis years, loans, tax brackets, and tax credits
+sizes = {'small':{'items':10, 'years':10, 'loans':2, 'brackets':3, 'credits':1},
+         'medium':{'items':100, 'years':20, 'loans':10, 'brackets':10, 'credits':3},
+         'large':{'items':2000, 'years':30, 'loans':50, 'brackets':25, 'credits':10}}
+
+start_date = dt.datetime(2015,1,1)
+
+
+def _dates(size):
+    return pd.date_range(start_date, start_date + dt.timedelta(days = 365*size['years']-1), freq = 'D')
+
+def _income(size):
+    """Daily income and deductions that grow steadily over the analysis period"""
+    dates = _dates(size)
+    income = 100.0*1.0001**np.arange(len(dates))
+    return (df.DataFrame({'income':income}, index = dates), df.DataFrame({'depreciation':income*0.05, 'interest':income*0.03}, index = dates))
+
+def _brackets(size):
+    n = size['brackets']
+    return dict(zip(np.linspace(0.0, 50000.0, n), np.linspace(0.10, 0.40, n)))
+
+
+#Each benchmark is a setup(size) that builds the inputs (not timed) and a run(inputs) that is timed
+
+def _clear_caches():
+    """Empties the module-level caches, so a run does not reuse the factors and kernels of the runs before it"""
+    pf.escalation_cache.clear()
+    pf.depreciation_kernels.clear()
+
+def setup_escalators(size):
+    _clear_caches()
+    dates = pd.Series(_dates(size))
+    return [(pf.InflationRateEscalator(rate = 0.01 + 0.001*(i % 25)), dates) for i in range(size['items'])]
+
+def run_escalators(inputs):
+    for (escalator, dates) in inputs:
+        escalator.escalate(basis_date = start_date, new_date = dates)
+
+
+def setup_depreciation(size):
+    _clear_caches()
+    length = min(size['years'], 20)
+    kinds = [('StraightLine', length), ('MACRS', max([3] + [l for l in (5, 7, 10, 15, 20) if l <= length]))]
+    return [kinds[i % 2] for i in range(size['items'])]
+
+def run_depreciation(inputs):
+    for (kind, length) in inputs:
+        schedule = getattr(pf, "%sDepreciationSchedule" % kind)(starting_period = start_date, length = length)
+        schedule.build(cost = 1.0E6)
+
+
+def _capital_item(i, size):
+    basis = pf.CapitalExpenseQuoteBasis(base_price = 1.0E5*(1 + i % 7), date = start_date, source = "Vendor", size_basis = uv.UnitVal(100, 'lb/hr'), scaler = pf.LinearScaler(), installation_model = pf.FactoredInstallModel(1.5), lead_time = dt.timedelta(days = 365))
+    item = pf.CapitalExpense(tag = "C-%s" % i, name = "Item %s" % i, quote_basis = basis, escalation_type = 'InflationRate', depreciation_type = ('StraightLine', 'MACRS')[i % 2], payment_terms = 'EqualPeriodic')
+    item.set_inflation_rate(0.02)
+    item.payment_args['order_date'] = start_date
+    item.depreciation_args['starting_period'] = start_date + dt.timedelta(days = 365)
+    item.depreciation_args['length'] = 7
+    return item
+
+def setup_capex(size):
+    _clear_caches()
+    costs = pf.CapitalCosts()
+    for i in range(size['items']):
+        costs.add_direct_capital_item(_capital_item(i, size))
+    return costs
+
+def run_capex(costs):
+    costs.build_capex_schedule()
+
+
+def setup_debt(size):
+    return [pf.Loan(name = "loan%s" % i, principal = 1.0E6*(1 + i % 5), init_date = start_date + dt.timedelta(days = 30*i), term = dt.timedelta(days = 365*min(size['years'], 20)), rate = 0.04 + 0.005*(i % 4), pmt_freq = 12) for i in range(size['loans'])]
+
+def run_debt(loans):
+    for loan in loans:
+        loan.build_debt_schedule()
+
+
+def setup_graduated_tax(size):
+    (income, deductions) = _income(size)
+    return pf.GraduatedFractionalTax(name = 'fed', basis = income, deductions = deductions, credits = None, rate = _brackets(size))
+
+def run_graduated_tax(tax):
+    tax.build_tax_schedule()
+
+
+def setup_tax_manager(size):
+    (income, deductions) = _income(size)
+    manager = pf.TaxManager(revenue = income, deductions = deductions)
+    manager.create_tax(kind = 'Fractional', revenue = '_income', deductions = ['_depreciation', '_interest'], name = 'fed', rate = 0.35)
+    manager.create_tax(kind = 'GraduatedFractional', revenue = '_income', deductions = ['_depreciation', '_interest'], name = 'state', rate = _brackets(size))
+    manager.associate_deductible_taxes('fed', 'state')
+    for i in range(size['credits']):
+        manager.create_tax_credit(kind = 'Fractional', revenue = ['_income'], name = 'credit%s' % i, refundable = False, rate = 0.01)
+        manager.associate_credits('fed', ['credit%s' % i])
+    return manager
+
+def run_tax_manager(manager):
+    manager.build_tax_schedule()
+
+
+benchmarks = [('escalators', setup_escalators, run_escalators),
+              ('depreciation', setup_depreciation, run_depreciation),
+              ('capex', setup_capex, run_capex),
+              ('debt', setup_debt, run_debt),
+              ('graduated_tax', setup_graduated_tax, run_graduated_tax),
+              ('tax_manager', setup_tax_manager, run_tax_manager)]
+
+
+def time_benchmark(setup, run, size, repeat = 5):
+    """Returns the wall time of each of repeat runs, with fresh inputs for every run"""
+    times = []
+    for i in range(repeat):
+        inputs = setup(size)
+        start = time.time()
+        run(inputs)
+        times.append(time.time() - start)
+    return times
+
+
+def run_suite(names = None, size_names = None, repeat = 5, size_table = None):
+    """Times the named benchmarks (default: all) at each size; returns the results document keyed by 'benchmark/size'"""
+    size_table = sizes if size_table is None else size_table
+    size_names = sorted(size_table.keys()) if size_names is None else size_names
+    selected = [b for b in benchmarks if names is None or b[0] in names]
+    if names is not None and len(selected) != len(names):
+        raise ValueError, "Unknown benchmark in %s; choose from %s" % (names, [b[0] for b in benchmarks])
+
+    results = {}
+    for (name, setup, run) in selected:
+        for size_name in size_names:
+            times = time_benchmark(setup, run, size_table[size_name], repeat)
+            results["%s/%s" % (name, size_name)] = {'best':min(times), 'mean':sum(times)/len(times), 'runs':times, 'size':size_table[size_name]}
+
+    meta = {'timestamp':dt.datetime.now().isoformat(), 'python':platform.python_version(), 'numpy':np.__version__, 'pandas':pd.__version__, 'machine':platform.machine(), 'repeat':repeat}
+    return {'meta':meta, 'results':results}
+
+
+def compare(results, baseline, threshold = 0.25):
+    """Compares the best times against a baseline results document.  A benchmark regressed if it is more than threshold
+    (a fraction) slower than the baseline; benchmarks missing from either side are skipped."""
+    comparison = {}
+    for key in sorted(results['results']):
+        if key not in baseline['results']:
+            continue
+        new = results['results'][key]['best']
+        old = baseline['results'][key]['best']
+        ratio = new/old if old > 0.0 else float('inf')
+        comparison[key] = {'baseline':old, 'best':new, 'ratio':ratio, 'regressed':ratio > 1.0 + threshold}
+    return comparison
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Time the ProjectFinance_daily schedule builders on synthetic workloads")
+    parser.add_argument('--benchmarks', nargs = '+', default = None, choices = [b[0] for b in benchmarks], help = "benchmarks to run (default: all)")
+    parser.add_argument('--sizes', nargs = '+', default = ['small', 'medium'], choices = sorted(sizes.keys()), help = "workload sizes (default: small medium)")
+    parser.add_argument('--repeat', type = int, default = 5, help = "timed runs per benchmark; the best is reported (default: 5)")
+    parser.add_argument('--output', default = None, help = "file for the JSON results (default: printed)")
+    parser.add_argument('--baseline', default = None, help = "JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type = float, default = 0.25, help = "fractional slowdown that counts as a regression (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.benchmarks, args.sizes, args.repeat)
+    regressed = []
+    if args.baseline is not None:
+        f = open(args.baseline)
+        baseline = json.load(f)
+        f.close()
+        results['comparison'] = compare(results, baseline, args.threshold)
+        results['threshold'] = args.threshold
+        regressed = [k for k in sorted(results['comparison']) if results['comparison'][k]['regressed']]
+
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if args.output is None:
+        print text
+    else:
+        f = open(args.output, 'w')
+        f.write(text)
+        f.close()
+
+    for key in sorted(results['results']):
+        line = "%-28s %10.4f s" % (key, results['results'][key]['best'])
+        if key in results.get('comparison', {}):
+            line += "   x%.2f of baseline%s" % (results['comparison'][key]['ratio'], "   REGRESSED" if key in regressed else "")
+        print >> sys.stderr, line
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""benchmarks_tests.py
+Unit tests for the micro-benchmark harness
+"""
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import benchmarks as bm
+import ProjectFinance_daily as pf
+
+
+tiny = {'tiny':{'items':2, 'years':2, 'loans':1, 'brackets':2, 'credits':1}}
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def testRunSuite(self):
+        """Every benchmark should run on a tiny workload and report one time per repeat"""
+        results = bm.run_suite(size_table = tiny, repeat = 2)
+        self.assertEqual(sorted(results['results'].keys()), sorted("%s/tiny" % b[0] for b in bm.benchmarks))
+        for r in results['results'].values():
+            self.assertEqual(len(r['runs']), 2)
+            self.assertEqual(r['best'], min(r['runs']))
+        self.assertEqual(results['meta']['repeat'], 2)
+        self.assertRaises(ValueError, bm.run_suite, ['gonzo'], size_table = tiny)
+
+    def testColdCaches(self):
+        """Every setup of a benchmark that uses the escalation or depreciation caches should empty both"""
+        for setup in (bm.setup_escalators, bm.setup_depreciation, bm.setup_capex):
+            (escalators, schedules) = (bm.setup_escalators(tiny['tiny']), bm.setup_depreciation(tiny['tiny']))
+            bm.run_escalators(escalators)
+            bm.run_depreciation(schedules)
+            self.assertTrue(len(pf.escalation_cache) > 0 and len(pf.depreciation_kernels) > 0)
+            setup(tiny['tiny'])
+            self.assertEqual((len(pf.escalation_cache), len(pf.depreciation_kernels)), (0, 0))
+
+    def testCompare(self):
+        """Only slowdowns beyond the threshold are regressions, and benchmarks missing from the baseline are skipped"""
+        new = {'results':{'a/small':{'best':1.2}, 'b/small':{'best':1.3}, 'c/small':{'best':5.0}}}
+        old = {'results':{'a/small':{'best':1.0}, 'b/small':{'best':1.0}}}
+        comparison = bm.compare(new, old, threshold = 0.25)
+        self.assertEqual(sorted(comparison.keys()), ['a/small', 'b/small'])
+        self.assertFalse(comparison['a/small']['regressed'])
+        self.assertTrue(comparison['b/small']['regressed'])
+        self.assertAlmostEqual(comparison['b/small']['ratio'], 1.3)
+
+    def testMain(self):
+        """The command line tool writes its results and fails on a regression"""
+        d = tempfile.mkdtemp()
+        try:
+            baseline = os.path.join(d, 'baseline.json')
+            f = open(baseline, 'w')
+            json.dump({'results':{'escalators/small':{'best':1.0E-12}}}, f)
+            f.close()
+            output = os.path.join(d, 'results.json')
+            self.assertEqual(bm.main(['--benchmarks', 'escalators', '--sizes', 'small', '--repeat', '1', '--output', output, '--baseline', baseline]), 1)
+            f = open(output)
+            results = json.load(f)
+            f.close()
+            self.assertTrue(results['comparison']['escalators/small']['regressed'])
+            self.assertEqual(bm.main(['--benchmarks', 'escalators', '--sizes', 'small', '--repeat', '1', '--output', output]), 0)
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,7 @@ import pandas as pd
 import datetime as dt
 from pandas.tseries.offsets import DateOffset
 import dataFrame_pd as df
+import schedule_tools as st
 
 
 class CapitalExpenseTests(unittest.TestCase):
@@ -76,6 +77,61 @@ class CapitalExpenseTests(unittest.TestCase):
         """Escalation using the CPI index should be properly calculated"""
         self.assertEqual(0,1)
 
+    def testEscalationCacheSharing(self):
+        """Escalators at the same rate over the same dates should share one read-only factor vector"""
+        pf.escalation_cache.clear()
+        start = dt.datetime(2010,01,01)
+        dates = pd.Series(pd.date_range(dt.datetime(2012,01,01), periods = 1000, freq = 'D'))
+        es1 = pf.InflationRateEscalator(rate = 0.02)
+        es2 = pf.InflationRateEscalator(rate = 0.02)
+        f1 = es1.escalate(basis_date = start, new_date = dates)
+        f2 = es2.escalate(basis_date = start, new_date = dates)
+        self.assertTrue(f1 is not f2)
+        self.assertTrue(np.shares_memory(f1.values, f2.values))
+        self.assertEqual((pf.escalation_cache.misses, pf.escalation_cache.hits), (1, 1))
+        self.assertAlmostEqual(f1[999], es1.escalate(basis_date = start, new_date = dates[999]), 12)
+        self.assertRaises(ValueError, f1.values.__setitem__, 0, 2.0)
+
+        #a different rate or basis date is a different vector, and the oldest entries go first
+        es1.rate = 0.03
+        es1.escalate(basis_date = start, new_date = dates)
+        pf.NoEscalationEscalator().escalate(basis_date = start, new_date = dates)
+        self.assertEqual(len(pf.escalation_cache), 3)
+
+        #a regular grid is keyed by its first date, length, and step, and an irregular one is not cached
+        es2.escalate(basis_date = start, new_date = pd.Series(pd.date_range(dt.datetime(2012,01,01), periods = 1000, freq = 'D')))
+        es2.escalate(basis_date = start, new_date = dates[1:])
+        self.assertEqual((len(pf.escalation_cache), pf.escalation_cache.hits), (4, 2))
+        months = pd.Series(pd.date_range(dt.datetime(2012,01,01), periods = 24, freq = 'MS'))
+        f3 = es2.escalate(basis_date = start, new_date = months)
+        self.assertEqual(len(pf.escalation_cache), 4)
+        self.assertAlmostEqual(f3[23], es2.escalate(basis_date = start, new_date = months[23]), 12)
+
+    def testDepreciationKernelSharing(self):
+        """Schedules of the same method, length, and recovery years should share one kernel and scale it by cost"""
+        pf.depreciation_kernels.clear()
+        d1 = pf.MACRSDepreciationSchedule(starting_period = dt.datetime(2012,01,01), length = 7)
+        d2 = pf.MACRSDepreciationSchedule(starting_period = dt.datetime(2012,01,01), length = 7)
+        d1.build(cost = 100.0)
+        d2.build(cost = 300.0)
+        self.assertEqual((pf.depreciation_kernels.misses, pf.depreciation_kernels.hits), (1, 1))
+        #the schedules hold the shared kernel and their cost, and only build a frame when asked for one
+        self.assertTrue(d1.kernel is d2.kernel)
+        acc = st.ScheduleAccumulator()
+        d1.add_to(acc)
+        d2.add_to(acc)
+        self.assertTrue(d1._frame is None and d2._frame is None)
+        self.assertAlmostEqual(acc.frame()['depreciation'].sum(), 400.0, 8)
+        self.assertAlmostEqual(d2.value(dt.datetime(2012,01,01)), 300.0*0.1429/366, 10)
+        self.assertAlmostEqual(d1['depreciation'].sum(), 100.0, 8)
+        self.assertTrue((np.abs(d2['depreciation'].values - 3.0*d1['depreciation'].values) < 1.0E-10).all())
+
+        #a different start shifts the leap days, so it gets its own kernel
+        d3 = pf.MACRSDepreciationSchedule(starting_period = dt.datetime(2013,01,01), length = 7)
+        d3.build(cost = 100.0)
+        self.assertEqual(len(pf.depreciation_kernels), 2)
+        self.assertAlmostEqual(d3['depreciation'].sum(), 100.0, 8)
+
 
     def testCreateCapitalExpense(self):
         """Testing correct setting of a capital expense"""
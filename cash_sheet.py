@@ -0,0 +1,107 @@
+"""cash_sheet.py
+Preallocated columnar storage for the project cash flow sheet
+"""
+
+import numpy as np
+import pandas as pd
+from pf_errors import *
+import dataFrame_pd as df
+
+
+DAY_NS = 86400.0*1E9		#nanoseconds in a day, for the int64 date arithmetic
+
+
+class CashSheet(object):
+    """Holds every cash sheet column in a single contiguous float64 block (columns x periods).
+
+    The column set is fixed when the sheet is created.  Each column is a row of the block, so the
+    assembly stages write into views of it with in-place ufuncs instead of allocating new Series.
+    Each period runs from its index date up to the next one (or to end for the last period); a daily
+    sheet is the special case where every period is one day long."""
+
+    columns = ('Period', 'Production', 'Sales_price', 'Sales', 'Salvage', 'Revenue', 'Variable_costs', 'Fixed_costs', 'Decommissioning_costs', 'Cost_of_sales', 'EBITDA', 'Loan_proceeds', 'Interest', 'Principal_payments', 'Pre-depreciation_income', 'Depreciation', 'Taxable_income', 'Taxes', 'After-tax_income', 'Capital_expenditures', 'Net_cash_flow')
+
+    def __init__(self, index, columns = None, end = None):
+        if not isinstance(index, pd.DatetimeIndex):
+            raise CashSheetError, "index must be a pandas DatetimeIndex, got %s" % type(index)
+        if len(index) == 0 or not index.is_monotonic_increasing or not index.is_unique:
+            raise CashSheetError, "The period start dates must be non-empty, increasing, and unique"
+        if end is None:
+            end = index[-1] + pd.Timedelta(days = 1)
+        if end <= index[-1]:
+            raise CashSheetError, "The end of the sheet (%s) must come after the last period start" % end
+        if columns is None:
+            columns = CashSheet.columns
+
+        self.index = index
+        self.edges = index.append(pd.DatetimeIndex([end]))
+        self.days = np.diff(self.edges.asi8)/DAY_NS			#length of each period in days
+        self.names = list(columns)
+        self.rows = dict((name, i) for i, name in enumerate(self.names))
+        if len(self.rows) != len(self.names):
+            raise CashSheetError, "The cash sheet columns must be unique"
+
+        self.block = np.zeros((len(self.names), len(index)))
+        self._frame = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __getitem__(self, name):
+        """Returns a writeable view of the named column"""
+        try:
+            return self.block[self.rows[name]]
+        except KeyError:
+            raise CashSheetError, "%s is not a column in the cash sheet" % name
+
+    def __setitem__(self, name, value):
+        """Copies value (scalar or array) into the named column in place"""
+        self[name][:] = value
+
+    def position(self, date):
+        """Returns the integer position of the period holding date; raises KeyError if the date is not on the sheet"""
+        i = self.edges.searchsorted(date, side = 'right') - 1
+        if i < 0 or i >= len(self.index):
+            raise KeyError(date)
+        return i
+
+    def span(self, start = None, end = None):
+        """Returns the positional slice for the label range [start, end], inclusive like pandas label slicing"""
+        i0 = 0 if start is None else self.index.searchsorted(start, side = 'left')
+        i1 = len(self.index) if end is None else self.index.searchsorted(end, side = 'right')
+        return slice(i0, i1)
+
+    def daily_index(self):
+        """Returns every day covered by the sheet, for building schedules that are then summed into its periods"""
+        return pd.date_range(self.index[0], self.edges[-1] - pd.Timedelta(days = 1), freq = 'D')
+
+    def overlap(self, start = None, end = None):
+        """Returns the number of days of each period that fall in [start, end) -- an open end runs to the end of the sheet"""
+        e = self.edges.asi8
+        lo = e[:-1] if start is None else np.maximum(e[:-1], pd.Timestamp(start).value)
+        hi = e[1:] if end is None else np.minimum(e[1:], pd.Timestamp(end).value)
+        return np.maximum(hi - lo, 0)/DAY_NS
+
+    def add_series(self, name, series):
+        """Adds a date-indexed series into the named column, summing into the period that holds each date; dates that are not on the sheet are dropped"""
+        pos = self.edges.searchsorted(pd.DatetimeIndex(series.index), side = 'right') - 1
+        vals = np.asarray(series, dtype = float)
+        keep = (pos >= 0) & (pos < len(self.index)) & np.isfinite(vals)
+        np.add.at(self[name], pos[keep], vals[keep])
+
+    def add_schedule(self, name, schedule, column = None):
+        """Adds a column of a schedule_tools.OffsetSchedule (the one with the sheet column's name by default) into the named column, the same way as add_series"""
+        values = schedule[name if column is None else column]
+        edges = schedule.calendar.offsets(self.edges)
+        pos = np.searchsorted(edges, np.arange(schedule.start, schedule.end), side = 'right') - 1
+        keep = schedule.present & (pos >= 0) & (pos < len(self.index)) & np.isfinite(values)
+        self[name] += np.bincount(pos[keep], weights = values[keep], minlength = len(self.index))
+
+    def frame(self):
+        """Returns a DataFrame that shares memory with the block -- it always reflects the current values"""
+        if self._frame is None:
+            self._frame = df.DataFrame(self.block.T, index = self.index, columns = self.names, copy = False)
+        return self._frame
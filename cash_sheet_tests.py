@@ -0,0 +1,84 @@
+"""cash_sheet_tests.py
+Unit tests for the preallocated cash sheet
+"""
+
+import unittest
+import cash_sheet as cs
+import schedule_tools as st
+import numpy as np
+import pandas as pd
+import datetime as dt
+from pf_errors import *
+
+
+class CashSheetTests(unittest.TestCase):
+
+    def testCreateCashSheet(self):
+        """A cash sheet should preallocate one zeroed block for all of its columns"""
+        dates = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2016,12,31), freq = 'D')
+        sheet = cs.CashSheet(dates)
+        self.assertEqual(sheet.block.shape, (len(cs.CashSheet.columns), len(dates)))
+        self.assertTrue(sheet.block.flags['C_CONTIGUOUS'])
+        self.assertTrue((sheet.block == 0.0).all())
+        self.assertEqual(len(sheet), len(dates))
+
+    def testBadCashSheetInput(self):
+        """A cash sheet needs a DatetimeIndex and known, unique column names"""
+        dates = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2015,12,31), freq = 'D')
+        self.assertRaises(CashSheetError, cs.CashSheet, range(10))
+        self.assertRaises(CashSheetError, cs.CashSheet, dates, ['Sales', 'Sales'])
+        sheet = cs.CashSheet(dates)
+        self.assertRaises(CashSheetError, sheet.__getitem__, 'Widgets')
+
+    def testColumnsAreViews(self):
+        """Writes through a column should show up in the block and in the frame view"""
+        dates = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2015,12,31), freq = 'D')
+        sheet = cs.CashSheet(dates)
+        frame = sheet.frame()
+        np.multiply(np.arange(len(dates)), 2.0, out = sheet['Sales'])
+        sheet['Salvage'] = 3.0
+        self.assertEqual(sheet.block[sheet.rows['Sales']][10], 20.0)
+        self.assertEqual(frame.loc['2015-01-11']['Sales'], 20.0)
+        self.assertEqual(frame['Salvage'].sum(), 3.0*len(dates))
+        self.assertTrue(frame is sheet.frame())
+
+    def testSpanAndSeries(self):
+        """Label spans should be inclusive, and date-indexed series should be added in by date"""
+        dates = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2015,12,31), freq = 'D')
+        sheet = cs.CashSheet(dates)
+        s = sheet.span(dt.datetime(2015,02,01), dt.datetime(2015,02,28))
+        self.assertEqual(s.stop - s.start, 28)
+        self.assertEqual(sheet.span(dt.datetime(2015,12,01)).stop, len(dates))
+
+        series = pd.Series([1.0, 2.0, 5.0], index = [dt.datetime(2014,12,31), dt.datetime(2015,01,02), dt.datetime(2015,01,02)])
+        sheet.add_series('Capital_expenditures', series)
+        self.assertEqual(sheet['Capital_expenditures'][1], 7.0)
+        self.assertEqual(sheet['Capital_expenditures'].sum(), 7.0)
+        self.assertRaises(KeyError, sheet.position, dt.datetime(2016,01,01))
+
+    def testMonthlyGrid(self):
+        """On a coarser grid, dates should fall into the period that holds them, and overlaps should count days"""
+        starts = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2015,12,01), freq = 'MS')
+        sheet = cs.CashSheet(starts, end = dt.datetime(2016,01,01))
+        self.assertEqual(sheet.days[1], 28.0)
+        self.assertEqual(sheet.days.sum(), 365.0)
+        self.assertEqual(sheet.position(dt.datetime(2015,02,14)), 1)
+        self.assertEqual(sheet.position(dt.datetime(2015,12,31)), 11)
+        self.assertRaises(KeyError, sheet.position, dt.datetime(2016,01,01))
+        self.assertRaises(CashSheetError, cs.CashSheet, starts, None, dt.datetime(2015,12,01))
+
+        o = sheet.overlap(dt.datetime(2015,01,20), dt.datetime(2015,03,02))
+        self.assertEqual(list(o[:4]), [12.0, 28.0, 1.0, 0.0])
+        self.assertEqual(sheet.overlap(dt.datetime(2015,11,15)).sum(), 47.0)
+
+        series = pd.Series(1.0, index = sheet.daily_index())
+        sheet.add_series('Interest', series)
+        self.assertTrue((sheet['Interest'] == sheet.days).all())
+
+        schedule = st.DayCalendar(dt.datetime(2015,01,01)).schedule(series.rename('interest'))
+        sheet.add_schedule('Interest', schedule, 'interest')
+        self.assertTrue((sheet['Interest'] == 2.0*sheet.days).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,10 @@
 #Version 1.0
 #Implements is_numeric function to check if a type is numeric operable
 #Implements a numpy array equality check
+#Implements a thread-safe LRU cache
 
+import threading
+from collections import OrderedDict
 
 
 def is_numeric(obj):
@@ -36,3 +39,43 @@ def numpy_arrays_equal(arr1, arr2):
 
 
     return bit
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache.  Values are shared between callers, so they should not be changed in place; failed builds raise
+    and are not cached."""
+
+    def __init__(self, maxsize = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Returns the value for key, calling build() to compute it on a miss; the least recently used entry is evicted when full"""
+        with self._lock:
+            try:
+                value = self._store.pop(key)
+                self.hits += 1
+                self._store[key] = value
+                return value
+            except KeyError:
+                pass
+        value = build()			#outside the lock, so a slow build does not hold up the other threads
+        with self._lock:
+            self.misses += 1
+            self._store.pop(key, None)
+            if len(self._store) >= self.maxsize:
+                self._store.popitem(last = False)
+            self._store[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._store)
@@ -0,0 +1,198 @@
+"""irr.py
+Internal rate of return solvers for single cash flow vectors and for stacks of them
+"""
+
+import numpy as np
+import scipy.optimize as spo
+from pf_errors import *
+
+
+class IRRSolver(object):
+    """Solves for the IRR of cash flows that all fall on the same set of time offsets.
+
+    The offsets are fixed when the solver is created, so repeated solves (a price sweep, a Monte Carlo
+    batch) reuse them.  The rate is per unit of offset -- day offsets give a daily rate, year fractions an
+    annual one.  Internally the solve is done in x = ln(1+rate), where NPV(x) = sum(c*exp(-t*x)) and its
+    derivatives are simple sums, and Halley steps are taken for every row at once.  Rows that do not
+    converge fall back to a bracketing solve with an expanding bracket."""
+
+    def __init__(self, offsets, tol = 1E-10, max_iter = 50):
+        self.t = np.asarray(offsets, dtype = float)
+        if self.t.ndim != 1 or len(self.t) == 0:
+            raise BadIRRInput, "offsets must be a non-empty one-dimensional sequence"
+        if not np.isfinite(self.t).all():
+            raise BadIRRInput, "offsets must all be finite"
+        self.t2 = self.t*self.t
+        self.tol = tol
+        self.max_iter = max_iter
+        #exp(-t*x) must stay representable across the whole sheet
+        self.x_limit = 700.0/max(np.abs(self.t).max(), 1.0)
+        self._grid = None
+
+    def discount(self, rate):
+        """Returns the discount factor at each offset for a scalar rate"""
+        return np.exp(-self.t*np.log1p(rate))
+
+    def npv(self, flows, rate):
+        """Returns the NPV of a flow vector (or of each row of a stack) at a scalar rate"""
+        return np.dot(self._check(flows), self.discount(rate))
+
+    def solve(self, flows, guess = 0.0, strict = False):
+        """Returns the IRR of a flow vector, or an array with the IRR of each row of a 2-D stack of flow vectors.
+
+        guess can also be an array with a starting rate for each row.  With strict = False a row without a root gives nan
+        and a row with several roots gives the root that the iteration reached from the guess.  With strict = True those
+        cases raise NoIRRError and MultipleIRRError."""
+        flows = self._check(flows)
+        stack = np.atleast_2d(flows)
+        x0 = np.empty(len(stack))
+        x0[:] = np.log1p(guess)
+        x = self._halley(stack, *self._start(stack, x0))
+
+        for i in np.where(np.isnan(x))[0]:
+            x[i] = self._bracket(stack[i], x0[i])
+            if strict and np.isnan(x[i]):
+                raise NoIRRError, "The cash flows in row %s have no IRR" % i
+
+        if strict:
+            for i in np.where(self._sign_changes(stack) > 1)[0]:
+                if len(self._scan(stack[i])) > 1:
+                    raise MultipleIRRError, "The cash flows in row %s have more than one IRR" % i
+
+        rates = np.expm1(x)
+        if flows.ndim == 1:
+            return rates[0]
+        return rates
+
+    def roots(self, flows, points = 401):
+        """Returns every IRR of a single flow vector found on a scan of the representable rates, smallest first"""
+        flows = self._check(flows)
+        if flows.ndim != 1:
+            raise BadIRRInput, "roots works on a single cash flow vector"
+        return np.expm1(np.array(self._scan(flows, points)))
+
+    def _check(self, flows):
+        flows = np.asarray(flows, dtype = float)
+        if flows.ndim not in (1, 2) or flows.shape[-1] != len(self.t):
+            raise BadIRRInput, "The cash flows must have one entry for each of the %s offsets" % len(self.t)
+        return flows
+
+    def _start(self, stack, x0):
+        """Starting points and brackets for the iteration.  NPV is evaluated on a coarse grid of rates for every row at once; a row whose
+        NPV changes sign on the grid starts from the interpolated crossing nearest its guess, bracketed by the grid points on either side.
+        Returns the starting points, the brackets, and the sign of NPV at the bottom of each bracket (0 for rows without one)."""
+        if self._grid is None:
+            u = np.linspace(-1.0, 1.0, 101)
+            self._grid = self.x_limit*u*np.abs(u)
+            self._grid_factors = np.exp(-np.outer(self.t, self._grid))
+        g = self._grid
+        f = np.dot(stack, self._grid_factors)
+        crossing = np.sign(f[:,:-1]) != np.sign(f[:,1:])
+        dist = np.where(crossing, np.abs(0.5*(g[:-1] + g[1:]) - x0[:,np.newaxis]), np.inf)
+        j = dist.argmin(axis = 1)
+        rows = np.arange(len(stack))
+        f0 = f[rows, j]
+        f1 = f[rows, j+1]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            x = g[j] - f0*(g[j+1] - g[j])/(f1 - f0)
+        bracketed = crossing.any(axis = 1) & np.isfinite(x)
+        x = np.where(bracketed, x, x0)
+        lo = np.where(bracketed, g[j], -self.x_limit)
+        hi = np.where(bracketed, g[j+1], self.x_limit)
+        return x, lo, hi, np.where(bracketed, np.sign(f0), 0.0)
+
+    def _derivatives(self, stack, x):
+        """NPV and its first two derivatives with respect to x, for each row at its own x"""
+        d = np.exp(-np.outer(x, self.t))
+        d *= stack
+        return d.sum(axis = 1), -np.dot(d, self.t), np.dot(d, self.t2)
+
+    def _halley(self, stack, x, lo, hi, sign_lo):
+        """Vectorized Halley iteration.  In rows with a bracket, the bracket is narrowed each step and any step that would leave it
+        is replaced by bisection.  Rows that fail to converge come back as nan."""
+        x = x.copy()
+        lo = lo.copy()
+        hi = hi.copy()
+        active = np.arange(len(stack))
+        for N in range(self.max_iter):
+            a = active
+            f, f1, f2 = self._derivatives(stack[a], x[a])
+            with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+                bracketed = sign_lo[a] != 0.0
+                below = bracketed & (np.sign(f) == sign_lo[a])
+                lo[a[below]] = x[a[below]]
+                above = bracketed & ~below
+                hi[a[above]] = x[a[above]]
+
+                step = 2.0*f*f1/(2.0*f1*f1 - f*f2)
+                #fall back on a Newton step where the Halley correction points the wrong way
+                newton = f/f1
+                bad = np.logical_or(~np.isfinite(step), step*newton < 0.0)
+                step[bad] = newton[bad]
+                new = x[a] - step
+                tol = self.tol*(1.0 + np.abs(new))
+                converged = (f == 0.0) | (np.abs(step) <= tol)
+                outside = bracketed & ~converged & ~((new >= lo[a]) & (new <= hi[a]))
+                new[outside] = 0.5*(lo[a][outside] + hi[a][outside])
+                x[a] = new
+
+                lost = ~(np.abs(new) <= self.x_limit)
+                x[a[lost]] = np.nan
+                done = lost | converged | (bracketed & (hi[a] - lo[a] <= tol))
+            active = a[~done]
+            if len(active) == 0:
+                return x
+        x[active] = np.nan
+        return x
+
+    def _bracket(self, flows, x0):
+        """Finds a sign change by expanding a bracket around x0, then polishes it with brentq; nan if there is none"""
+        f = lambda x: np.dot(flows, np.exp(-self.t*x))
+        x0 = min(max(x0, -self.x_limit), self.x_limit)
+        h = min(0.01, self.x_limit)
+        while True:
+            lo = max(x0 - h, -self.x_limit)
+            hi = min(x0 + h, self.x_limit)
+            if f(lo)*f(hi) <= 0.0:
+                return spo.brentq(f, lo, hi, xtol = self.tol)
+            if lo == -self.x_limit and hi == self.x_limit:
+                return np.nan
+            h *= 2.0
+
+    def _scan(self, flows, points = 401):
+        """Brackets and solves for every sign change of NPV on a grid that is densest near a zero rate"""
+        u = np.linspace(-1.0, 1.0, points)
+        grid = self.x_limit*u*np.abs(u)
+        f = np.dot(np.exp(-np.outer(grid, self.t)), flows)
+        found = []
+        for i in range(len(grid) - 1):
+            if f[i] == 0.0:
+                found.append(grid[i])
+            elif np.sign(f[i]) != np.sign(f[i+1]) and f[i+1] != 0.0:
+                found.append(spo.brentq(lambda x: np.dot(flows, np.exp(-self.t*x)), grid[i], grid[i+1], xtol = self.tol))
+        if f[-1] == 0.0:
+            found.append(grid[-1])
+        return found
+
+    def _sign_changes(self, stack):
+        """Number of sign changes in each row (Descartes' bound on the number of roots)"""
+        s = np.sign(stack)
+        changes = np.zeros(len(stack), dtype = int)
+        for i in range(len(stack)):
+            nz = s[i][s[i] != 0]
+            changes[i] = np.count_nonzero(nz[1:] != nz[:-1])
+        return changes
+
+
+def irr(flows, offsets = None, guess = 0.0, strict = False):
+    """IRR of evenly spaced flows (one per period) or of flows at the given offsets; works row-wise on a 2-D stack"""
+    flows = np.asarray(flows, dtype = float)
+    if offsets is None:
+        offsets = np.arange(flows.shape[-1])
+    return IRRSolver(offsets).solve(flows, guess = guess, strict = strict)
+
+def xirr(flows, dates, guess = 0.1, strict = False):
+    """Annual IRR of flows on arbitrary dates, with offsets counted as actual days/365 from the first date"""
+    dates = np.asarray(dates, dtype = 'datetime64[D]')
+    offsets = (dates - dates[0]).astype(float)/365.0
+    return IRRSolver(offsets).solve(flows, guess = guess, strict = strict)
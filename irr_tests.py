@@ -0,0 +1,81 @@
+"""irr_tests.py
+Unit tests for the IRR solvers
+"""
+
+import unittest
+import irr
+import numpy as np
+import datetime as dt
+from pf_errors import *
+
+
+class IRRTests(unittest.TestCase):
+
+    def testSimpleIRR(self):
+        """Evenly spaced flows should give the textbook IRR"""
+        self.assertAlmostEqual(irr.irr([-100.0, 110.0]), 0.10, 10)
+        self.assertAlmostEqual(irr.irr([-100.0, 0.0, 121.0]), 0.10, 10)
+        solver = irr.IRRSolver(np.arange(3))
+        self.assertAlmostEqual(solver.npv([-100.0, 0.0, 121.0], 0.10), 0.0, 8)
+
+    def testStackedIRR(self):
+        """Each row of a stack should get its own IRR, with nan where there is no root"""
+        flows = np.array([[-100.0, 110.0, 0.0], [-100.0, 0.0, 121.0], [-100.0, 50.0, 80.0], [100.0, 10.0, 10.0]])
+        rates = irr.irr(flows)
+        self.assertAlmostEqual(rates[0], 0.10, 10)
+        self.assertAlmostEqual(rates[1], 0.10, 10)
+        self.assertAlmostEqual(-100.0 + 50.0/(1+rates[2]) + 80.0/(1+rates[2])**2, 0.0, 8)
+        self.assertTrue(np.isnan(rates[3]))
+        self.assertRaises(NoIRRError, irr.irr, flows, None, 0.0, True)
+
+    def testXIRR(self):
+        """XIRR on dated flows should match the spreadsheet value"""
+        dates = [dt.date(2008,1,1), dt.date(2008,3,1), dt.date(2008,10,30), dt.date(2009,2,15), dt.date(2009,4,1)]
+        flows = [-10000.0, 2750.0, 4250.0, 3250.0, 2750.0]
+        self.assertAlmostEqual(irr.xirr(flows, dates), 0.373362535, 7)
+
+    def testFarFromGuess(self):
+        """Rates well outside the old search bracket should still be found"""
+        self.assertAlmostEqual(irr.irr([-100.0, 400.0]), 3.0, 8)
+        self.assertAlmostEqual(irr.irr([-100.0, 50.0]), -0.5, 8)
+        self.assertAlmostEqual(irr.irr([-100.0, 0.0, 0.0, 0.0, 110.0], guess = 2.0), 1.1**0.25 - 1.0, 8)
+
+    def testSteepDailyFlows(self):
+        """Long daily sheets with deeply negative IRRs should converge in the vectorized iteration, without the bracketing fallback"""
+        t = np.arange(20*365)
+        flows = np.empty((3, len(t)))
+        flows[0] = 1.1106583731521338
+        flows[0,:1141] = -1903.370993069851
+        flows[1] = 6.351464995757239
+        flows[1,:721] = -4691.772651596395
+        flows[2] = 400.0
+        flows[2,:730] = -2000.0
+        solver = irr.IRRSolver(t)
+        def no_bracket(*args):
+            self.fail("The bracketing fallback should not be needed")
+        solver._bracket = no_bracket
+        rates = solver.solve(flows)
+        self.assertTrue((rates < 0.0)[:2].all())
+        for row, rate in zip(flows, rates):
+            self.assertAlmostEqual(solver.npv(row, rate)/np.abs(row).sum(), 0.0, 10)
+        #per-row guesses give the same roots
+        np.testing.assert_allclose(solver.solve(flows, guess = np.array([0.0, -0.001, 0.001])), rates, rtol = 1E-8)
+
+    def testMultipleRoots(self):
+        """Flows with two sign changes can have two IRRs"""
+        flows = [-100.0, 230.0, -132.0]
+        roots = irr.IRRSolver(np.arange(3)).roots(flows)
+        self.assertEqual(len(roots), 2)
+        self.assertAlmostEqual(roots[0], 0.10, 8)
+        self.assertAlmostEqual(roots[1], 0.20, 8)
+        self.assertRaises(MultipleIRRError, irr.irr, flows, None, 0.0, True)
+
+    def testBadInput(self):
+        """Offsets and flows have to line up"""
+        self.assertRaises(BadIRRInput, irr.IRRSolver, [])
+        solver = irr.IRRSolver(np.arange(3))
+        self.assertRaises(BadIRRInput, solver.solve, [1.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
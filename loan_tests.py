@@ -187,6 +187,23 @@ class LoanTests(unittest.TestCase):
             self.assertAlmostEqual(loan.schedule.loc[date]['principal_payment'],pp,2)
         self.assertAlmostEqual(loan.schedule.loc['2012-01-01']['cash_proceeds'],686000,2)
 
+    def testRebuildAndPrepayment(self):
+        """Rebuilding a loan should give the same schedule, and a prepayment that retires the principal should zero the rest of the schedule"""
+        loan = pf.Loan(name = "loan1", principal = 686000, term = dt.timedelta(days=365*20), rate = 0.085, pmt_freq = 12, init_date = dt.datetime(2015,1,1))
+        loan.build_debt_schedule()
+        first = loan.schedule.copy()
+        loan.build_debt_schedule()
+        self.assertTrue((loan.schedule.values == first.values).all())
+        self.assertEqual(loan.pmt_schedules, [])
+
+        loan.pmt_schedules.append(pd.DataFrame({'payments':[900000.0]}, index = [dt.datetime(2020,3,15)]))
+        loan.build_debt_schedule()
+        self.assertEqual(len(loan.schedule), len(first) + 1)
+        self.assertAlmostEqual(loan.schedule.loc['2020-02-29']['principal'], first.loc['2020-02-29']['principal'], 6)
+        self.assertEqual(loan.schedule.loc['2020-03-15']['principal_payment'], 900000.0)
+        self.assertEqual(loan.schedule.loc['2020-03-15']['interest'], 0.0)
+        self.assertTrue((loan.schedule.loc['2020-03-31':].values == 0.0).all())
+
 class DebtPortfolioTests(unittest.TestCase):
     def testAddLoan(self):
         """DebtPortfolio must correctly add a loan to its set of loans"""
@@ -0,0 +1,244 @@
+"""monte_carlo.py
+Monte Carlo simulation of a CapitalProject over uncertain financial parameters and component attributes
+"""
+
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+import UnitValues as uv
+from pf_errors import *
+import dataFrame_pd as df
+
+
+class Distribution(object):
+    """Abstract class for the distribution of a single uncertain input"""
+
+    def sample(self, n, rng):
+        """Returns an array of n draws from the distribution, using the given numpy RandomState"""
+        pass
+
+
+class NormalDistribution(Distribution):
+    def __init__(self, mean, sd):
+        if sd < 0:
+            raise BadDistributionInput, "The standard deviation must be non-negative, got %s" % sd
+        self.mean = mean
+        self.sd = sd
+
+    def sample(self, n, rng):
+        return rng.normal(self.mean, self.sd, n)
+
+
+class UniformDistribution(Distribution):
+    def __init__(self, low, high):
+        if high < low:
+            raise BadDistributionInput, "The upper bound (%s) is below the lower bound (%s)" % (high, low)
+        self.low = low
+        self.high = high
+
+    def sample(self, n, rng):
+        return rng.uniform(self.low, self.high, n)
+
+
+class TriangularDistribution(Distribution):
+    def __init__(self, low, mode, high):
+        if not low <= mode <= high or low == high:
+            raise BadDistributionInput, "Need low <= mode <= high with low < high, got (%s, %s, %s)" % (low, mode, high)
+        self.low = low
+        self.mode = mode
+        self.high = high
+
+    def sample(self, n, rng):
+        return rng.triangular(self.low, self.mode, self.high, n)
+
+
+class MonteCarlo(object):
+    """Samples uncertain inputs of a CapitalProject and collects the distribution of NPV and IRR at a fixed selling price.
+
+    When only Inflation_rate, Cap_factor, and Design_cap are uncertain, every other column of the sheet is fixed, so the samples
+    are evaluated together as (sample x row) arrays, block_size samples at a time.  Any other input (another financial parameter,
+    a quote's base_price, a loan's rate) needs the full assembly, so those samples are farmed out to a pool of worker processes."""
+
+    vector_params = ['Inflation_rate', 'Cap_factor', 'Design_cap']
+
+    def __init__(self, project, price, mode = "fixed", rate = None, seed = None):
+        if False in project.check_bits:
+            raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"
+        if mode != "fixed":
+            raise ProjFinError, "Monte Carlo runs only support the 'fixed' inflation mode, got %s" % mode
+        self.project = project
+        self.price = price
+        self.mode = mode
+        self.rate = rate
+        self.rng = np.random.RandomState(seed)
+        self.inputs = []			#(name, target, attribute, distribution); target is None for financial parameters
+
+        self.samples = None
+        self.results = None
+        self.percentile_sheets = {}
+
+    def add_parameter(self, key, distribution):
+        """Makes a FinancialParameters key uncertain; Design_cap is sampled as a magnitude in its current units"""
+        if key not in self.project.fin_param.key_list:
+            raise ProjFinError, "%s is not a valid financial parameter" % key
+        self._add(key, None, key, distribution)
+
+    def add_attribute(self, target, attribute, distribution, name = None):
+        """Makes an attribute of a component uncertain -- e.g. (quote_basis, 'base_price') or (loan, 'rate')"""
+        if not hasattr(target, attribute):
+            raise ProjFinError, "%s has no attribute %s" % (target, attribute)
+        if name is None:
+            name = "%s.%s" % (getattr(target, 'name', type(target).__name__), attribute)
+        self._add(name, target, attribute, distribution)
+
+    def _add(self, name, target, attribute, distribution):
+        if not isinstance(distribution, Distribution):
+            raise BadDistributionInput, "The distribution for %s must be a Distribution object" % name
+        if name in [i[0] for i in self.inputs]:
+            raise ProjFinError, "%s is already an uncertain input" % name
+        self.inputs.append((name, target, attribute, distribution))
+
+    def vectorized(self):
+        """True if every uncertain input can be evaluated in the vectorized path"""
+        return all(target is None and attr in MonteCarlo.vector_params for (name, target, attr, dist) in self.inputs)
+
+    def run(self, n, block_size = 500, workers = None, percentiles = (10, 50, 90)):
+        """Draws n samples and evaluates them; returns a DataFrame of the sampled inputs with the NPV and IRR of each sample.
+        The rate (Target_IRR by default) and the reported IRRs are annual."""
+        if len(self.inputs) == 0:
+            raise ProjFinError, "There are no uncertain inputs to sample"
+        if n < 1:
+            raise ProjFinError, "The number of samples must be positive, got %s" % n
+        rate = self.project.period_rate(self.rate if self.rate is not None else self.project.fin_param['Target_IRR'])
+        block_size = max(1, block_size)
+
+        self.samples = df.DataFrame(dict((name, dist.sample(n, self.rng)) for (name, target, attr, dist) in self.inputs), columns = [i[0] for i in self.inputs])
+        self.samples.index.name = 'sample'
+        base = self._snapshot()
+        try:
+            if self.vectorized():
+                npv, irr = self._run_vectorized(rate, block_size)
+            else:
+                npv, irr = self._run_pool(rate, workers)
+        finally:
+            self._restore(base)
+
+        self.results = self.samples.copy()
+        self.results['NPV'] = npv
+        self.results['IRR'] = self.project.annual_rate(irr)
+        self.percentile_sheets = self._percentile_sheets(percentiles)
+        return self.results
+
+    def _run_vectorized(self, rate, block_size):
+        """Evaluates all of the samples as (sample x row) arrays"""
+        proj = self.project
+        proj.assembleFinancials((self.price, self.mode))
+        sheet = proj.cash_sheet
+        #Production, and so variable cost, scales with Cap_factor*Design_cap; remove the base escalation from the cost columns
+        esc = proj._escalation()
+        production = sheet['Production'].copy()
+        vc = sheet['Variable_costs']/esc
+        fc = sheet['Fixed_costs']/esc
+        disc = proj._discount_factors(rate)
+        base_out = proj.fin_param['Cap_factor']*proj.fin_param['Design_cap'].value
+
+        n = len(self.samples)
+        inflation = self._column('Inflation_rate', proj.fin_param['Inflation_rate'])
+        scale = self._column('Cap_factor', proj.fin_param['Cap_factor'])*self._column('Design_cap', proj.fin_param['Design_cap'].value)/base_out
+
+        npv = np.empty(n)
+        irr = np.empty(n)
+        m = min(block_size, n)
+        esc_block = np.empty((m, len(sheet)))
+        for start in range(0, n, m):
+            stop = min(start + m, n)
+            e = proj._escalation_factors(inflation[start:stop], out = esc_block[:stop-start])
+            q = scale[start:stop, np.newaxis]
+            sales = production*q
+            sales *= e
+            variable = vc*q
+            variable *= e
+            ncf = proj._net_cash_flow(self.price*sales, variable, fc*e)
+            npv[start:stop] = np.dot(ncf, disc)
+            #Samples are alike, so the last block's IRRs are a good place to start the next one
+            guess = np.nanmedian(irr[:start]) if start > 0 and not np.isnan(irr[:start]).all() else 0.0
+            irr[start:stop] = proj._irr.solve(ncf, guess = guess)
+        return npv, irr
+
+    def _run_pool(self, rate, workers):
+        """Evaluates each sample with a full assembly, spread across worker processes"""
+        rows = self.samples.values
+        if workers == 1:
+            _init_worker(self.project, self.inputs, self.price, self.mode, rate)
+            results = [_evaluate_sample(row) for row in rows]
+        else:
+            #The project and its input targets go to the workers together, so each target is still part of the worker's copy of the project
+            pool = mp.Pool(processes = workers, initializer = _init_worker, initargs = (self.project, self.inputs, self.price, self.mode, rate))
+            try:
+                results = pool.map(_evaluate_sample, rows, chunksize = max(1, len(rows)/(4*(workers or mp.cpu_count()))))
+            finally:
+                pool.close()
+                pool.join()
+        results = np.array(results)
+        return results[:,0], results[:,1]
+
+    def _percentile_sheets(self, percentiles):
+        """Full cash sheets for the samples whose NPV sits at each percentile of the NPV distribution"""
+        sheets = {}
+        npv = self.results['NPV'].values
+        order = np.argsort(npv)
+        base = self._snapshot()
+        try:
+            for p in percentiles:
+                i = order[int(round((len(order) - 1)*p/100.0))]
+                _apply_sample(self.project, self.inputs, self.samples.values[i])
+                self.project.assembleFinancials((self.price, self.mode))
+                sheets[p] = self.project.cf_sheet.copy()
+        finally:
+            self._restore(base)
+        self.project.assembleFinancials((self.price, self.mode))
+        return sheets
+
+    def _column(self, key, default):
+        if key in self.samples:
+            return self.samples[key].values
+        return np.ones(len(self.samples))*default
+
+    def _snapshot(self):
+        return [_get_value(self.project, target, attr) for (name, target, attr, dist) in self.inputs]
+
+    def _restore(self, values):
+        for ((name, target, attr, dist), value) in zip(self.inputs, values):
+            if target is None:
+                self.project.fin_param[attr] = value
+            else:
+                setattr(target, attr, value)
+
+
+def _get_value(project, target, attr):
+    if target is None:
+        return project.fin_param[attr]
+    return getattr(target, attr)
+
+def _apply_sample(project, inputs, row):
+    for ((name, target, attr, dist), value) in zip(inputs, row):
+        if target is not None:
+            setattr(target, attr, value)
+        elif attr == 'Design_cap':
+            project.fin_param[attr] = uv.UnitVal(value, project.fin_param[attr].units)
+        else:
+            project.fin_param[attr] = value
+
+
+#Worker process state for the pooled path -- set once per worker by the pool initializer
+_worker = {}
+
+def _init_worker(project, inputs, price, mode, rate):
+    _worker.update(project = project, inputs = inputs, price = price, mode = mode, rate = rate)
+
+def _evaluate_sample(row):
+    project = _worker['project']
+    _apply_sample(project, _worker['inputs'], row)
+    project.assembleFinancials((_worker['price'], _worker['mode']))
+    ncf = project.cash_sheet['Net_cash_flow']
+    return project.calcNPV(_worker['rate']), project._irr.solve(ncf)
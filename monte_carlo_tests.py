@@ -0,0 +1,94 @@
+"""monte_carlo_tests.py
+Unit tests for the Monte Carlo engine
+"""
+
+import unittest
+import os
+import monte_carlo as mc
+import ProjectFinance_daily as pf
+import UnitValues as uv
+import numpy as np
+import pandas as pd
+import datetime as dt
+from pf_errors import *
+
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pf_batch_test.xml')
+
+
+class DistributionTests(unittest.TestCase):
+
+    def testSampling(self):
+        """Seeded samples should be reproducible and fall inside the distribution's support"""
+        d = mc.TriangularDistribution(1.0, 2.0, 4.0)
+        a = d.sample(1000, np.random.RandomState(3))
+        b = d.sample(1000, np.random.RandomState(3))
+        self.assertTrue((a == b).all())
+        self.assertTrue(a.min() >= 1.0 and a.max() <= 4.0)
+        u = mc.UniformDistribution(0.8, 0.9).sample(1000, np.random.RandomState(3))
+        self.assertTrue(u.min() >= 0.8 and u.max() <= 0.9)
+        self.assertEqual(len(mc.NormalDistribution(0.0, 1.0).sample(10, np.random.RandomState(3))), 10)
+
+    def testBadDistributions(self):
+        self.assertRaises(BadDistributionInput, mc.NormalDistribution, 0.0, -1.0)
+        self.assertRaises(BadDistributionInput, mc.UniformDistribution, 2.0, 1.0)
+        self.assertRaises(BadDistributionInput, mc.TriangularDistribution, 1.0, 5.0, 4.0)
+
+
+class MonteCarloTests(unittest.TestCase):
+
+    def testBadSetup(self):
+        """The project has to be complete, and inputs have to be real parameters with Distribution objects"""
+        self.assertRaises(ProjFinError, mc.MonteCarlo, pf.CapitalProject(), 1.0)
+        sim = mc.MonteCarlo(pf.PF_FileLoader(fixture).load(), 1.0)
+        self.assertRaises(ProjFinError, sim.add_parameter, 'Gonzo', mc.NormalDistribution(0.0, 1.0))
+        self.assertRaises(BadDistributionInput, sim.add_parameter, 'Cap_factor', (0.8, 0.9))
+        self.assertRaises(ProjFinError, sim.add_attribute, sim.project.debt, 'gonzo', mc.NormalDistribution(0.0, 1.0))
+        self.assertRaises(ProjFinError, sim.run, 10)
+
+    def testVectorizedMatchesAssembly(self):
+        """The vectorized path should give the same NPV and IRR as assembling each sample, and leave the project as it was"""
+        proj = pf.PF_FileLoader(fixture).load()
+        sim = mc.MonteCarlo(proj, 1.5, seed = 7)
+        sim.add_parameter('Inflation_rate', mc.NormalDistribution(0.02, 0.005))
+        sim.add_parameter('Cap_factor', mc.UniformDistribution(0.8, 0.95))
+        sim.add_parameter('Design_cap', mc.TriangularDistribution(9E6, 1E7, 1.1E7))
+        self.assertTrue(sim.vectorized())
+        results = sim.run(20, block_size = 8, percentiles = (50,))
+
+        self.assertEqual(proj.fin_param['Inflation_rate'], 0.02)
+        self.assertEqual(proj.fin_param['Design_cap'].value, 10000000)
+        for i in (0, 9, 19):
+            check = pf.PF_FileLoader(fixture).load()
+            check.fin_param['Inflation_rate'] = results['Inflation_rate'][i]
+            check.fin_param['Cap_factor'] = results['Cap_factor'][i]
+            check.fin_param['Design_cap'] = uv.UnitVal(results['Design_cap'][i], 'kg')
+            check.assembleFinancials((1.5, 'fixed'))
+            self.assertAlmostEqual(results['NPV'][i]/check.calcNPV(check.period_rate(0.15)), 1.0, 10)
+            self.assertAlmostEqual(results['IRR'][i], check.annual_rate(check.calcIRR()), 10)
+
+        median = np.sort(results['NPV'].values)[10]
+        self.assertAlmostEqual(sim.percentile_sheets[50]['Net_cash_flow'].values.dot(proj._discount_factors(proj.period_rate(0.15)))/median, 1.0, 10)
+
+    def testPoolMatchesSerial(self):
+        """Samples evaluated across worker processes should give the same NPVs as evaluating them in this process, for the same seed"""
+        results = []
+        for workers in (1, 2):
+            sim = mc.MonteCarlo(pf.PF_FileLoader(fixture).load(), 1.5, seed = 11)
+            sim.add_parameter('Salvage_value', mc.UniformDistribution(5E4, 2E5))
+            sim.add_parameter('Cap_factor', mc.UniformDistribution(0.8, 0.95))
+            self.assertFalse(sim.vectorized())
+            results.append(sim.run(8, workers = workers, percentiles = (50,)))
+        self.assertTrue((results[0]['Salvage_value'] == results[1]['Salvage_value']).all())
+        self.assertTrue((results[0]['NPV'] == results[1]['NPV']).all())
+        np.testing.assert_allclose(results[1]['IRR'], results[0]['IRR'], rtol = 1E-12)
+
+        check = pf.PF_FileLoader(fixture).load()
+        check.fin_param['Salvage_value'] = results[0]['Salvage_value'][3]
+        check.fin_param['Cap_factor'] = results[0]['Cap_factor'][3]
+        check.assembleFinancials((1.5, 'fixed'))
+        self.assertAlmostEqual(results[1]['NPV'][3]/check.calcNPV(check.period_rate(0.15)), 1.0, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
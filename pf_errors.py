@@ -106,3 +106,18 @@ class TaxUnderdefinedError(ProjFinError):
 
 class TaxManagerError(ProjFinError):
     pass
+
+class CashSheetError(ProjFinError):
+    pass
+
+class BadIRRInput(ProjFinError):
+    pass
+
+class NoIRRError(ProjFinError):
+    pass
+
+class MultipleIRRError(ProjFinError):
+    pass
+
+class BadDistributionInput(ProjFinError):
+    pass
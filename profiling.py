@@ -0,0 +1,175 @@
+"""profiling.py
+Instrumentation for the assembly stages of a CapitalProject and the schedule builds of its line items
+"""
+
+import time
+import json
+import functools
+from pf_errors import *
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None			#pytracemalloc on Python 2; memory tracking is unavailable without it
+
+
+#The profiler seen by the decorated build_* methods; None (the usual case) means they just run
+_active = None
+
+
+class _NullTimer(object):
+    """Shared do-nothing context manager handed out by the null profiler"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class NullProfiler(object):
+    """Stand-in for a Profiler that records nothing -- every call returns the same no-op context manager"""
+    enabled = False
+
+    def session(self):
+        return _null_timer
+
+    def stage(self, name):
+        return _null_timer
+
+    def item(self, kind, name):
+        return _null_timer
+
+    def report(self):
+        return None
+
+null_profiler = NullProfiler()
+
+
+class _Timer(object):
+    """Adds one call's wall time (and net bytes allocated, if tracked) to a record of the profiler"""
+    def __init__(self, profiler, table, key):
+        self.profiler = profiler
+        self.table = table
+        self.key = key
+
+    def __enter__(self):
+        #Re-entrant calls on the same key (Loan.build_debt_schedule calling Debt.build_debt_schedule) are counted once
+        self.outer = self.key not in self.profiler._open
+        if self.outer:
+            self.profiler._open.add(self.key)
+            self.mem = self.profiler._memory()
+            self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if self.outer:
+            elapsed = time.time() - self.start
+            record = self.table.get(self.key)
+            if record is None:
+                record = self.table[self.key] = [0, 0.0, 0]
+            record[0] += 1
+            record[1] += elapsed
+            if self.mem is not None:
+                record[2] += self.profiler._memory() - self.mem
+            self.profiler._open.discard(self.key)
+        return False
+
+
+class Profiler(object):
+    """Records the calls, wall time, and (optionally) net bytes allocated of each assembly stage and each line item build.
+
+    Stage timings come from CapitalProject; item timings come from the build_* methods decorated with profiled, which record
+    into whichever profiler has an open session.  Item times are inclusive, so a container's time includes its members'."""
+    enabled = True
+
+    def __init__(self, track_memory = False):
+        if track_memory and tracemalloc is None:
+            raise ProjFinError, "Memory tracking needs the tracemalloc module"
+        self.track_memory = track_memory
+        self.reset()
+
+    def reset(self):
+        self.stages = {}			#stage:[calls, seconds, bytes]
+        self.items = {}				#(kind, name):[calls, seconds, bytes]
+        self.runs = 0
+        self.wall_time = 0.0
+        self._open = set()
+
+    def session(self):
+        """Context manager for one run -- line item builds inside it are recorded here"""
+        return _Session(self)
+
+    def stage(self, name):
+        return _Timer(self, self.stages, name)
+
+    def item(self, kind, name):
+        return _Timer(self, self.items, (kind, name))
+
+    def _memory(self):
+        if not self.track_memory:
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def report(self):
+        """Structured summary: totals, then every stage and every line item (grouped by kind) as calls/seconds/bytes"""
+        def entry(record):
+            return {'calls':record[0], 'seconds':record[1], 'bytes':record[2] if self.track_memory else None}
+
+        items = {}
+        for ((kind, name), record) in self.items.items():
+            items.setdefault(kind, {})[name] = entry(record)
+        return {'runs':self.runs, 'seconds':self.wall_time, 'memory_tracked':self.track_memory,
+                'stages':dict((name, entry(record)) for (name, record) in self.stages.items()), 'items':items}
+
+    def slowest_items(self, n = 10):
+        """The n line items with the most total build time, as (kind, name, seconds, calls)"""
+        ranked = sorted(self.items.items(), key = lambda i: i[1][1], reverse = True)
+        return [(kind, name, record[1], record[0]) for ((kind, name), record) in ranked[:n]]
+
+    def to_json(self, filename = None):
+        """Returns the report as a JSON string, or writes it to filename"""
+        text = json.dumps(self.report(), indent = 2, sort_keys = True)
+        if filename is None:
+            return text
+        f = open(filename, 'w')
+        f.write(text)
+        f.close()
+
+
+class _Session(object):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        _active = self.profiler
+        self.started_tracing = self.profiler.track_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.start = time.time()
+        return self.profiler
+
+    def __exit__(self, *exc):
+        global _active
+        self.profiler.wall_time += time.time() - self.start
+        self.profiler.runs += 1
+        if self.started_tracing:
+            tracemalloc.stop()
+        _active = self.previous
+        return False
+
+
+def profiled(kind):
+    """Decorator for the build_* methods of line items; records each call under (kind, item name) when a profiler session is open"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if _active is None:
+                return method(self, *args, **kwargs)
+            with _active.item(kind, getattr(self, 'name', None) or self.__class__.__name__):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
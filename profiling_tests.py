@@ -0,0 +1,88 @@
+"""profiling_tests.py
+Unit tests for the stage and line item profiler
+"""
+
+import unittest
+import os
+import json
+import profiling
+import ProjectFinance_daily as pf
+from pf_errors import *
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pf_batch_test.xml')
+
+
+class Item(object):
+    def __init__(self, name):
+        self.name = name
+
+    @profiling.profiled('widget')
+    def build(self, n = 1):
+        if n > 1:
+            self.build(n-1)
+        return n
+
+class Parent(Item):
+    @profiling.profiled('widget')
+    def build(self, n = 1):
+        return super(Parent, self).build(n)
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def testItems(self):
+        """Decorated builds are recorded only inside a session, and re-entrant calls on the same item count once"""
+        prof = profiling.Profiler()
+        a = Item('a')
+        self.assertEqual(a.build(), 1)
+        with prof.session():
+            a.build(3)
+            Parent('b').build()
+            Item(None).build()
+        a.build()
+        report = prof.report()
+        self.assertEqual(report['runs'], 1)
+        self.assertEqual(sorted(report['items']['widget'].keys()), ['Item', 'a', 'b'])
+        self.assertEqual(report['items']['widget']['a']['calls'], 1)
+        self.assertEqual(report['items']['widget']['b']['calls'], 1)
+        self.assertEqual(report['items']['widget']['a']['bytes'], None)
+        self.assertEqual([i[1] for i in prof.slowest_items(2)], sorted(['a', 'b', 'Item'], key = lambda n: -report['items']['widget'][n]['seconds'])[:2])
+        self.assertEqual(json.loads(prof.to_json())['runs'], 1)
+        self.assertEqual(profiling._active, None)
+
+    def testProjectStages(self):
+        """A profiled project should report every stage it ran, and an unprofiled one should report nothing"""
+        proj = pf.PF_FileLoader(fixture).load()
+        proj.assembleFinancials((1.5, 'fixed'))
+        self.assertEqual(proj.profile_report, None)
+
+        proj.enable_profiling()
+        proj.assembleFinancials((1.5, 'fixed'))
+        stages = proj.profile_report['stages']
+        self.assertEqual(sorted(stages.keys()), sorted(pf.CapitalProject.stage_order))
+        self.assertTrue(all(s['calls'] == 1 and s['seconds'] >= 0.0 for s in stages.values()))
+
+        proj.fin_param['Cap_factor'] = 0.8
+        self.assertEqual(proj.recompute(), ['output', 'revenue', 'variable', 'other'])
+        stages = proj.profile_report['stages']
+        self.assertEqual(stages['output']['calls'], 2)
+        self.assertEqual(stages['capex']['calls'], 1)
+        self.assertEqual(proj.profile_report['runs'], 2)
+
+        proj.disable_profiling()
+        proj.recompute((2.0, 'fixed'))
+        self.assertEqual(proj.profile_report, None)
+
+    def testMemoryTracking(self):
+        """Memory tracking needs tracemalloc"""
+        if profiling.tracemalloc is None:
+            self.assertRaises(ProjFinError, profiling.Profiler, track_memory = True)
+        else:
+            prof = profiling.Profiler(track_memory = True)
+            with prof.session():
+                Item('a').build()
+            self.assertTrue(isinstance(prof.report()['items']['widget']['a']['bytes'], (int, long)))
+
+
+if __name__ == "__main__":
+    unittest.main()
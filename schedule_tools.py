@@ -0,0 +1,274 @@
+"""schedule_tools.py
+Integer day-offset calendar and the dense schedules laid out on it, so schedules are aligned by slicing instead of index joins
+"""
+
+import numpy as np
+import pandas as pd
+from pf_errors import *
+import dataFrame_pd as df
+
+
+DAY_NS = 86400*10**9			#nanoseconds in a day
+
+
+class DayCalendar(object):
+    """Maps dates to signed integer day offsets from an anchor date (the project's Initial_period)"""
+
+    def __init__(self, anchor):
+        try:
+            anchor = pd.Timestamp(anchor)
+        except (TypeError, ValueError):
+            raise BadScheduleDateError, "The calendar anchor must be a date, got %s" % type(anchor)
+        if anchor.value % DAY_NS != 0:
+            raise BadScheduleDateError, "The calendar anchor must fall on midnight, got %s" % anchor
+        self.anchor = anchor
+        self._anchor_ns = anchor.value
+
+    def offsets(self, dates):
+        """Returns the int32 day offset of each date; every date must fall on midnight"""
+        try:
+            if not isinstance(dates, pd.DatetimeIndex):
+                dates = pd.DatetimeIndex(dates)
+            ns = dates.asi8 - self._anchor_ns
+        except (TypeError, ValueError):
+            raise BadScheduleDateError, "Schedules must be indexed by dates"
+        (days, rem) = np.divmod(ns, DAY_NS)
+        if rem.any():
+            raise BadScheduleDateError, "Schedule dates must fall on midnight"
+        return days.astype(np.int32)
+
+    def offset(self, date):
+        return int(self.offsets([date])[0])
+
+    def dates(self, offsets):
+        """Returns the DatetimeIndex for an array of day offsets"""
+        return pd.DatetimeIndex(np.asarray(offsets, dtype = np.int64)*DAY_NS + self._anchor_ns)
+
+    def schedule(self, frame, columns = None):
+        """Lays a date-indexed frame (or series) out on this calendar"""
+        return OffsetSchedule.from_frame(self, frame, columns)
+
+    def __eq__(self, other):
+        return isinstance(other, DayCalendar) and self.anchor == other.anchor
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def anchor_calendar(index):
+    """A calendar anchored on the first day of a date index, for schedules that are not tied to a project"""
+    if len(index) == 0:
+        return DayCalendar(pd.Timestamp('2000-01-01'))
+    try:
+        return DayCalendar(pd.Timestamp(index[0]).normalize())
+    except (TypeError, ValueError, AttributeError):
+        raise BadScheduleDateError, "Schedules must be indexed by dates"
+
+
+class PeriodCodes(object):
+    """The fiscal year of each day of a date index, coded 0..n-1 in order, so daily columns are summed into years in one
+    pass and annual values are spread back over the days with one gather.  Fiscal years start in first_month and are
+    named for the calendar year they end in, so the default is the calendar year."""
+
+    def __init__(self, index, first_month = 1):
+        index = pd.DatetimeIndex(index)
+        years = np.asarray(index.year)
+        if first_month > 1:
+            years = years + (np.asarray(index.month) >= first_month)
+        self.index = index
+        self.first_month = first_month
+        (self.periods, self.codes) = np.unique(years, return_inverse = True)
+        #days in date order make each period one run of rows, which reduceat sums directly
+        self._starts = np.flatnonzero(np.diff(self.codes) != 0) + 1 if (np.diff(self.codes) >= 0).all() else None
+        if self._starts is not None and len(self.codes) > 0:
+            self._starts = np.concatenate(([0], self._starts))
+
+    def __len__(self):
+        return len(self.periods)
+
+    def matches(self, index):
+        """Whether these codes were built for (an index equal to) index"""
+        return index is self.index or (len(index) == len(self.index) and self.index.equals(index))
+
+    def aggregate(self, values):
+        """Sums daily values (a vector, or a days x columns array) into periods; missing values count as zero"""
+        values = np.asarray(values, dtype = float)
+        if np.isnan(values).any():
+            values = np.where(np.isnan(values), 0.0, values)
+        if len(self.codes) == 0:
+            return np.zeros((0,) + values.shape[1:])
+        if self._starts is not None:
+            return np.add.reduceat(values, self._starts, axis = 0)
+        if values.ndim == 1:
+            return np.bincount(self.codes, values, minlength = len(self.periods))
+        return np.column_stack([np.bincount(self.codes, values[:, j], minlength = len(self.periods)) for j in range(values.shape[1])])
+
+    def spread(self, values):
+        """Returns the value of each day's period, for an array of per-period values"""
+        return np.asarray(values)[self.codes]
+
+
+class OffsetSchedule(object):
+    """Columns of daily values over the days [start, start + n) of a calendar.
+
+    values is a dense (days x columns) float array; present marks the days that carry an entry, so a schedule of monthly
+    payments converts back to a frame with just those dates, the same as the outer joins it replaces."""
+
+    def __init__(self, calendar, start, values, columns, present = None):
+        values = np.asarray(values, dtype = float)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        if values.shape[1] != len(columns):
+            raise ProjFinError, "There are %s value columns for %s column names" % (values.shape[1], len(columns))
+        self.calendar = calendar
+        self.start = int(start)
+        self.values = values
+        self.columns = list(columns)
+        self.present = np.ones(len(values), dtype = bool) if present is None else present
+
+    @classmethod
+    def from_frame(cls, calendar, frame, columns = None):
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame()
+        if columns is None:
+            columns = list(frame.columns)
+        if len(frame.index) == 0:
+            return cls(calendar, 0, np.zeros((0, len(columns))), columns)
+        offsets = calendar.offsets(frame.index)
+        lo = offsets.min()
+        pos = offsets - lo
+        if list(frame.columns) == list(columns):
+            data = np.asarray(frame.values, dtype = float)
+        else:
+            data = np.column_stack([np.asarray(frame[c], dtype = float) for c in columns])
+        values = np.zeros((offsets.max() - lo + 1, len(columns)))
+        if len(pos) == len(values) and (np.diff(pos) == 1).all():
+            #Already dense and in order, the usual daily schedule
+            values[pos] = data
+        else:
+            np.add.at(values, pos, data)
+        present = np.zeros(len(values), dtype = bool)
+        present[pos] = True
+        return cls(calendar, lo, values, columns, present)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end(self):
+        return self.start + len(self.values)
+
+    def __getitem__(self, column):
+        try:
+            return self.values[:, self.columns.index(column)]
+        except ValueError:
+            raise KeyError(column)
+
+    def join(self, *others):
+        """Returns a new schedule with the columns of this one and the others side by side, over the union of their days"""
+        schedules = [self] + list(others)
+        columns = [c for s in schedules for c in s.columns]
+        if len(set(columns)) != len(columns):
+            raise ProjFinError, "Joined schedules cannot share column names"
+        for s in others:
+            if s.calendar != self.calendar:
+                raise ProjFinError, "Only schedules on the same calendar can be joined"
+        spans = [s for s in schedules if len(s) > 0]
+        if not spans:
+            return OffsetSchedule(self.calendar, 0, np.zeros((0, len(columns))), columns)
+
+        lo = min(s.start for s in spans)
+        values = np.zeros((max(s.end for s in spans) - lo, len(columns)))
+        present = np.zeros(len(values), dtype = bool)
+        col = 0
+        for s in schedules:
+            rows = slice(s.start - lo, s.end - lo)
+            values[rows, col:col + len(s.columns)] = s.values
+            present[rows] |= s.present
+            col += len(s.columns)
+        return OffsetSchedule(self.calendar, lo, values, columns, present)
+
+    def to_frame(self):
+        """Returns the date-indexed frame of the days that carry an entry"""
+        rows = np.flatnonzero(self.present)
+        return df.DataFrame(self.values[rows], index = self.calendar.dates(self.start + rows), columns = self.columns)
+
+
+class ScheduleAccumulator(object):
+    """Sums the schedules of a container's items into one schedule over the union of their days.
+
+    Items are laid out on the calendar as they are added, and the total is allocated once for the whole span and filled
+    by slice-adding each item, so the build is linear in the number of items.  A column missing from an item counts as
+    zero.  With detailed, each item's columns are also kept side by side as '<item name>_<column>'."""
+
+    def __init__(self, calendar = None, detailed = False, detail_columns = None):
+        self.calendar = calendar
+        self.detailed = detailed
+        self.detail_columns = detail_columns		#the item columns to keep when detailed; all of them by default
+        self.items = []					#(name, OffsetSchedule, units)
+
+    def add(self, frame, name = None):
+        """Adds a date-indexed frame (or series); name labels its detail columns"""
+        if self.calendar is None:
+            self.calendar = anchor_calendar(frame.index)
+        units = getattr(frame, 'units', None)
+        self.items.append((name, self.calendar.schedule(frame), dict(units) if units else {}))
+
+    def add_values(self, start, values, columns, name = None, units = None):
+        """Adds dense daily values (a vector, or a days x columns array) running from the date start, without a date index"""
+        if self.calendar is None:
+            self.calendar = anchor_calendar([start])
+        schedule = OffsetSchedule(self.calendar, self.calendar.offset(start), values, columns)
+        self.items.append((name, schedule, dict(units) if units else {}))
+
+    def total(self):
+        """Returns the summed OffsetSchedule, followed by the detail columns if detailed"""
+        columns = []
+        positions = {}
+        for (name, s, units) in self.items:
+            for c in s.columns:
+                if c not in positions:
+                    positions[c] = len(columns)
+                    columns.append(c)
+        n_total = len(columns)
+        details = []
+        if self.detailed:
+            for (name, s, units) in self.items:
+                for c in s.columns:
+                    if self.detail_columns is None or c in self.detail_columns:
+                        details.append((name, s, c))
+                        columns.append("%s_%s" % (name, c))
+
+        calendar = self.calendar if self.calendar is not None else anchor_calendar([])
+        spans = [s for (name, s, units) in self.items if len(s) > 0]
+        if not spans:
+            return OffsetSchedule(calendar, 0, np.zeros((0, len(columns))), columns)
+        lo = min(s.start for s in spans)
+        values = np.zeros((max(s.end for s in spans) - lo, len(columns)))
+        present = np.zeros(len(values), dtype = bool)
+        for (name, s, units) in self.items:
+            r0 = s.start - lo
+            present[r0:r0 + len(s)] |= s.present
+            idx = [positions[c] for c in s.columns]
+            if not idx:
+                continue
+            #an item's columns are distinct, so in order and spanning len(idx) positions means they add as one block
+            if idx[-1] - idx[0] == len(idx) - 1 and idx == sorted(idx):
+                values[r0:r0 + len(s), idx[0]:idx[-1] + 1] += s.values
+            else:
+                values[r0:r0 + len(s), idx] += s.values
+        for (i, (name, s, c)) in enumerate(details):
+            values[s.start - lo:s.end - lo, n_total + i] = s[c]
+        return OffsetSchedule(calendar, lo, values, columns, present)
+
+    def frame(self):
+        """Returns the total as a date-indexed frame, carrying the units of the items' columns (the first item's, for the sums)"""
+        total = self.total()
+        frame = total.to_frame()
+        if hasattr(frame, 'units'):
+            for (name, s, units) in reversed(self.items):
+                frame.units.update((c, u) for (c, u) in units.items() if c in total.columns)
+            if self.detailed:
+                for (name, s, units) in self.items:
+                    frame.units.update(("%s_%s" % (name, c), u) for (c, u) in units.items() if "%s_%s" % (name, c) in total.columns)
+        return frame
@@ -0,0 +1,150 @@
+"""schedule_tools_tests.py
+Unit tests for the day-offset calendar and offset schedules
+"""
+
+import unittest
+import schedule_tools as st
+import numpy as np
+import pandas as pd
+import datetime as dt
+from pf_errors import *
+import dataFrame_pd as df
+
+
+class DayCalendarTests(unittest.TestCase):
+
+    def testOffsets(self):
+        """Dates map to signed day offsets from the anchor and back"""
+        cal = st.DayCalendar(dt.datetime(2015,01,01))
+        dates = pd.DatetimeIndex([dt.datetime(2014,12,31), dt.datetime(2015,01,01), dt.datetime(2016,01,01)])
+        offsets = cal.offsets(dates)
+        self.assertEqual(list(offsets), [-1, 0, 365])
+        self.assertEqual(offsets.dtype, np.int32)
+        self.assertTrue((cal.dates(offsets) == dates).all())
+        self.assertEqual(cal.offset(dt.datetime(2015,03,01)), 59)
+        self.assertRaises(BadScheduleDateError, cal.offsets, [dt.datetime(2015,01,01,12)])
+        self.assertRaises(BadScheduleDateError, st.DayCalendar, dt.datetime(2015,01,01,6))
+        self.assertEqual(cal, st.DayCalendar(pd.Timestamp('2015-01-01')))
+
+
+class PeriodCodesTests(unittest.TestCase):
+
+    def testAggregateAndSpread(self):
+        """Daily values sum into years and spread back, whether or not the days are in order"""
+        dates = pd.date_range(dt.datetime(2015,12,30), dt.datetime(2017,01,02), freq = 'D')
+        periods = st.PeriodCodes(dates)
+        self.assertEqual(list(periods.periods), [2015, 2016, 2017])
+        values = np.column_stack([np.ones(len(dates)), np.arange(len(dates), dtype = float)])
+        totals = periods.aggregate(values)
+        self.assertEqual(list(totals[:, 0]), [2.0, 366.0, 2.0])
+        self.assertEqual(totals[:, 1].sum(), values[:, 1].sum())
+        self.assertEqual(list(periods.spread([1.0, 2.0, 3.0])[[0, 2, -1]]), [1.0, 2.0, 3.0])
+
+        shuffled = st.PeriodCodes(dates[::-1])
+        self.assertTrue(np.allclose(shuffled.aggregate(values[::-1]), totals))
+        self.assertTrue(periods.matches(pd.DatetimeIndex(list(dates))))
+        self.assertFalse(periods.matches(dates[1:]))
+
+        #fiscal years starting in October are named for the year they end in
+        fiscal = st.PeriodCodes(pd.DatetimeIndex([dt.datetime(2015,9,30), dt.datetime(2015,10,01)]), first_month = 10)
+        self.assertEqual(list(fiscal.periods), [2015, 2016])
+
+
+class OffsetScheduleTests(unittest.TestCase):
+
+    def testJoinMatchesOuterJoin(self):
+        """Joining offset schedules should give the same frame as an outer join of the date-indexed frames with the gaps zeroed"""
+        cal = st.DayCalendar(dt.datetime(2015,01,01))
+        daily = pd.DataFrame({'income':np.arange(400.0)}, index = pd.date_range(dt.datetime(2015,03,01), periods = 400, freq = 'D'))
+        monthly = pd.DataFrame({'payments':np.arange(1.0, 25.0), 'fees':1.0}, index = pd.date_range(dt.datetime(2014,06,30), periods = 24, freq = 'M'))
+        monthly = monthly[['payments', 'fees']]
+
+        joined = cal.schedule(daily).join(cal.schedule(monthly))
+        expected = daily.join(monthly, how = 'outer').fillna(0.0)
+        frame = joined.to_frame()
+        self.assertTrue((frame.index == expected.index).all())
+        self.assertEqual(list(frame.columns), ['income', 'payments', 'fees'])
+        self.assertTrue((frame.values == expected.values).all())
+        self.assertEqual(joined.start, cal.offset(dt.datetime(2014,06,30)))
+        self.assertTrue((joined['payments'][joined.present] == expected['payments'].values).all())
+        self.assertRaises(KeyError, joined.__getitem__, 'gonzo')
+        self.assertRaises(ProjFinError, joined.join, cal.schedule(daily))
+        self.assertRaises(ProjFinError, cal.schedule(daily).join, st.DayCalendar(dt.datetime(2012,01,01)).schedule(monthly))
+
+    def testRepeatedDates(self):
+        """Entries on the same date are summed, and an empty frame gives an empty schedule"""
+        cal = st.DayCalendar(dt.datetime(2015,01,01))
+        s = pd.Series([1.0, 2.0, 3.0], index = [dt.datetime(2015,01,05), dt.datetime(2015,01,02), dt.datetime(2015,01,05)], name = 'x')
+        schedule = cal.schedule(s)
+        self.assertEqual((schedule.start, schedule.end), (1, 5))
+        self.assertEqual(list(schedule['x']), [2.0, 0.0, 0.0, 4.0])
+        self.assertEqual(list(schedule.present), [True, False, False, True])
+        self.assertEqual(list(cal.schedule(pd.Series([1.0, 2.0, 3.0], index = [dt.datetime(2015,01,01), dt.datetime(2015,01,01), dt.datetime(2015,01,03)]))[0]), [3.0, 0.0, 3.0])
+        empty = cal.schedule(pd.DataFrame({'y':[]}, index = pd.DatetimeIndex([])))
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.join(schedule).to_frame()), 2)
+
+
+class ScheduleAccumulatorTests(unittest.TestCase):
+
+    def testTotals(self):
+        """The accumulated total should match chained outer joins and adds, with missing entries counted as zero"""
+        a = pd.DataFrame({'direct_costs':[1.0, 2.0, 3.0], 'depreciation':[0.5, 0.5, 0.5]}, index = pd.date_range(dt.datetime(2015,01,01), periods = 3, freq = 'D'))
+        b = pd.DataFrame({'direct_costs':[10.0, 20.0]}, index = pd.date_range(dt.datetime(2015,01,03), periods = 2, freq = 'D'))
+        c = pd.Series([100.0], index = [dt.datetime(2014,12,31)], name = 'indirect_costs')
+
+        acc = st.ScheduleAccumulator()
+        for item in (a, b, c):
+            acc.add(item)
+        frame = acc.frame()
+        expected = a.add(b, fill_value = 0.0).add(c.to_frame(), fill_value = 0.0).fillna(0.0)
+        self.assertEqual(list(frame.columns), ['depreciation', 'direct_costs', 'indirect_costs'])
+        self.assertTrue((frame.index == expected.index).all())
+        self.assertTrue((frame[expected.columns].values == expected.values).all())
+        self.assertEqual(len(st.ScheduleAccumulator().frame()), 0)
+
+    def testColumnOrder(self):
+        """Items with their columns in another order, or with no columns at all, should still add up by name"""
+        dates = pd.date_range(dt.datetime(2015,01,01), periods = 2, freq = 'D')
+        a = pd.DataFrame([[1.0, 2.0, 3.0, 4.0]], index = dates[:1], columns = ['a', 'b', 'c', 'd'])
+        b = pd.DataFrame([[10.0, 30.0, 20.0, 40.0]], index = dates[1:], columns = ['a', 'c', 'b', 'd'])
+        acc = st.ScheduleAccumulator()
+        acc.add(a)
+        acc.add(b)
+        acc.add(pd.DataFrame(index = dates))
+        frame = acc.frame()
+        self.assertEqual(list(frame.columns), ['a', 'b', 'c', 'd'])
+        self.assertEqual(list(frame.loc[dates[1]]), [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(len(frame), 2)
+
+    def testDetailed(self):
+        """Detailed accumulation keeps each item's columns, with their units"""
+        dates = pd.date_range(dt.datetime(2015,01,01), periods = 4, freq = 'D')
+        a = df.DataFrame({'rate':1.0, 'revenue':2.0, 'price':0.5}, index = dates)
+        a.units = {'rate':'gal/day', 'revenue':'$/day', 'price':'$/gal'}
+        b = df.DataFrame({'rate':3.0, 'revenue':4.0, 'price':0.5}, index = dates[1:])
+        b.units = {'rate':'kg/day', 'revenue':'$/day', 'price':'$/kg'}
+        acc = st.ScheduleAccumulator(detailed = True, detail_columns = ['rate', 'revenue'])
+        acc.add(a, 'a')
+        acc.add(b, 'b')
+        frame = acc.frame()
+        self.assertEqual(list(frame['revenue']), [2.0, 6.0, 6.0, 6.0])
+        self.assertEqual(list(frame['b_rate']), [0.0, 3.0, 3.0, 3.0])
+        self.assertTrue('a_price' not in frame.columns)
+        self.assertEqual(frame.units['rate'], 'gal/day')
+        self.assertEqual(frame.units['b_rate'], 'kg/day')
+
+    def testAddValues(self):
+        """Dense values from a start date should add like the equivalent daily frame"""
+        a = pd.DataFrame({'depreciation':[1.0, 2.0, 3.0]}, index = pd.date_range(dt.datetime(2015,01,02), periods = 3, freq = 'D'))
+        acc = st.ScheduleAccumulator()
+        acc.add_values(dt.datetime(2015,01,03), np.array([10.0, 20.0, 30.0]), ['depreciation'])
+        acc.add(a)
+        frame = acc.frame()
+        self.assertEqual(list(frame.index), list(pd.date_range(dt.datetime(2015,01,02), periods = 4, freq = 'D')))
+        self.assertEqual(list(frame['depreciation']), [1.0, 12.0, 23.0, 30.0])
+        self.assertEqual(acc.calendar.anchor, pd.Timestamp(dt.datetime(2015,01,03)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""sensitivity.py
+One-at-a-time (tornado) sensitivity analysis of a CapitalProject
+"""
+
+import numpy as np
+import multiprocessing as mp
+import ProjectFinance_daily as pf
+import UnitValues as uv
+from pf_errors import *
+import dataFrame_pd as df
+
+
+class SensitivityAnalyzer(object):
+    """Swings each input to a low and a high value, one at a time, and ranks the inputs by the swing in NPV.
+
+    Each perturbation only marks the stages that read the perturbed input as dirty, so CapitalProject.recompute rebuilds
+    those stages and the ones downstream of them, and every other component keeps its cached schedules.  The perturbations
+    are spread across a pool of worker processes, each of which assembles its copy of the project once up front.  rate is the
+    annual discount rate for the NPV (Target_IRR by default), and the IRRs are annual too."""
+
+    def __init__(self, project, price, mode = "fixed", rate = None):
+        if False in project.check_bits:
+            raise ProjFinError, "Not all of the inputs (capex, etc.) have been set yet"
+        self.project = project
+        self.price = (price, mode)
+        self.rate = rate
+        self.inputs = []			#(name, target, attribute, stage, low, high); target is None for financial parameters
+        self.base_npv = None
+        self.base_irr = None
+        self.tornado = None
+
+    def add_parameter(self, key, low, high):
+        """Swings a FinancialParameters key; Design_cap is given as magnitudes in its current units"""
+        if key not in self.project.fin_param.key_list:
+            raise ProjFinError, "%s is not a valid financial parameter" % key
+        self._add(key, None, key, None, low, high)
+
+    def add_capital_price(self, name, low, high):
+        """Swings the quote base price of the named capital expense (direct or indirect)"""
+        item = self._find_capital_item(self.project.capex, name)
+        if item is None:
+            raise ProjFinError, "There is no capital expense named %s in the project" % name
+        if item.quote_basis is None:
+            raise ProjFinError, "The capital expense %s does not have a quote basis" % name
+        self._add("%s base_price" % name, item.quote_basis, 'base_price', 'capex', low, high)
+
+    def add_loan_rate(self, name, low, high):
+        """Swings the interest rate of the named loan"""
+        for debt in self.project.debt.debts:
+            if debt.name == name:
+                self._add("%s rate" % name, debt, 'rate', 'debt', low, high)
+                return
+        raise ProjFinError, "There is no loan named %s in the debt portfolio" % name
+
+    def _add(self, name, target, attribute, stage, low, high):
+        if name in [i[0] for i in self.inputs]:
+            raise ProjFinError, "%s is already in the sensitivity analysis" % name
+        self.inputs.append((name, target, attribute, stage, low, high))
+
+    def _find_capital_item(self, capex, name):
+        for item in capex.direct_capital + capex.indirect_capital:
+            if isinstance(item, pf.CapitalCosts):
+                found = self._find_capital_item(item, name)
+                if found is not None:
+                    return found
+            elif item.name == name:
+                return item
+        return None
+
+    def run(self, workers = None):
+        """Runs every perturbation and returns the tornado table, ranked by the swing in NPV"""
+        if len(self.inputs) == 0:
+            raise ProjFinError, "There are no inputs to swing"
+        rate = self.project.period_rate(self.rate if self.rate is not None else self.project.fin_param['Target_IRR'])
+
+        tasks = [(i, v) for i in range(len(self.inputs)) for v in self.inputs[i][4:6]]
+        if workers == 1:
+            _init_worker(self.project, self.inputs, self.price, rate)
+            results = [_evaluate(task) for task in tasks]
+            _worker.clear()
+        else:
+            pool = mp.Pool(processes = workers, initializer = _init_worker, initargs = (self.project, self.inputs, self.price, rate))
+            try:
+                results = pool.map(_evaluate, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        #The base case, and the project left as we found it
+        self.project.assembleFinancials(self.price)
+        self.base_npv = self.project.calcNPV(rate)
+        self.base_irr = self.project.annual_rate(self.project._irr.solve(self.project.cash_sheet['Net_cash_flow']))
+
+        names = [i[0] for i in self.inputs]
+        results = np.array(results).reshape(len(self.inputs), 2, 2)
+        table = df.DataFrame({'low':[i[4] for i in self.inputs], 'high':[i[5] for i in self.inputs], 'NPV_low':results[:,0,0], 'NPV_high':results[:,1,0], 'IRR_low':results[:,0,1], 'IRR_high':results[:,1,1]}, index = names)
+        table['NPV_swing'] = np.abs(table['NPV_high'] - table['NPV_low'])
+        table['IRR_swing'] = np.abs(table['IRR_high'] - table['IRR_low'])
+        table = table.sort_values('NPV_swing', ascending = False)
+        table.index.name = 'input'
+        self.tornado = table[['low', 'high', 'NPV_low', 'NPV_high', 'NPV_swing', 'IRR_low', 'IRR_high', 'IRR_swing']]
+        return self.tornado
+
+
+def _set_input(project, target, attribute, stage, value):
+    """Sets one input and marks its stage dirty -- financial parameters mark themselves through their revision counts"""
+    if target is not None:
+        setattr(target, attribute, value)
+        project._dirty.add(stage)
+    elif attribute == 'Design_cap' and not isinstance(value, uv.UnitVal):
+        project.fin_param[attribute] = uv.UnitVal(value, project.fin_param[attribute].units)
+    else:
+        project.fin_param[attribute] = value
+
+def _get_input(project, target, attribute):
+    if target is None:
+        return project.fin_param[attribute]
+    return getattr(target, attribute)
+
+
+#Worker process state -- set once per worker by the pool initializer
+_worker = {}
+
+def _init_worker(project, inputs, price, rate):
+    project.assembleFinancials(price)
+    _worker.update(project = project, inputs = inputs, rate = rate)
+
+def _evaluate(task):
+    (i, value) = task
+    project = _worker['project']
+    (name, target, attribute, stage, low, high) = _worker['inputs'][i]
+    base = _get_input(project, target, attribute)
+    try:
+        _set_input(project, target, attribute, stage, value)
+        project.recompute()
+        return project.calcNPV(_worker['rate']), project.annual_rate(project._irr.solve(project.cash_sheet['Net_cash_flow']))
+    finally:
+        #The restored stage is rebuilt by the next task's recompute
+        _set_input(project, target, attribute, stage, base)
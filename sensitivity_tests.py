@@ -0,0 +1,87 @@
+"""sensitivity_tests.py
+Unit tests for the tornado sensitivity analysis
+"""
+
+import unittest
+import os
+import sensitivity as sa
+import numpy as np
+import ProjectFinance_daily as pf
+from pf_errors import *
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pf_batch_test.xml')
+
+
+class SensitivityAnalyzerTests(unittest.TestCase):
+
+    def testBadInputs(self):
+        """Only real parameters, capital items, and loans can be swung"""
+        analyzer = sa.SensitivityAnalyzer(pf.PF_FileLoader(fixture).load(), 1.5)
+        self.assertRaises(ProjFinError, analyzer.add_parameter, 'Gonzo', 1.0, 2.0)
+        self.assertRaises(ProjFinError, analyzer.add_loan_rate, 'loan1', 0.05, 0.10)
+        analyzer.add_parameter('Cap_factor', 0.8, 0.95)
+        self.assertRaises(ProjFinError, analyzer.add_parameter, 'Cap_factor', 0.7, 0.9)
+
+    def testTornado(self):
+        """Each swing should match a cold assembly at the perturbed value, and the table should be ranked by NPV swing"""
+        proj = pf.PF_FileLoader(fixture).load()
+        analyzer = sa.SensitivityAnalyzer(proj, 1.5)
+        analyzer.add_parameter('Cap_factor', 0.8, 0.95)
+        analyzer.add_parameter('Federal_tax_rate', 0.25, 0.35)
+        analyzer.add_parameter('Inflation_rate', 0.0, 0.04)
+        analyzer.add_parameter('Salvage_value', 0.0, 200000.0)
+        tornado = analyzer.run(workers = 1)
+
+        self.assertEqual(list(tornado['NPV_swing']), sorted(tornado['NPV_swing'], reverse = True))
+        self.assertEqual(proj.fin_param['Cap_factor'], 0.9)
+        for (key, column, value) in (('Inflation_rate', 'NPV_high', 0.04), ('Federal_tax_rate', 'NPV_low', 0.25), ('Salvage_value', 'NPV_high', 200000.0)):
+            check = pf.PF_FileLoader(fixture).load()
+            check.fin_param[key] = value
+            check.assembleFinancials((1.5, 'fixed'))
+            rate = check.period_rate(check.fin_param['Target_IRR'])
+            self.assertAlmostEqual(tornado[column][key]/check.calcNPV(rate), 1.0, 10)
+        self.assertAlmostEqual(analyzer.base_npv/proj.calcNPV(proj.period_rate(proj.fin_param['Target_IRR'])), 1.0, 12)
+        self.assertAlmostEqual(analyzer.base_irr, proj.annual_rate(proj.calcIRR()), 10)
+
+        pooled = sa.SensitivityAnalyzer(pf.PF_FileLoader(fixture).load(), 1.5)
+        for item in analyzer.inputs:
+            pooled.add_parameter(item[0], item[4], item[5])
+        self.assertTrue(np.allclose(pooled.run(workers = 2)['NPV_low'], tornado['NPV_low'], rtol = 1E-12))
+
+    def testCapitalPriceAndLoanRate(self):
+        """Dearer equipment and dearer debt should both lower the NPV and IRR, and each swing should match a cold assembly"""
+        proj = pf.PF_FileLoader(fixture).load()
+        analyzer = sa.SensitivityAnalyzer(proj, 0.8, rate = 0.10)
+        analyzer.add_capital_price('gasifier', 2000000.0, 3000000.0)
+        analyzer.add_capital_price('Land', 250000.0, 1000000.0)
+        analyzer.add_loan_rate('term_loan', 0.05, 0.10)
+        self.assertRaises(ProjFinError, analyzer.add_capital_price, 'gonzo', 1.0, 2.0)
+        tornado = analyzer.run(workers = 1)
+
+        for name in ['gasifier base_price', 'Land base_price', 'term_loan rate']:
+            self.assertTrue(tornado['NPV_high'][name] < analyzer.base_npv < tornado['NPV_low'][name])
+            self.assertTrue(tornado['IRR_high'][name] < analyzer.base_irr < tornado['IRR_low'][name])
+        #the inputs are restored afterwards
+        self.assertEqual(proj.capex.direct_capital[0].quote_basis.base_price, 2500000.0)
+        self.assertEqual(proj.debt.debts[0].rate, 0.07)
+
+        check = pf.PF_FileLoader(fixture).load()
+        check.capex.direct_capital[0].quote_basis.base_price = 3000000.0
+        check.debt.debts[0].rate = 0.10
+        check.assembleFinancials((0.8, 'fixed'))
+        base = pf.PF_FileLoader(fixture).load()
+        base.assembleFinancials((0.8, 'fixed'))
+        self.assertAlmostEqual(analyzer.base_npv/base.calcNPV(base.period_rate(0.10)), 1.0, 10)
+        #the two high swings are independent, so their NPV changes add up
+        combined = tornado['NPV_high']['gasifier base_price'] + tornado['NPV_high']['term_loan rate'] - analyzer.base_npv
+        self.assertAlmostEqual(check.calcNPV(check.period_rate(0.10))/combined, 1.0, 8)
+
+        pooled = sa.SensitivityAnalyzer(pf.PF_FileLoader(fixture).load(), 0.8, rate = 0.10)
+        pooled.add_capital_price('gasifier', 2000000.0, 3000000.0)
+        pooled.add_capital_price('Land', 250000.0, 1000000.0)
+        pooled.add_loan_rate('term_loan', 0.05, 0.10)
+        np.testing.assert_allclose(pooled.run(workers = 2)['NPV_high'], tornado['NPV_high'], rtol = 1E-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -726,6 +726,9 @@ class TaxManagerTests(unittest.TestCase):
 		self.assertAlmostEqual(manager.schedule.loc[td,'fed2_tax'], f2tv,4)
 		self.assertAlmostEqual(manager.schedule.loc[td,'tax'],atv,4)
 
+	#every tax and credit works from the manager's period codes
+	self.assertTrue(manager.taxes['fed'].periods is manager.taxes['fed2'].periods is manager.credits['ITC'].periods)
+
     def testAggregateTaxesOneDDeduction(self):
 	"""TaxManager should correctly aggregate the taxes and return a tax column"""
 
@@ -803,6 +806,31 @@ class TaxManagerTests(unittest.TestCase):
 	self.assertAlmostEqual(manager.schedule.loc[dt.datetime(2015,01,01),'fed1_tax'], 4773.869,2)
 	self.assertAlmostEqual(manager.schedule.loc[dt.datetime(2015,01,01),'fed2_tax'], 2261.307,2)
 	self.assertAlmostEqual(manager.schedule.loc[dt.datetime(2015,01,01),'tax'],4773.869+2261.307,2)
+	self.assertEqual(manager.solve_info, [{'taxes':['fed1', 'fed2'], 'method':'linear', 'builds':2}])
+
+    def testSolveOrder(self):
+	"""Deductible taxes are built after the taxes they deduct, and nonlinear cycles are iterated to a fixed point"""
+	dates = pd.date_range(dt.datetime(2015,01,01), dt.datetime(2016,12,31), freq = 'D')
+	b = df.DataFrame({'income':np.linspace(50.0, 150.0, len(dates))}, index = dates)
+	manager = pf.TaxManager(revenue = b)
+	manager.create_tax(kind = 'GraduatedFractional', revenue = '_income', name = 'fed', rate = {0.0:0.1, 25000.0:0.25, 35000.0:0.35})
+	manager.create_tax(kind = 'Fractional', revenue = '_income', name = 'state', rate = 0.06)
+	manager.create_tax(kind = 'Fractional', revenue = '_income', name = 'city', rate = 0.01)
+	manager.associate_deductible_taxes('fed', ['state'])
+	manager.associate_deductible_taxes('state', ['fed'])
+	manager.associate_deductible_taxes('city', ['fed', 'state'])
+	manager.build_tax_schedule()
+	self.assertEqual([(i['taxes'], i['method']) for i in manager.solve_info], [(['fed', 'state'], 'iterative'), (['city'], 'direct')])
+
+	#the result is a fixed point: rebuilding each tax on the others' final schedules changes nothing
+	for tax in ['fed', 'state']:
+	    other = {'fed':'state', 'state':'fed'}[tax]
+	    manager.taxes[tax].deductions[other] = manager.schedule['%s_tax' % other]
+	    manager.taxes[tax].build_tax_schedule()
+	    self.assertTrue((np.absolute(manager.taxes[tax].schedule['tax'] - manager.schedule['%s_tax' % tax]) < 0.01).all())
+
+	manager.max_iterations = 1
+	self.assertRaises(pf.TaxManagerError, manager.build_tax_schedule)
 
 
 
@@ -0,0 +1,169 @@
+"""tax_tools.py
+Array kernels for the annual tax calculations, shared by the Tax classes and batched (scenario x year) Monte Carlo runs
+"""
+
+import numpy as np
+from pf_errors import *
+
+
+#Columns of the loss ledger, each an array the shape of the income
+ledger_columns = ['loss', 'carried_back', 'carryback_absorbed', 'carryforward_used', 'expired', 'balance']
+
+
+def _fifo(available, amount):
+    """Takes amount (per scenario) from the columns of available, first column first; returns the amount taken from each"""
+    taken = np.minimum(np.cumsum(available, axis = 1), amount[:, np.newaxis])
+    taken[:, 1:] -= taken[:, :-1].copy()
+    return taken
+
+
+def carry_losses(income, carryover_years = 10, carryback_years = 2):
+    """Applies net operating loss carryback and carryforward to consecutive years of taxable income.
+
+    income is an array of annual taxable income, or a (scenario x year) matrix whose scenarios are all carried at once.
+    A year's loss is first carried back against the positive income of the carryback_years before it, oldest year
+    first, then carried forward against the income of the next carryover_years, oldest loss first; whatever is left
+    after that expires.  Returns (adjusted income, ledger): the adjusted income is never negative, and the ledger maps
+    each of ledger_columns to an array the shape of income:
+        loss                the loss generated in the year
+        carried_back        the part of the year's loss used against earlier years
+        carryback_absorbed  the year's income offset by losses carried back from later years
+        carryforward_used   the year's income offset by losses carried forward from earlier years
+        expired             the loss that expired unused at the end of the year
+        balance             the unused loss carried into the next year
+    """
+    for (name, v) in (('carryover_years', carryover_years), ('carryback_years', carryback_years)):
+        if not isinstance(v, (int, long)) or v < 0:
+            raise BadTaxInputError, "%s must be a non-negative integer, got %s" % (name, v)
+    income = np.array(income, dtype = float)
+    if income.ndim not in (1, 2):
+        raise BadTaxInputError, "Income must be a vector of years or a (scenario x year) matrix"
+
+    x = income if income.ndim == 2 else income[np.newaxis, :]
+    ledger = dict((c, np.zeros(x.shape)) for c in ledger_columns)
+    pool = np.zeros(x.shape)				#unused loss, by year of origin
+    for t in range(x.shape[1]):
+        loss = np.maximum(-x[:, t], 0.0)
+        x[:, t] += loss
+        ledger['loss'][:, t] = loss
+
+        lo = max(0, t - carryback_years)
+        if lo < t and loss.any():
+            absorbed = _fifo(x[:, lo:t], loss)
+            x[:, lo:t] -= absorbed
+            ledger['carryback_absorbed'][:, lo:t] += absorbed
+            ledger['carried_back'][:, t] = absorbed.sum(axis = 1)
+
+        lo = max(0, t - carryover_years)
+        if lo < t and pool[:, lo:t].any():
+            used = _fifo(pool[:, lo:t], x[:, t])
+            pool[:, lo:t] -= used
+            ledger['carryforward_used'][:, t] = used.sum(axis = 1)
+            x[:, t] = np.maximum(x[:, t] - ledger['carryforward_used'][:, t], 0.0)
+
+        pool[:, t] = loss - ledger['carried_back'][:, t]
+        if t >= carryover_years:
+            ledger['expired'][:, t] = pool[:, t - carryover_years]
+            pool[:, t - carryover_years] = 0.0
+        ledger['balance'][:, t] = pool[:, max(0, t - carryover_years + 1):t + 1].sum(axis = 1)
+
+    #x is a view of income, so income now holds the adjusted values
+    np.maximum(income, 0.0, out = income)
+    return (income, dict((c, v.reshape(income.shape)) for (c, v) in ledger.items()))
+
+
+class BracketTable(object):
+    """The thresholds and rates of a graduated rate dict ({threshold:rate, ...}), with the tax accumulated by each threshold.
+
+    The tax on any income is then one searchsorted for its bracket plus the partial amount within it, so incomes of any
+    shape -- a year's schedule or a (scenario x year) batch -- are taxed at once.  The arrays are read-only, since the
+    tables are shared."""
+
+    def __init__(self, rate):
+        if not rate:
+            raise BadTaxInputError, "A bracket table needs at least one threshold:rate pair"
+        self.thresholds = np.array(sorted(rate), dtype = float)
+        self.rates = np.array([rate[k] for k in sorted(rate)], dtype = float)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(np.diff(self.thresholds)*self.rates[:-1])))
+        for a in (self.thresholds, self.rates, self.cumulative):
+            a.setflags(write = False)
+
+    def bracket(self, income):
+        """Index of the highest threshold at or below each income; -1 below the first threshold"""
+        return np.searchsorted(self.thresholds, income, side = 'right') - 1
+
+    def fractional_tax(self, income):
+        """Tax at the marginal rates of the brackets; income below the first threshold is taxed at the first rate"""
+        income = np.asarray(income, dtype = float)
+        k = np.maximum(self.bracket(income), 0)
+        return self.cumulative[k] + (income - self.thresholds[k])*self.rates[k]
+
+    def fixed_tax(self, income):
+        """The flat amount of the bracket each income falls in; nothing below the first threshold"""
+        k = self.bracket(np.asarray(income, dtype = float))
+        return np.where(k >= 0, self.rates[np.maximum(k, 0)], 0.0)
+
+
+_bracket_tables = {}
+bracket_table_size = 256
+
+def bracket_table(rate):
+    """Returns the shared BracketTable for a rate dict; tables are keyed by the dict's contents, so a dict changed in place
+    gets a new table"""
+    key = tuple(sorted(rate.items()))
+    table = _bracket_tables.get(key)
+    if table is None:
+        if len(_bracket_tables) >= bracket_table_size:
+            _bracket_tables.clear()
+        table = _bracket_tables[key] = BracketTable(rate)
+    return table
+
+
+def dependency_order(dependencies):
+    """Groups the nodes of a {node:[nodes it depends on], ...} graph into strongly connected components, returned in an
+    order where every component comes after the components it depends on.  A component of more than one node, or of a
+    node that depends on itself, is a cycle that has to be solved together."""
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for dep in dependencies.get(node, []):
+            if dep not in index:
+                visit(dep)
+                low[node] = min(low[node], low[dep])
+            elif dep in on_stack:
+                low[node] = min(low[node], index[dep])
+        if low[node] == index[node]:
+            component = []
+            while True:
+                n = stack.pop()
+                on_stack.discard(n)
+                component.append(n)
+                if n == node:
+                    break
+            components.append(sorted(component))
+
+    for node in sorted(dependencies):
+        if node not in index:
+            visit(node)
+    return components
+
+
+def extrapolate(x0, x1, x2):
+    """Aitken extrapolation of three successive iterates of a vector sequence that converges geometrically; returns the
+    estimated limit, or None if the steps are not shrinking"""
+    d0 = x1 - x0
+    d1 = x2 - x1
+    denominator = np.dot(d0, d0)
+    if denominator == 0.0:
+        return None
+    ratio = np.dot(d1, d0)/denominator
+    if not -1.0 < ratio < 1.0:
+        return None
+    return x2 + d1*ratio/(1.0 - ratio)
@@ -0,0 +1,91 @@
+"""tax_tools_tests.py
+Unit tests for the annual tax array kernels
+"""
+
+import unittest
+import tax_tools as tt
+import numpy as np
+from pf_errors import *
+
+
+class CarryLossesTests(unittest.TestCase):
+
+    def testCarryLosses(self):
+        """Losses are carried back oldest year first, then forward oldest loss first, and expire after the carryover years"""
+        income = [50.0, 30.0, -100.0, 10.0, -40.0, 25.0, 5.0, 100.0]
+        (adjusted, ledger) = tt.carry_losses(income, carryover_years = 2, carryback_years = 1)
+        self.assertEqual(list(adjusted), [50.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 100.0])
+        self.assertEqual(list(ledger['loss']), [0.0, 0.0, 100.0, 0.0, 40.0, 0.0, 0.0, 0.0])
+        self.assertEqual(list(ledger['carried_back']), [0.0, 0.0, 30.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(list(ledger['carryback_absorbed']), [0.0, 30.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(list(ledger['carryforward_used']), [0.0, 0.0, 0.0, 10.0, 0.0, 25.0, 5.0, 0.0])
+        self.assertEqual(list(ledger['expired']), [0.0, 0.0, 0.0, 0.0, 60.0, 0.0, 10.0, 0.0])
+        self.assertEqual(list(ledger['balance']), [0.0, 0.0, 70.0, 60.0, 40.0, 15.0, 0.0, 0.0])
+        self.assertEqual(income[2], -100.0)
+
+        #no carryover at all just floors the income
+        (adjusted, ledger) = tt.carry_losses(income, carryover_years = 0, carryback_years = 0)
+        self.assertEqual(list(adjusted), list(np.maximum(income, 0.0)))
+        self.assertEqual(ledger['expired'].sum(), 140.0)
+
+    def testBatched(self):
+        """A (scenario x year) matrix is carried the same as each scenario on its own"""
+        income = np.random.RandomState(3).normal(0.0, 100.0, (50, 15))
+        (adjusted, ledger) = tt.carry_losses(income, carryover_years = 5, carryback_years = 2)
+        self.assertEqual(adjusted.shape, (50, 15))
+        self.assertEqual(ledger['balance'].shape, (50, 15))
+        for s in (0, 17, 49):
+            (row, row_ledger) = tt.carry_losses(income[s], carryover_years = 5, carryback_years = 2)
+            self.assertTrue(np.allclose(adjusted[s], row))
+            self.assertTrue(np.allclose(ledger['carryforward_used'][s], row_ledger['carryforward_used']))
+
+    def testBadInputs(self):
+        self.assertRaises(BadTaxInputError, tt.carry_losses, [1.0, -1.0], carryover_years = -1)
+        self.assertRaises(BadTaxInputError, tt.carry_losses, [1.0, -1.0], carryback_years = 1.5)
+        self.assertRaises(BadTaxInputError, tt.carry_losses, np.zeros((2, 2, 2)))
+
+
+class BracketTableTests(unittest.TestCase):
+
+    def testTaxes(self):
+        """Marginal and flat bracket taxes come from the table for incomes of any shape"""
+        table = tt.BracketTable({0.0:0.10, 100.0:0.20, 300.0:0.30})
+        self.assertEqual(list(table.cumulative), [0.0, 10.0, 50.0])
+        income = np.array([[-50.0, 0.0, 50.0], [100.0, 250.0, 1000.0]])
+        tax = table.fractional_tax(income)
+        self.assertEqual(tax.shape, (2, 3))
+        self.assertTrue(np.allclose(tax, [[-5.0, 0.0, 5.0], [10.0, 40.0, 260.0]]))
+        self.assertEqual(list(tt.BracketTable({10.0:1.0, 100.0:5.0}).fixed_tax([5.0, 10.0, 99.0, 1.0E6])), [0.0, 1.0, 1.0, 5.0])
+        self.assertRaises(ValueError, table.rates.__setitem__, 0, 0.5)
+        self.assertRaises(BadTaxInputError, tt.BracketTable, {})
+
+    def testSharedTables(self):
+        """Rate dicts with the same contents share one table, and changing a dict in place gets a new one"""
+        rate = {0.0:0.10, 100.0:0.20}
+        table = tt.bracket_table(rate)
+        self.assertTrue(tt.bracket_table(dict(rate)) is table)
+        rate[100.0] = 0.25
+        self.assertFalse(tt.bracket_table(rate) is table)
+        self.assertEqual(tt.bracket_table(rate).rates[1], 0.25)
+
+
+class SolveToolsTests(unittest.TestCase):
+
+    def testDependencyOrder(self):
+        """Cycles are grouped together, and every group comes after the groups it depends on"""
+        order = tt.dependency_order({'a':['b'], 'b':['a'], 'c':['a', 'd'], 'd':[], 'e':['e']})
+        self.assertEqual(sorted(order), [['a', 'b'], ['c'], ['d'], ['e']])
+        self.assertTrue(order.index(['c']) > order.index(['a', 'b']))
+        self.assertTrue(order.index(['c']) > order.index(['d']))
+
+    def testExtrapolate(self):
+        """A geometrically converging sequence extrapolates to its limit"""
+        limit = np.array([1.0, -2.0])
+        (x0, x1, x2) = [limit + 0.5**k*np.array([3.0, 1.0]) for k in range(3)]
+        self.assertTrue(np.allclose(tt.extrapolate(x0, x1, x2), limit))
+        self.assertEqual(tt.extrapolate(x0, x0, x0), None)
+        self.assertEqual(tt.extrapolate(x0, x1, x1 + 2.0*(x1 - x0)), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,8 @@
 """Unit conversion module for Python"""
 
 import numpy as np
-import itertools as it
-import copy
+from collections import namedtuple
+from cp_tools import LRUCache
 
 class UnitError(Exception):
     pass
@@ -22,6 +22,23 @@ class InconsistentUnitError(UnitError):
 class BadExponentError(UnitError):
     pass
 
+class DuplicateUnitError(UnitError):
+    pass
+
+
+#A unit in the registry: index is its dictionary in UnitConverter.units (or, for a derived unit, in derived_units), factor
+#its value in that dictionary, expansion the (unit, exponent) base units of a derived unit, and scale and dims its size in
+#base units and its dimension exponent vector
+UnitEntry = namedtuple('UnitEntry', ['index', 'factor', 'derived', 'expansion', 'scale', 'dims'])
+
+#Parsed unit strings, as tuples of (unit, exponent), and (from, to) pairs, as (scale, offset, dimension signature)
+parse_cache = LRUCache()
+conversion_cache = LRUCache()
+#Unit strings, as (scale, dimension vector) and as the (factor, unit string) of simplify_units
+vector_cache = LRUCache()
+simplify_cache = LRUCache()
+
+
 class UnitConverter:
     """This class converts arbitrary fundamental units from one to the other"""
 
@@ -51,6 +68,7 @@ class UnitConverter:
 
 
     units = [mass_dict, time_dict, length_dict, mole_dict, temperature_dict, money_dict, unity_dict]
+    base_unit_names = ['kg', 's', 'm', 'mol', 'K', '$', '1']		#the unit with a value of 1.0 in each dictionary above
     derived_units = [(energy_units, energy_dict),(pressure_units,pressure_dict),(volume_units,volume_dict),(power_units,power_dict)]
     derived_preferred_units = [energy_pref_u, pressure_pref_u, volume_pref_u, power_pref_u]
 
@@ -60,313 +78,236 @@ class UnitConverter:
     
     temp_units = ['R', 'C', 'K', 'F']
 
+    registry = None			#{unit symbol:UnitEntry}, built from the dictionaries above at import and on register_unit
+    _derived_order = None		#the derived units in the order simplify_units pulls them out of a unit
+
     def __init__(self):
         self.unit_list = []
 
 
     def simplify_units(self, unit):
-	"""Returns a reduced unit string for the given unit"""
+	"""Returns (factor, reduced unit string) for the given unit.  The unit is reduced to the net exponent of each base
+	unit, and then the derived units (J, Pa, L, W) that fit in it are pulled out, the largest first.  Base units are named
+	by the first one of their kind in the unit, and derived units by the last of their kind, or the preferred unit."""
+	if not isinstance(unit, basestring):
+	    raise BadCharacterError, "Either the to or from string given was not a string; it was of type %s" % type(unit)
+	return simplify_cache.get(unit, lambda: self._simplify(unit))
+
+    def _simplify(self, unit):
         parsed = self._parse_inputstr(unit)
-	#Now I have a list of (unit, exponent) tuples
-
-	#Strategy1: 
-	#Parse the string
-	#Determine the preferred units?  maybe?
-	#Shift the derived units to base units, tack onto the list
-	#File the list into base unit buckets
-	#Add the exponents
-	#Search for derived unit permutations among the derived unit set, rewrite in terms of those
-	#Recast in terms of preferred units
-	#Calculate the return factor
-
-
-        
-
 	if len(parsed) == 1:
             return (1.0,unit)
 
-	simplified_list = [0] * len(UnitConverter.units)
-	self.unit_names = [None] * len(UnitConverter.units)
-	dunit_names = copy.deepcopy(UnitConverter.derived_preferred_units)
-	found = False
-	for (u, exponent) in parsed:
-                    
-
-            for (base_units, unit_dict) in UnitConverter.derived_units:
-                for (key,value) in unit_dict.items():
-                    if u == key:
-                        found = True
-                        dunit_names[UnitConverter.derived_units.index((base_units,unit_dict))] = u	#uses the first derived unit it encounters as the preferred unit
-                        parsed_sub = self._parse_inputstr(base_units)
-                        for st, exponent2 in parsed_sub:
-                            parsed.append((st, float(exponent2)*float(exponent)))
-
-                if found == True:
-                    break
-
-            
-            for unit_dict in UnitConverter.units:
-                for (key, value) in unit_dict.items():
-                    if u == key:
-                        
-                        found = True
-                        simplified_list[UnitConverter.units.index(unit_dict)] += exponent
-			if self.unit_names[UnitConverter.units.index(unit_dict)] is None:
-			    self.unit_names[UnitConverter.units.index(unit_dict)] = u		#uses the first base unit it encounters as the natural unit -- can do the same above for derived units
-
-
-                        break
-                if found == True:
-                    break
-
-            if found == False:
-                raise UnitNotFoundError, "The unit %s is not in the database" % u
+        n = len(UnitConverter.units)
+        exponents = self.unit_vector(unit)[1].copy()
+        #name the base units by the first of their kind -- the ones written out, then the ones inside derived units
+        unit_names = [None] * n
+        dunit_names = list(UnitConverter.derived_preferred_units)
+        expansions = []
+        for (u, exponent) in parsed:
+            entry = self.registry[u]
+            if entry.derived:
+                dunit_names[entry.index] = u
+                expansions.extend(b for (b, e) in entry.expansion)
+            elif unit_names[entry.index] is None:
+                unit_names[entry.index] = u
+        for u in expansions:
+            if unit_names[self.registry[u].index] is None:
+                unit_names[self.registry[u].index] = u
+
+        derived_list = [0] * len(UnitConverter.derived_units)
+        found = True
+        while found:
             found = False
-
-	found = False
-
-	#Now we should have a list of the net exponents; it should be easy to write a new string for this
-	out_string = ""
-	for unit_dict in UnitConverter.units:
-	    if simplified_list[UnitConverter.units.index(unit_dict)] != 0:
-	        out_string += "%s^%s*" % (self.unit_names[UnitConverter.units.index(unit_dict)], simplified_list[UnitConverter.units.index(unit_dict)])
-        out_string = out_string[:-1]
-	#right now, this is where I'm stopping -- I can search for derived units when I have this working
-
-	#ok -- now we want to look for derived units
-	#the simplified_list contains [[exponent1],[exponent2],[exponent3],...] for the base units involved here
-	#if we iterate over the absolute value of the exponents, starting at the highest value from the first base unit, we can cover all combinations
-	#The combinations here are given by the itertools.combinations library, which we want to sort from longest to shortest
-	#We'll create all of the combinations, then sort them by the sum of their exponents.  That is what we'll do.
-	#[[4,1,0], [3,1,0], [2,1,0], [1,1,0], [4,0,0], ...]
-	
-        drv_list = [0] * len(UnitConverter.derived_units)
-        (simplified_list, derived_list) = self._find_derived_units(simplified_list, drv_list)
-
+            for (j, sign, dims) in UnitConverter._derived_order:
+                if self._fits(dims*sign, exponents):
+                    derived_list[j] += sign
+                    exponents -= dims*sign
+                    found = True
+                    break
 
         out_string = ""
-        for unit_dict in UnitConverter.units:
-            if simplified_list[UnitConverter.units.index(unit_dict)] != 0:
-                if unit_dict != UnitConverter.unity_dict:			#don't want it to pollute the output string with lots of 1's
-                    out_string += "%s^%s*" % (self.unit_names[UnitConverter.units.index(unit_dict)], int(simplified_list[UnitConverter.units.index(unit_dict)]))
-
-        for (base_unit, unit_dict) in UnitConverter.derived_units:
-            if derived_list[UnitConverter.derived_units.index((base_unit,unit_dict))] != 0:
-                out_string += "%s^%s*" % (dunit_names[UnitConverter.derived_units.index((base_unit,unit_dict))], int(derived_list[UnitConverter.derived_units.index((base_unit,unit_dict))]))
+        for (i, unit_dict) in enumerate(UnitConverter.units):
+            if exponents[i] != 0 and unit_dict is not UnitConverter.unity_dict:		#don't want it to pollute the output string with lots of 1's
+                out_string += "%s^%s*" % (unit_names[i], int(exponents[i]))
+        for (j, exponent) in enumerate(derived_list):
+            if exponent != 0:
+                out_string += "%s^%s*" % (dunit_names[j], int(exponent))
         out_string = out_string[:-1]
 
         if out_string == "":
             out_string = "1"		#the unity case
 	return (self.convert_units(1.0,unit,out_string),out_string)
 
-    def _find_derived_units(self, smp_list, drv_list):
-        """Determines whether a simplified unit expression in base units can be expressed in more complicated derived units.
-           Searches the most complex units first.  smp_list is a list of exponents for base units in the simplified expression,
-           ordered by the unit dictionary at the top.  Ordering is implicit.  drv_list is the list of exponents for derived
-           units in the new expression, ordered by its unit dictionary at the top, with implicit ordering.
-           Returns (smp_list,drv_list) tuple, with a new simplified list and derived list)"""
-        lsl = self._simp_list(smp_list)		#this will have the simplified list, now we need to organize it by exponential sum
-        lsl_d = {lsl.index(lsl_i):sum(lsl_i) for lsl_i in lsl}
-	lsl_s = sorted(lsl_d, key = lsl_d.get)		#this is the sorted list of indices in simplified_list -- we want to work it in reverse order
-        N = len(lsl_s) - 1
-        
-	while N >0:
-            #build the unit string
-            u_string = ""
-	    temp_list = lsl[lsl_s[N]]
-
-	    for unit_dict in UnitConverter.units:
-                i = UnitConverter.units.index(unit_dict)
-                if temp_list[i] != 0:
-                    u_string += "%s^%s*" % (self.unit_names[i], int(temp_list[i]*np.sign(smp_list[i])))
-            u_string = u_string[:-1]			#this should be the simplified unit string, now we'll test it against all of the base units in the derived dictionary
-            N -= 1
-	    
-	    
-	    for bu, dd in UnitConverter.derived_units:
-                try:
-                    self.convert_units(1.0, u_string, bu)	#this attempts to convert between the base unit in the derived dictionary and the subunit string
-                    #now strip out the derived unit from the simplified_list and tag the derived unit onto the new parsed list -- easier said than done
-		    ###!!!###
-                    #increment the derived unit by one
-                    drv_list[UnitConverter.derived_units.index((bu,dd))] += 1
-		    #parse the string to get the exponents
-                    dec = self._parse_inputstr(u_string)
-                    for (u,exponent) in dec:
-                        for unit_dict in UnitConverter.units:
-                            if u in unit_dict:
-                                smp_list[UnitConverter.units.index(unit_dict)] -= exponent
-                                break
-		                #return the list with the function called on itself with the shorter list
-                            #this should be safe -- base units should have already been vetted if I get here, so u should not NOT be in a unit_dict
-                    return self._find_derived_units(smp_list, drv_list)
-                except InconsistentUnitError:
-                    #flip it around
-                    try:
-                        self.convert_units(1.0, u_string, "(%s)^-1" % bu)
-                        drv_list[UnitConverter.derived_units.index((bu,dd))] -= 1
-                        dec = self._parse_inputstr(u_string)
-                        for (u,exponent) in dec:
-                            for unit_dict in UnitConverter.units:
-                                if u in unit_dict:
-                                    smp_list[UnitConverter.units.index(unit_dict)] -= exponent
-                                    break
-                        return self._find_derived_units(smp_list,drv_list)
-
-                    except InconsistentUnitError:
-                        pass
-        
-            #didn't find any derived units.  Just return the simplified list and the derived unit list
-
-        
-        return (smp_list, drv_list)    
-
-    def _simp_list(self, ll):
-        rlist = []
-
-
-        #need a base case here
-
-        if len(ll) == 1:
-            for j in range(0,int(abs(ll[0]))+1):
-                rlist.append([j])
-            return rlist
-    
-        #iterating case
-        
-        for i in range(0, int(abs(ll[0]))+1):       #if this were zero, it would skip it
-            sl = self._simp_list(ll[1:])		#want this to return a list of lists, with exponents at the appropriate location
-            for l in sl:
-                l.insert(0,i)
-            rlist.extend(sl)
-        
-        return rlist
-
-        
-    
-    def _derived_unit_replace(self, unit):
-        """Takes derived units (N, J, etc.) and replaces them with new text representing the fundamental units"""
-        #Search through the dictionary and see if the given unit is a derived unit
-        #Return text for the fundamental unit  #THIS IS NOT WORKING YET!!!!!!!!!!!!
-        if unit in UnitConverter.derived_units.keys():
-            return UnitConverter.derived_units[unit]
+    def _fits(self, dims, exponents):
+        """Whether a derived unit's (signed) dimension vector can be taken whole out of the exponents: each of its exponents
+        has the same sign as the unit's and is no larger than the whole part of it"""
+        for (d, e) in zip(dims, exponents):
+            if d != 0 and (d*e <= 0 or abs(d) > int(abs(e))):
+                return False
+        return True
+
+    def unit_vector(self, unit):
+        """Returns (scale, dimension vector) for a unit string: the size of the unit in base units (kg, s, m, mol, K, $),
+        not counting temperature zero points, and the exponent of each base unit.  The vectors add when units multiply."""
+        if not isinstance(unit, basestring):
+            raise BadCharacterError, "Either the to or from string given was not a string; it was of type %s" % type(unit)
+        return vector_cache.get(unit, lambda: self._unit_vector(unit))
+
+    def _unit_vector(self, unit):
+        scale = 1.0
+        dims = np.zeros(len(UnitConverter.units))
+        for (u, exponent) in self._parse_inputstr(unit):
+            try:
+                entry = self.registry[u]
+            except KeyError:
+                raise UnitNotFoundError, "The unit %s is not in the database" % u
+            scale *= np.power(entry.scale, float(exponent))
+            dims += entry.dims*exponent
+        dims.flags.writeable = False
+        return (scale, dims)
+
+    @classmethod
+    def rebuild_registry(cls):
+        """Rebuilds the registry from the unit dictionaries and clears the conversions cached from the old one"""
+        conv = cls()
+        n = len(cls.units)
+        registry = {}
+        for (i, unit_dict) in enumerate(cls.units):
+            dims = np.zeros(n)
+            if unit_dict is not cls.unity_dict:
+                dims[i] = 1.0
+            dims.flags.writeable = False
+            for (u, value) in unit_dict.items():
+                registry[u] = UnitEntry(i, value, False, (), 1.0/value, dims)
+        order = []
+        for (j, (base_units, unit_dict)) in enumerate(cls.derived_units):
+            expansion = tuple(conv._parse_inputstr(base_units))
+            dims = np.zeros(n)
+            scale = 1.0
+            for (u, exponent) in expansion:
+                dims += registry[u].dims*exponent
+                scale *= np.power(registry[u].scale, float(exponent))
+            dims.flags.writeable = False
+            for (u, value) in unit_dict.items():
+                registry[u] = UnitEntry(j, value, True, expansion, scale/value, dims)
+            order.append((j, 1, dims))
+            order.append((j, -1, dims))
+        #largest first, by the total of the exponents and then exponent by exponent, as the search over exponent combinations did
+        order.sort(key = lambda (j, sign, dims): (-np.abs(dims).sum(), tuple(-np.abs(dims)), j, -sign))
+        cls._derived_order = order
+        cls.registry = registry
+        for cache in (conversion_cache, vector_cache, simplify_cache):
+            cache.clear()
+
+    @classmethod
+    def register_unit(cls, symbol, factor, units):
+        """Adds a unit at runtime, given as factor of the new unit in one of units: register_unit('tonne', 0.001, 'kg') or
+        register_unit('bbl', 6.28981, 'm^3').  A unit of a single base unit joins that unit's dictionary, and any other
+        joins the derived units of the same dimensions -- or starts a new derived unit, which simplify_units will then use."""
+        if not isinstance(symbol, basestring) or symbol == "" or not all(c.isalpha() or c == '$' for c in symbol):
+            raise BadCharacterError, "Unit names can only contain alphabetical characters"
+        if symbol in cls.registry:
+            raise DuplicateUnitError, "The unit %s is already in the database" % symbol
+        try:
+            if not factor > 0.0:
+                raise UnitError, "The factor for %s must be positive" % symbol
+        except TypeError:
+            raise UnitError, "The factor for %s must be numeric" % symbol
+        (scale, dims) = cls().unit_vector(units)
+        if dims[cls.units.index(cls.temperature_dict)] != 0:
+            raise UnitError, "Temperature units cannot be registered, since they carry a zero point"
+
+        nonzero = np.flatnonzero(dims)
+        if len(nonzero) == 0:
+            cls.unity_dict[symbol] = factor/scale
+        elif len(nonzero) == 1 and dims[nonzero[0]] == 1.0:
+            cls.units[nonzero[0]][symbol] = factor/scale
         else:
-            return unit
+            for (base_units, unit_dict) in cls.derived_units:
+                (base_scale, base_dims) = cls().unit_vector(base_units)
+                if (base_dims == dims).all():
+                    unit_dict[symbol] = factor*base_scale/scale
+                    break
+            else:
+                base_units = "*".join("%s^%s" % (cls.base_unit_names[i], int(dims[i]) if dims[i] == int(dims[i]) else dims[i]) for i in nonzero)
+                cls.derived_units.append((base_units, {symbol:factor/scale}))
+                cls.derived_preferred_units.append(symbol)
+        cls.rebuild_registry()
 
     def convert_units(self, val, from_str, to_str):
+        (scale, offset, signature) = self.conversion(from_str, to_str)
+        if offset == 0.0:
+            return val * scale
+        return val * scale + offset
+
+    def conversion(self, from_str, to_str):
+        """Returns (scale, offset, dimension signature) for converting from_str to to_str: to = from*scale + offset, and the
+        signature is the exponent of each base unit dictionary.  Conversions are cached, so repeats are a dict lookup."""
+        for u in (from_str, to_str):
+            if not isinstance(u, basestring):
+                raise BadCharacterError, "Either the to or from string given was not a string; it was of type %s" % type(u)
+        return conversion_cache.get((from_str, to_str), lambda: self._conversion(from_str, to_str))
+
+    def _conversion(self, from_str, to_str):
         from_parsed = self._parse_inputstr(from_str)
         to_parsed = self._parse_inputstr(to_str)
         
         if len(from_parsed) == 1:
             if from_parsed[0][0] in UnitConverter.temp_units and from_parsed[0][1] == 1:
                 if to_parsed[0][0] in UnitConverter.temp_units and len(to_parsed) == 1 and to_parsed[0][1] == 1:
-                    ret_val = val - UnitConverter.non_abs_temp_factors[from_parsed[0][0]]
-                    ret_val = ret_val / UnitConverter.temperature_dict[from_parsed[0][0]]
-                    ret_val = ret_val * UnitConverter.temperature_dict[to_parsed[0][0]]
-                    ret_val = ret_val + UnitConverter.non_abs_temp_factors[to_parsed[0][0]]
-                    return ret_val
+                    #absolute temperatures: scale about absolute zero, then shift to the new zero
+                    scale = UnitConverter.temperature_dict[to_parsed[0][0]] / UnitConverter.temperature_dict[from_parsed[0][0]]
+                    offset = UnitConverter.non_abs_temp_factors[to_parsed[0][0]] - UnitConverter.non_abs_temp_factors[from_parsed[0][0]] * scale
+                    signature = [0] * len(UnitConverter.units)
+                    signature[UnitConverter.units.index(UnitConverter.temperature_dict)] = 1
+                    return (scale, offset, tuple(signature))
                 else:
                     raise InconsistentUnitError, "The units were not consistent for this temperature conversion"
             #Do nothing if it is not a direct temperature conversion; we could put gauge pressure conversions here, as well
 
-        found = False
-
         consistency_list = [0] * len(UnitConverter.units)
+        unity = UnitConverter.units.index(UnitConverter.unity_dict)
 
+        #divide by the from units and multiply by the to units; derived units add their base units to the end of the list
         factor = 1.0
-        for (unit, exponent) in from_parsed:
-            
-            
-            #Check if the unit is in the derived_unit dictionaries first
-
-            for (base_units, unit_dict) in UnitConverter.derived_units:
-                for (key,value) in unit_dict.items():
-                    if unit == key:
-                       
-                        factor = factor / np.power(value, float(exponent))
-                        found = True
-                        
-                        parsed_sub = self._parse_inputstr(base_units)
-                        for st, exponent2 in parsed_sub:
-                            from_parsed.append((st, float(exponent2)*float(exponent)))
-
-                if found == True:
-                    break
-
-            
-            for unit_dict in UnitConverter.units:
-                for (key, value) in unit_dict.items():
-                    if unit == key:
-                        factor = factor / np.power(value, float(exponent))
-                        found = True
-                        if unit_dict != UnitConverter.unity_dict:
-                            consistency_list[UnitConverter.units.index(unit_dict)] += exponent
-
-
-                        break
-                if found == True:
-                    break
-
-            if found == False:
-                raise UnitNotFoundError, "The unit %s is not in the database" % unit
-            found = False
-
-        
-
-        for (unit, exponent) in to_parsed:
-            
-            for (base_units, unit_dict) in UnitConverter.derived_units:
-                for (key,value) in unit_dict.items():
-                    if unit == key:
-                        
-                        factor = factor * np.power(value, float(exponent))
-                        found = True
-                        
-                        parsed_sub = self._parse_inputstr(base_units)
-                        for st, exponent2 in parsed_sub:
-                            to_parsed.append((st, float(exponent2)*float(exponent)))
-
-                if found == True:
-                    break
-
-            
-
-            for unit_dict in UnitConverter.units:
-                for (key, value) in unit_dict.items():
-                    if unit == key:
-                        factor = factor * np.power(value, float(exponent))
-                        found = True
-                        if unit_dict != UnitConverter.unity_dict:
-                            consistency_list[UnitConverter.units.index(unit_dict)] += -exponent
-                        break
-                if found == True:
-                    break
-
-
-            
-            if found == False:
-                raise UnitNotFoundError, "The unit %s is not in the database" % unit
-            found = False
-
-       
+        for (parsed, sign) in ((from_parsed, -1), (to_parsed, 1)):
+            for (unit, exponent) in parsed:
+                try:
+                    entry = self.registry[unit]
+                except KeyError:
+                    raise UnitNotFoundError, "The unit %s is not in the database" % unit
+                if sign < 0:
+                    factor = factor / np.power(entry.factor, float(exponent))
+                else:
+                    factor = factor * np.power(entry.factor, float(exponent))
+                if entry.derived:
+                    for (st, exponent2) in entry.expansion:
+                        parsed.append((st, float(exponent2)*float(exponent)))
+                elif entry.index != unity:
+                    consistency_list[entry.index] += -sign*exponent
+            if sign < 0:
+                signature = tuple(consistency_list)
 
         for checksum in consistency_list:
             if checksum != 0:
                 raise InconsistentUnitError, "The to and from units do not match"
 
-
-        
-        return val * factor
+        return (factor, 0.0, signature)
 
         
 
     def _parse_inputstr(self, i_string):
-        """Parser for arbitrary symbolic mathematical expressions of units"""
+        """Parser for arbitrary symbolic mathematical expressions of units.  Returns a new list of (unit, exponent) tuples,
+        which the caller is free to change; the parses themselves are cached."""
 
 	#first, make sure i_string is a string
 	if not isinstance(i_string, basestring):
 	    raise BadCharacterError, "Either the to or from string given was not a string; it was of type %s" % type(i_string)
 
+        return list(parse_cache.get(i_string, lambda: tuple(self._parse(i_string))))
+
+    def _parse(self, i_string):
         operators = ['*','/','^','(',')']
         number_sym = ['.', '-']
         parsed_units = []      
@@ -448,6 +389,8 @@ class UnitConverter:
             parsed_units.append((current_unit, current_exp))
         return parsed_units
 
+UnitConverter.rebuild_registry()
+
 if __name__ == '__main__':
    conv = UnitConverter()
    print "3 m^3 to L: %s" % conv.convert_units(3, 'm^3', 'L')
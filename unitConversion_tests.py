@@ -7,6 +7,7 @@ Chris Perkins
 
 import unitConversion as uc
 import unittest
+import threading
 
 
 class UnitConversionTests(unittest.TestCase):
@@ -62,6 +63,86 @@ class UnitConversionTests(unittest.TestCase):
         """UnitConverter should raise an error when the conversion is between incompatible units"""
 	conv = uc.UnitConverter()
 	self.assertRaises(uc.InconsistentUnitError, conv.convert_units, 1.0, "m", "kg")
+    def testCachedConversions(self):
+	"""Repeated conversions come from the caches, and callers get their own copy of a parse"""
+	conv = uc.UnitConverter()
+	uc.conversion_cache.clear()
+	self.assertAlmostEqual(conv.convert_units(100.0, 'C', 'F'), 212.0, 10)
+	self.assertAlmostEqual(conv.convert_units(-40.0, 'C', 'F'), -40.0, 10)
+	self.assertAlmostEqual(conv.convert_units(32.0, 'F', 'K'), 273.15, 10)
+	self.assertEqual((uc.conversion_cache.misses, uc.conversion_cache.hits), (2, 1))
+	(scale, offset, signature) = conv.conversion('kW*hr', 'MJ')
+	self.assertAlmostEqual(scale, 3.6, 10)
+	self.assertEqual(offset, 0.0)
+	self.assertEqual(signature, (1, -2, 2, 0, 0, 0, 0))
+
+	parsed = conv._parse_inputstr('kg/m^3')
+	parsed.append(('s', 1))
+	self.assertEqual(conv._parse_inputstr('kg/m^3'), [('kg', 1), ('m', -3.0)])
+
+	#failures are not cached
+	self.assertRaises(uc.InconsistentUnitError, conv.convert_units, 1.0, 'm', 'kg')
+	self.assertRaises(uc.InconsistentUnitError, conv.convert_units, 1.0, 'm', 'kg')
+
+	cache = uc.LRUCache(maxsize = 2)
+	for key in ('a', 'b', 'a', 'c'):
+	    cache.get(key, lambda: key)
+	self.assertEqual(list(cache._store.keys()), ['a', 'c'])
+
+    def testThreadedConversions(self):
+	"""Conversions from several threads at once all come out right"""
+	uc.conversion_cache.clear()
+	results = []
+	def work():
+	    conv = uc.UnitConverter()
+	    results.append(all(abs(conv.convert_units(2.0, 'kg/hr', 'lb/day') - 2.0*2.20462*24.0) < 1.0E-9 for i in range(200)))
+	threads = [threading.Thread(target = work) for i in range(8)]
+	for t in threads:
+	    t.start()
+	for t in threads:
+	    t.join()
+	self.assertEqual(results, [True]*8)
+	self.assertEqual(len(uc.conversion_cache), 1)
+
+    def testThreadedSimplification(self):
+	"""Simplifying different units on one shared converter from several threads keeps each thread's unit names apart"""
+	conv = uc.UnitConverter()
+	results = []
+	def work(unit, expected):
+	    results.append(all(conv._simplify(unit)[1] == expected for i in range(200)))
+	threads = [threading.Thread(target = work, args = pair) for pair in [('lb*ft/s', 'lb^1*s^-1*ft^1'), ('kg*m/s', 'kg^1*s^-1*m^1')]*4]
+	for t in threads:
+	    t.start()
+	for t in threads:
+	    t.join()
+	self.assertEqual(results, [True]*8)
+
+    def testRegisterUnits(self):
+	"""Units registered at runtime convert like the built in ones, and a unit of new dimensions becomes a derived unit"""
+	saved = [(d, dict(d)) for d in uc.UnitConverter.units + [d for (b, d) in uc.UnitConverter.derived_units]]
+	n_derived = len(uc.UnitConverter.derived_units)
+	conv = uc.UnitConverter()
+	try:
+	    uc.UnitConverter.register_unit('tonne', 0.001, 'kg')
+	    uc.UnitConverter.register_unit('bbl', 1.0/42.0, 'gal')
+	    uc.UnitConverter.register_unit('N', 1.0, 'kg*m/s^2')
+	    self.assertAlmostEqual(conv.convert_units(2.0, 'tonne', 'lb'), 4409.24, 6)
+	    self.assertAlmostEqual(conv.convert_units(1.0, 'bbl/day', 'gal/hr'), 1.75, 10)
+	    self.assertEqual(uc.UnitConverter.registry['bbl'].derived, True)
+	    self.assertAlmostEqual(conv.convert_units(3.0, 'N*m', 'J'), 3.0, 10)
+	    self.assertEqual(conv.simplify_units('kg*m/s^2*kg')[1], 'kg^1*N^1')
+	    self.assertRaises(uc.DuplicateUnitError, uc.UnitConverter.register_unit, 'lb', 1.0, 'kg')
+	    self.assertRaises(uc.UnitError, uc.UnitConverter.register_unit, 'mK', 1000.0, 'K')
+	    self.assertRaises(uc.UnitNotFoundError, uc.UnitConverter.register_unit, 'cubit', 1.0, 'canteloupe')
+	finally:
+	    for (d, contents) in saved:
+		d.clear()
+		d.update(contents)
+	    del uc.UnitConverter.derived_units[n_derived:]
+	    del uc.UnitConverter.derived_preferred_units[n_derived:]
+	    uc.UnitConverter.rebuild_registry()
+	self.assertRaises(uc.UnitNotFoundError, conv.convert_units, 1.0, 'tonne', 'kg')
+
 
 class UnitSimplificationTests(unittest.TestCase):
 
@@ -93,6 +174,19 @@ class UnitSimplificationTests(unittest.TestCase):
 	self.assertIn(s4[1],simp4)
 	self.assertIn(s5[1],simp5)
 
+    def testSimplificationByExponentVectors(self):
+	"""Units reduce through their exponent vectors, pulling out the largest derived units first, however large the exponents"""
+	conv = uc.UnitConverter()
+	(scale, dims) = conv.unit_vector('kW*hr')
+	self.assertAlmostEqual(scale, 3.6E6, 4)
+	self.assertEqual(list(dims), list(conv.unit_vector('J')[1]))
+	self.assertEqual(list(conv.unit_vector('kg*m/s')[1] + conv.unit_vector('m/s')[1]), list(dims))
+	self.assertEqual(conv.simplify_units('W*hr'), (3600.0, 'J^1'))
+	self.assertEqual(conv.simplify_units('gal*gal*gal'), (1.0, 'gal^3'))
+	self.assertEqual(conv.simplify_units('m^-3*kg/s^2/m^-2'), (1.0, 'Pa^1'))
+	self.assertEqual(conv.simplify_units('kg^12*m^24/s^36*mol'), (1.0, 'mol^1*W^12'))
+	self.assertRaises(uc.UnitNotFoundError, conv.unit_vector, 'canteloupe')
+
     def testNonsenseSimplificationInput(self):
 	"""UnitConverter should raise an error if a given unit string is nonsense"""
 	conv = uc.UnitConverter()